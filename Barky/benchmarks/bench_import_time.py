@@ -0,0 +1,94 @@
+"""
+Cold start benchmark: python -X importtime for importing the API module, plus the time the
+first create_app() takes to build the bus, each in a fresh interpreter.
+
+    cd Barky
+    PYTHONPATH=src python benchmarks/bench_import_time.py --budget-ms 800
+
+Exits with status 1 when the median import goes over --budget-ms or a module from --forbid
+is imported, so it can guard cold start time in CI.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+CREATE_APP = """
+import time
+start = time.perf_counter()
+from barkylib.api import create_app
+create_app()
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def import_times(module: str) -> dict:
+    """
+    Imports module in a new interpreter and returns {name: (self_us, cumulative_us)} from
+    the -X importtime report
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    times = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+
+    return times
+
+
+def create_app_time() -> float:
+    # run against a scratch database, config points at ../bookmarks.db
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = Path(tmp) / "run"
+        cwd.mkdir()
+        # the scratch directory must still find barkylib through a relative PYTHONPATH
+        path = [os.path.abspath(entry) for entry in os.environ.get("PYTHONPATH", "").split(os.pathsep) if entry]
+        result = subprocess.run(
+            [sys.executable, "-c", CREATE_APP], cwd=cwd, env=dict(os.environ, PYTHONPATH=os.pathsep.join(path)),
+            capture_output=True, text=True, check=True,
+        )
+
+    return float(result.stdout.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--module", default="barkylib.api.flaskapi")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--forbid", nargs="*", default=["requests", "flask_sqlalchemy", "redis"])
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    totals = [run[args.module][1] / 1000 for run in runs]
+    median = statistics.median(totals)
+
+    print(f"import {args.module}: median {median:.1f} ms, best {min(totals):.1f} ms over {args.repeat} runs")
+    print(f"create_app (import + bootstrap): {create_app_time():.1f} ms")
+    print(f"slowest modules by own time (last run):")
+    for name, (own, cumulative) in sorted(runs[-1].items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"  {own / 1000:8.1f} ms own {cumulative / 1000:8.1f} ms total  {name}")
+
+    failed = False
+    forbidden = sorted(name for name in runs[-1] if name.split(".")[0] in args.forbid)
+    if forbidden:
+        print(f"FAIL: imported at startup: {', '.join(forbidden)}")
+        failed = True
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"FAIL: median import {median:.1f} ms is over the {args.budget_ms:.1f} ms budget")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Micro-benchmark for bookmark serialization: the old inspect() based _asdict plus
+json.dumps(default=str) against the column accessor resolved at start_mappers time.
+
+    cd Barky
+    PYTHONPATH=src python benchmarks/bench_serialization.py --rows 100000
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import clear_mappers
+
+from barkylib.adapters.orm import start_mappers
+from barkylib.domain.models import Bookmark
+
+
+def legacy_asdict(bookmark):
+    return {c.key: getattr(bookmark, c.key) for c in inspect(bookmark).mapper.column_attrs}
+
+
+def legacy(bookmarks):
+    return [json.dumps(legacy_asdict(bookmark), default=str) for bookmark in bookmarks]
+
+
+def fast(bookmarks):
+    return [json.dumps(bookmark.to_dict()) for bookmark in bookmarks]
+
+
+def measure(fn, bookmarks, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(bookmarks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return len(bookmarks) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    clear_mappers()
+    start_mappers()
+
+    now = datetime.now()
+    bookmarks = [
+        Bookmark(id=i, title=f"title {i}", url=f"http://example{i}.com", notes=f"notes {i}",
+                 date_added=now, date_edited=now)
+        for i in range(args.rows)
+    ]
+
+    before = measure(legacy, bookmarks, args.repeat)
+    after = measure(fast, bookmarks, args.repeat)
+
+    print(f"rows:   {args.rows}")
+    print(f"before: {before:,.0f} rows/sec (inspect + json.dumps(default=str))")
+    print(f"after:  {after:,.0f} rows/sec (precomputed columns + isoformat)")
+    print(f"speedup: {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
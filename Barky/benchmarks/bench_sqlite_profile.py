@@ -0,0 +1,118 @@
+"""
+Mixed read/write throughput of the SQLite engine profiles: SQLite's defaults (rollback
+journal, synchronous=FULL) against the tuned profile from config.get_sqlite_engine_profile.
+
+Reader threads page through the table while writer threads add and edit bookmarks, each
+operation in a fresh session like an API request.
+
+    cd Barky
+    PYTHONPATH=src python benchmarks/bench_sqlite_profile.py --seconds 5 --readers 4 --writers 2
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from barkylib import config
+from barkylib.adapters import read_model
+from barkylib.adapters.orm import mapper_registry, start_mappers
+from barkylib.domain import commands
+from barkylib.services import handlers
+from barkylib.services.unit_of_work import SqlAlchemyUnitOfWork, create_sqlite_engine
+
+PROFILES = {
+    "default": dict(journal_mode="DELETE", synchronous="FULL", busy_timeout=5000),
+    "tuned": config.get_sqlite_engine_profile(),
+}
+
+
+def run(profile, seconds, readers, writers, seed):
+    path = os.path.join(tempfile.mkdtemp(), "bookmarks.db")
+    engine = create_sqlite_engine(f"sqlite:///{path}", **profile)
+    mapper_registry.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+
+    now = datetime.now()
+    uow = SqlAlchemyUnitOfWork(session_factory)
+    with uow:
+        uow.bookmarks.add_bulk([
+            dict(title=f"seed {i}", url=f"http://seed{i}.com", notes=None, date_added=now, date_edited=now)
+            for i in range(seed)
+        ])
+        # listings are served from the read model, seed it too or readers time empty pages
+        read_model.rebuild(uow.session.connection())
+        uow.commit()
+
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def reader():
+        done = 0
+        uow = SqlAlchemyUnitOfWork(session_factory)
+        while time.perf_counter() < stop:
+            cmd = commands.ListBookmarksCommand(order_by="id", limit=50)
+            handlers.list_bookmarks(cmd, uow)
+            assert len(cmd.bookmarks) == 50
+            done += 1
+        with lock:
+            counts["reads"] += done
+
+    def writer(number):
+        done = errors = 0
+        uow = SqlAlchemyUnitOfWork(session_factory)
+        while time.perf_counter() < stop:
+            try:
+                with uow:
+                    title = f"writer {number} {done}"
+                    uow.bookmarks.add_bulk([dict(
+                        title=title, url="http://example.com", notes=None,
+                        date_added=now, date_edited=now,
+                    )])
+                    uow.bookmarks.update_bulk([{"id": done % seed + 1, "notes": f"edit {done}"}])
+                    # keep the documents in step as the write handlers do
+                    uow.bookmarks.refresh_documents(titles=[title])
+                    uow.bookmarks.refresh_documents(ids=[done % seed + 1])
+                    uow.commit()
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts["writes"] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(number,)) for number in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    engine.dispose()
+    return {name: count / seconds for name, count in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=10000)
+    args = parser.parse_args()
+
+    start_mappers()
+    for name, profile in PROFILES.items():
+        result = run(profile, args.seconds, args.readers, args.writers, args.seed)
+        print(
+            f"{name:8} reads/sec: {result['reads']:9,.0f}  writes/sec: {result['writes']:9,.0f}"
+            f"  busy errors/sec: {result['errors']:,.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Benchmark suite for the repository, the message bus and the Flask routes, on synthetic datasets.
+
+Each size gets a fresh SQLite database seeded with that many bookmarks. Every benchmark runs
+--iterations timed calls after a short warm up and reports calls per second and the p50, p95
+and p99 latency of a call. --output writes the results as JSON; --baseline compares them
+against an earlier --output and exits with status 1 when a benchmark got slower by more than
+--tolerance (ops/sec down or p95 up).
+
+    cd Barky
+    PYTHONPATH=src python benchmarks/bench_suite.py --sizes 1000 10000 --output bench.json
+    PYTHONPATH=src python benchmarks/bench_suite.py --sizes 1000 10000 --baseline bench.json
+    PYTHONPATH=src python benchmarks/bench_suite.py --sizes 1000000 --only repository
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from barkylib import bootstrap, config
+from barkylib.adapters import read_model
+from barkylib.adapters.cache import make_cache
+from barkylib.adapters.orm import start_mappers
+from barkylib.domain import commands
+from barkylib.domain.models import Bookmark, url_hash
+from barkylib.services import handlers
+from barkylib.services.messagebus import MessageBus
+from barkylib.services.unit_of_work import SqlAlchemyUnitOfWork, create_sqlite_engine
+
+GROUPS = ("repository", "bus", "api")
+BATCH_SIZE = 100
+PAGE_SIZE = 50
+SEED_CHUNK_SIZE = 10000
+
+
+def percentile(sorted_values, fraction):
+    # nearest rank
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(group, name, size, call, iterations, warmup=5, **extra):
+    """
+    Times iterations calls of call(i) and returns the result row for them
+    """
+    for i in range(warmup):
+        call(-1 - i)
+
+    timings = list()
+    for i in range(iterations):
+        start = time.perf_counter()
+        call(i)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return dict(
+        group=group, name=name, size=size, iterations=iterations,
+        ops_per_sec=iterations / sum(timings),
+        p50_ms=percentile(timings, 0.50) * 1000,
+        p95_ms=percentile(timings, 0.95) * 1000,
+        p99_ms=percentile(timings, 0.99) * 1000,
+        **extra,
+    )
+
+
+def seed_row(index, now):
+    url = f"http://seed{index}.example.com/page"
+    return dict(
+        title=f"seed {index}", url=url, url_hash=url_hash(url), notes=f"seeded note {index % 97}",
+        date_added=now, date_edited=now,
+    )
+
+
+class Dataset:
+    """
+    A scratch database with size seeded bookmarks, ids 1 to size
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.directory = tempfile.mkdtemp(prefix="barky-bench-")
+        self.engine = create_sqlite_engine(
+            f"sqlite:///{os.path.join(self.directory, 'bookmarks.db')}", **config.get_sqlite_engine_profile()
+        )
+        self.session_factory = sessionmaker(bind=self.engine)
+        # creates the schema and runs the migrations
+        SqlAlchemyUnitOfWork(self.session_factory)
+
+        now = datetime.now()
+        for start in range(0, size, SEED_CHUNK_SIZE):
+            uow = SqlAlchemyUnitOfWork(self.session_factory, create_schema=False)
+            with uow:
+                uow.bookmarks.add_bulk([seed_row(index, now) for index in range(start, min(size, start + SEED_CHUNK_SIZE))])
+                uow.commit()
+        with self.engine.begin() as connection:
+            read_model.rebuild(connection)
+
+        self.counter = itertools.count()
+
+    def new_rows(self, count, prefix):
+        now = datetime.now()
+        return [
+            dict(title=f"{prefix} {number}", url=f"http://{prefix}{number}.example.com", notes=None,
+                 date_added=now, date_edited=now)
+            for number in itertools.islice(self.counter, count)
+        ]
+
+    def uow(self):
+        return SqlAlchemyUnitOfWork(self.session_factory, create_schema=False)
+
+    def close(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def bench_repository(dataset, iterations):
+    size = dataset.size
+    results = list()
+    added = list()
+
+    def add_many(_):
+        uow = dataset.uow()
+        with uow:
+            bookmarks = [Bookmark(id=None, **row) for row in dataset.new_rows(BATCH_SIZE, "added")]
+            uow.bookmarks.add_many(bookmarks)
+            uow.commit()
+            added.extend(bookmark.id for bookmark in bookmarks)
+
+    def find_all(_):
+        start = random.randint(0, max(0, size - PAGE_SIZE))
+        uow = dataset.uow()
+        with uow:
+            uow.bookmarks.find_all(select(Bookmark).where(Bookmark.id > start).order_by(Bookmark.id).limit(PAGE_SIZE))
+
+    def update_many(i):
+        start = random.randint(1, max(1, size - BATCH_SIZE))
+        uow = dataset.uow()
+        with uow:
+            uow.bookmarks.update_many([{"id": id, "notes": f"edited {i}"} for id in range(start, start + BATCH_SIZE)])
+            uow.commit()
+
+    def delete_many(_):
+        ids, added[:BATCH_SIZE] = added[:BATCH_SIZE], []
+        uow = dataset.uow()
+        with uow:
+            uow.bookmarks.delete_many([{"id": id} for id in ids])
+            uow.commit()
+
+    results.append(measure("repository", "add_many", size, add_many, iterations, batch=BATCH_SIZE))
+    results.append(measure("repository", "find_all", size, find_all, iterations, page=PAGE_SIZE))
+    results.append(measure("repository", "update_many", size, update_many, iterations, batch=BATCH_SIZE))
+    # deletes the rows add_many put in, warm up included
+    results.append(measure("repository", "delete_many", size, delete_many, iterations, batch=BATCH_SIZE))
+    return results
+
+
+@dataclass
+class NoopCommand(commands.Command):
+    pass
+
+
+class NoopUnitOfWork:
+    def collect_new_events(self):
+        return ()
+
+
+def bench_bus(dataset, iterations):
+    size = dataset.size
+    # the bus on its own: a handler that does nothing and a unit of work that holds nothing
+    noop_bus = MessageBus(
+        uow_factory=NoopUnitOfWork, event_handlers=dict(),
+        command_handlers={NoopCommand: lambda message, uow: None},
+    )
+    bus = bootstrap.bootstrap(
+        start_orm=False, uow=SqlAlchemyUnitOfWork(dataset.session_factory, create_schema=False),
+    )
+    uow = dataset.uow()
+
+    return [
+        measure("bus", "handle noop command", size, lambda _: noop_bus.handle(NoopCommand()), iterations * 10),
+        measure("bus", "handler GetBookmarksVersion (direct)", size,
+                lambda _: handlers.get_bookmarks_version(commands.GetBookmarksVersionCommand(), uow), iterations),
+        measure("bus", "handle GetBookmarksVersion", size,
+                lambda _: bus.handle(commands.GetBookmarksVersionCommand()), iterations),
+        measure("bus", "handle ListBookmarks page", size,
+                lambda _: bus.handle(commands.ListBookmarksCommand(order_by="id", limit=PAGE_SIZE)), iterations),
+    ]
+
+
+def bench_api(dataset, iterations):
+    from barkylib.api import create_app, flaskapi
+
+    size = dataset.size
+    # the app serves the seeded database rather than the configured one
+    flaskapi._bus = bootstrap.bootstrap(
+        uow=SqlAlchemyUnitOfWork(dataset.session_factory, create_schema=False),
+        cache=make_cache(**config.get_cache_settings()),
+    )
+    client = create_app().test_client()
+    added = list()
+
+    def check(response, *statuses):
+        if response.status_code not in statuses:
+            raise RuntimeError(f"{response.request.path} answered {response.status_code}: {response.data[:200]!r}")
+        return response
+
+    def random_id():
+        return random.randint(1, size)
+
+    def add(_):
+        row = dataset.new_rows(1, "api")[0]
+        check(client.post("/api/add", json=dict(title=row["title"], url=row["url"])), 201)
+        added.append(row["title"])
+
+    def delete(_):
+        title = added.pop()
+        id = check(client.get(f"/api/first/title/{title}/title"), 200).get_json()["id"]
+        check(client.get(f"/api/delete/{id}"), 200)
+
+    bulk_ids = list()
+
+    def delete_bulk(_):
+        if not bulk_ids:
+            with dataset.engine.connect() as connection:
+                bulk_ids.extend(connection.execute(
+                    select(Bookmark.id).where(Bookmark.title.like("bulk %")).order_by(Bookmark.id)
+                ).scalars())
+        ids, bulk_ids[:BATCH_SIZE] = bulk_ids[:BATCH_SIZE], []
+        check(client.post("/api/delete/bulk", json={"ids": ids}), 200)
+
+    etag = check(client.get("/api/one/1"), 200).headers["ETag"]
+    routes = [
+        ("GET /api/", lambda _: check(client.get("/api/"), 200)),
+        ("GET /api/one/<id>", lambda _: check(client.get(f"/api/one/{random_id()}"), 200)),
+        ("GET /api/one/<id> 304", lambda _: check(client.get("/api/one/1", headers={"If-None-Match": etag}), 304)),
+        ("GET /api/all?limit", lambda _: check(client.get(f"/api/all?limit={PAGE_SIZE}"), 200)),
+        ("GET /api/first/title/<value>/title",
+         lambda _: check(client.get(f"/api/first/title/seed {random_id() - 1}/title"), 200)),
+        ("GET /api/search", lambda _: check(client.get(f"/api/search?q=note&limit={PAGE_SIZE}"), 200)),
+        ("GET /api/duplicates", lambda _: check(client.get("/api/duplicates"), 200)),
+        ("GET /api/metrics", lambda _: check(client.get("/api/metrics"), 200, 404)),
+        ("POST /api/add", add),
+        ("POST /api/add/bulk", lambda _: check(client.post(
+            "/api/add/bulk", json=[dict(title=row["title"], url=row["url"]) for row in dataset.new_rows(BATCH_SIZE, "bulk")]
+        ), 201)),
+        ("POST /api/edit/<id>", lambda i: check(client.post(f"/api/edit/{random_id()}", json={"notes": f"api {i}"}), 201)),
+        ("PATCH /api/edit/bulk", lambda i: check(client.patch(
+            "/api/edit/bulk", json=[{"id": random_id(), "notes": f"bulk {i}"} for _ in range(BATCH_SIZE)]
+        ), 200)),
+        # these remove what the two adds put in
+        ("GET /api/delete/<id>", delete),
+        ("POST /api/delete/bulk", delete_bulk),
+    ]
+
+    results = [measure("api", name, size, call, iterations) for name, call in routes]
+    flaskapi.get_bus().shutdown()
+    flaskapi._bus = None
+    return results
+
+
+BENCHMARKS = dict(repository=bench_repository, bus=bench_bus, api=bench_api)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints how each result moved against the baseline and returns the regressions
+    """
+    previous = {(row["group"], row["name"], row["size"]): row for row in baseline["results"]}
+    regressions = list()
+    for row in results:
+        before = previous.get((row["group"], row["name"], row["size"]))
+        if before is None:
+            continue
+
+        speed = row["ops_per_sec"] / before["ops_per_sec"] - 1
+        p95 = row["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        regressed = speed < -tolerance or p95 > tolerance
+        print(
+            f"{'REGRESSION' if regressed else 'ok':10} {row['group']:10} {row['name']:40} {row['size']:>9,}"
+            f"  ops/sec {speed:+7.1%}  p95 {p95:+7.1%}"
+        )
+        if regressed:
+            regressions.append(row)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    start_mappers()
+
+    results = list()
+    for size in args.sizes:
+        start = time.perf_counter()
+        dataset = Dataset(size)
+        print(f"seeded {size:,} bookmarks in {time.perf_counter() - start:.1f}s")
+        try:
+            for group in args.only:
+                for row in BENCHMARKS[group](dataset, args.iterations):
+                    print(
+                        f"{row['group']:10} {row['name']:40} {row['size']:>9,}  {row['ops_per_sec']:10,.1f} ops/sec"
+                        f"  p50 {row['p50_ms']:8.3f}  p95 {row['p95_ms']:8.3f}  p99 {row['p99_ms']:8.3f} ms"
+                    )
+                    results.append(row)
+        finally:
+            dataset.close()
+
+    report = dict(
+        meta=dict(
+            created_at=datetime.now().isoformat(timespec="seconds"), python=platform.python_version(),
+            sqlite=sqlite3.sqlite_version, platform=platform.platform(), args=vars(args),
+        ),
+        results=results,
+    )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
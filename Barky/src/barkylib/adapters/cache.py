@@ -0,0 +1,335 @@
+"""
+Caches for bookmark reads, used by repository.CachingRepository: BookmarkCache lives in the
+process, SharedBookmarkCache in Redis so several worker processes share one warm cache.
+
+Entries are plain dict snapshots of bookmarks (never session bound objects). Single bookmarks
+are keyed by id, query results by the normalized statement plus a generation number; every
+invalidation bumps the generation, which drops all cached query results at once and stops
+loads that started before the write from storing stale rows.
+"""
+import hashlib
+import logging
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+class BookmarkCache:
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.generation = 0
+        # the bookmarks table version the entries belong to, see sync_version
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._loading = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_many(self, keys: list) -> list:
+        return [self.get(key) for key in keys]
+
+    def set(self, key: Hashable, value, generation: int) -> None:
+        """
+        Stores a value loaded while the cache was at the given generation, dropping it
+        when a write invalidated the cache in the meantime
+        """
+        self.set_many({key: value}, generation)
+
+    def set_many(self, values: dict, generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return
+
+            for key, value in values.items():
+                self._entries[key] = (self.clock() + self.ttl, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable, generation: int = None):
+        """
+        Returns the cached value or loads and stores it; concurrent misses on the same key
+        wait for the first thread's load instead of all hitting the database
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        generation = self.generation if generation is None else generation
+        with self._lock:
+            loading = self._loading.get(key)
+            leader = loading is None
+            if leader:
+                loading = self._loading[key] = threading.Event()
+
+        if not leader:
+            loading.wait()
+            value = self.get(key)
+            if value is not None:
+                return value
+            return loader()
+
+        try:
+            value = loader()
+            if value is not None:
+                self.set(key, value, generation)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+
+    def invalidate(self, ids: Optional[list] = None) -> None:
+        """
+        Drops the given bookmark ids and every cached query result, or everything when ids is None
+        """
+        with self._lock:
+            self.generation += 1
+            if ids is None:
+                self._entries.clear()
+            else:
+                for id in ids:
+                    self._entries.pop(("id", int(id)), None)
+
+    def sync_version(self, version: int) -> int:
+        """
+        Drops everything when the bookmarks table version moved since the last call, which
+        catches writes made by other processes that never invalidate this cache, and
+        returns the generation that goes with the version
+        """
+        with self._lock:
+            if version != self.version:
+                self.generation += 1
+                self._entries.clear()
+                self.version = version
+
+            return self.generation
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                size=len(self._entries),
+            )
+
+
+class SharedBookmarkCache:
+    """
+    BookmarkCache counterpart kept in Redis. The generation is a counter in Redis bumped by
+    every invalidation, and query keys include it, so one write retires the cached query
+    results of every worker at once. Values are pickled snapshots with a TTL.
+
+    Stores are checked and set atomically: set_many WATCHes the generation and writes in a
+    MULTI/EXEC that fails when an invalidation bumped it after the check, and invalidate bumps
+    the generation and deletes the id keys in one MULTI/EXEC.
+
+    Misses are stampede protected: the first worker takes a short SET NX lock and loads, the
+    others poll for its result for up to lock_wait seconds before loading themselves.
+
+    Reads and locks survive a Redis outage: the error is logged and counted, and the value is
+    loaded from the database as if it were a miss.
+    """
+
+    def __init__(
+        self,
+        client,
+        ttl: float = 60.0,
+        prefix: str = "barky:cache",
+        lock_ttl: float = 5.0,
+        lock_wait: float = 2.0,
+        poll_interval: float = 0.02,
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.poll_interval = poll_interval
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation_key(self) -> str:
+        return f"{self.prefix}:generation"
+
+    @property
+    def generation(self) -> int:
+        from redis.exceptions import RedisError
+
+        try:
+            return int(self.client.get(self.generation_key) or 0)
+        except RedisError:
+            self._failed("generation read")
+            # matches no stored generation, so set_many stores nothing loaded meanwhile
+            return -1
+
+    def _failed(self, operation: str) -> None:
+        logger.warning("shared cache %s failed, using the database", operation, exc_info=True)
+        with self._lock:
+            self.errors += 1
+
+    def redis_key(self, key: Hashable) -> str:
+        if isinstance(key, tuple) and len(key) == 2 and key[0] == "id":
+            # bookmarks by id are deleted one by one on invalidation, so their names are known
+            return f"{self.prefix}:id:{int(key[1])}"
+
+        return f"{self.prefix}:{hashlib.sha1(repr(key).encode()).hexdigest()}"
+
+    def get(self, key: Hashable):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: list) -> list:
+        """
+        Fetches all keys in one MGET round trip, None for the misses
+        """
+        from redis.exceptions import RedisError
+
+        if not keys:
+            return list()
+
+        try:
+            raw = self.client.mget([self.redis_key(key) for key in keys])
+        except RedisError:
+            self._failed("read")
+            raw = [None] * len(keys)
+        values = [None if value is None else pickle.loads(value) for value in raw]
+        with self._lock:
+            hits = sum(value is not None for value in values)
+            self.hits += hits
+            self.misses += len(values) - hits
+
+        return values
+
+    def set(self, key: Hashable, value, generation: int) -> None:
+        self.set_many({key: value}, generation)
+
+    def set_many(self, values: dict, generation: int) -> None:
+        from redis.exceptions import RedisError, WatchError
+
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.generation_key)
+                if int(pipe.get(self.generation_key) or 0) != generation:
+                    return
+
+                pipe.multi()
+                for key, value in values.items():
+                    pipe.set(self.redis_key(key), pickle.dumps(value), px=int(self.ttl * 1000))
+                pipe.execute()
+            except WatchError:
+                # invalidated between the check and the write, the values may be stale
+                pass
+            except RedisError:
+                self._failed("store")
+
+    def get_or_load(self, key: Hashable, loader: Callable, generation: int = None):
+        from redis.exceptions import RedisError
+
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        generation = self.generation if generation is None else generation
+        lock = f"{self.redis_key(key)}:lock"
+        token = uuid.uuid4().hex
+        try:
+            locked = self.client.set(lock, token, nx=True, px=int(self.lock_ttl * 1000))
+        except RedisError:
+            self._failed("lock")
+            return loader()
+
+        if not locked:
+            deadline = time.monotonic() + self.lock_wait
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                value = self.get(key)
+                if value is not None:
+                    return value
+
+            # the loading worker is slow or gone, do not wait any longer
+            return loader()
+
+        try:
+            value = loader()
+            if value is not None:
+                self.set(key, value, generation)
+            return value
+        finally:
+            try:
+                if self.client.get(lock) == token.encode():
+                    self.client.delete(lock)
+            except RedisError:
+                # the lock expires after lock_ttl anyway
+                self._failed("unlock")
+
+    def sync_version(self, version: int) -> int:
+        # every process invalidates the one shared cache on its writes already
+        return self.generation
+
+    def invalidate(self, ids: Optional[Iterable] = None) -> None:
+        if ids is None:
+            names = list(self.client.scan_iter(match=f"{self.prefix}:id:*"))
+        else:
+            names = [self.redis_key(("id", id)) for id in ids]
+
+        pipe = self.client.pipeline(transaction=True)
+        pipe.incr(self.generation_key)
+        if names:
+            pipe.delete(*names)
+        pipe.execute()
+
+    def stats(self) -> dict:
+        with self._lock:
+            # evictions and size are up to the Redis server (maxmemory-policy)
+            return dict(hits=self.hits, misses=self.misses, evictions=None, size=None, errors=self.errors)
+
+
+def make_cache(maxsize: int, ttl: float, backend: str = "local"):
+    # a size of 0 turns caching off
+    if maxsize <= 0:
+        return None
+
+    if backend == "redis":
+        import redis
+
+        from barkylib import config
+
+        return SharedBookmarkCache(
+            redis.Redis(**config.get_redis_host_and_port(), **config.get_redis_timeouts()), ttl=ttl
+        )
+
+    return BookmarkCache(maxsize=maxsize, ttl=ttl)
@@ -0,0 +1,169 @@
+"""
+In-process metrics rendered in the Prometheus text format at /api/metrics.
+
+messagebus.MessageBus records every handled message (handler time, time spent in the
+repository, events emitted) and repository.MeteredRepository every repository call (queries,
+rows, time). With metrics turned off (BARKY_METRICS=0) neither is wired in, so nothing is
+timed or counted at all.
+"""
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Iterator, Sequence
+
+# seconds, from a cached read to a slow bulk write
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+@dataclass
+class QueryStats:
+    """
+    Running totals for one unit of work, see unit_of_work.SqlAlchemyUnitOfWork
+    """
+    queries: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence, le: str = None) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def lines(self) -> Iterator[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per bucket counts, sum, count], the counts are not cumulative
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * len(self.buckets), 0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *labels) -> int:
+        state = self.values.get(labels)
+        return 0 if state is None else state[2]
+
+    def lines(self) -> Iterator[str]:
+        with self.lock:
+            values = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self.values.items())
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield f"{self.name}_bucket{format_labels(self.labels, labels, format_value(bound))} {cumulative}"
+            yield f"{self.name}_bucket{format_labels(self.labels, labels, '+Inf')} {count}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(total)}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {count}"
+
+
+class Metrics:
+    """
+    The registry the bus and the repository report to, one per process
+    """
+
+    def __init__(self) -> None:
+        self.metrics = list()
+        self.messages = self.add(Counter(
+            "barky_messages_total", "Messages handled, by type, kind and outcome", ("type", "kind", "outcome"),
+        ))
+        self.handler_seconds = self.add(Histogram(
+            "barky_message_handler_seconds", "Time spent in a message handler", ("type",),
+        ))
+        self.db_seconds = self.add(Histogram(
+            "barky_message_db_seconds", "Time a message handler spent in repository calls", ("type",),
+        ))
+        self.events_emitted = self.add(Histogram(
+            "barky_message_events_emitted", "Events raised by one message handler", ("type",), COUNT_BUCKETS,
+        ))
+        self.api_errors = self.add(Counter(
+            "barky_api_errors_total", "API requests that failed, by endpoint and exception type", ("endpoint", "error"),
+        ))
+        self.queries = self.add(Counter(
+            "barky_repository_queries_total", "Repository calls that reached the database", ("method",),
+        ))
+        self.rows = self.add(Counter(
+            "barky_repository_rows_total", "Rows read or written by repository calls", ("method",),
+        ))
+        self.query_seconds = self.add(Histogram(
+            "barky_repository_query_seconds", "Time spent in a repository call", ("method",),
+        ))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def observe_message(self, type: str, kind: str, outcome: str, seconds: float, db_seconds: float, events: int) -> None:
+        self.messages.inc(type, kind, outcome)
+        self.handler_seconds.observe(seconds, type)
+        self.db_seconds.observe(db_seconds, type)
+        self.events_emitted.observe(events, type)
+
+    def observe_query(self, method: str, seconds: float, rows: int) -> None:
+        self.queries.inc(method)
+        self.rows.inc(method, amount=rows)
+        self.query_seconds.observe(seconds, method)
+
+    def render(self) -> str:
+        lines = list()
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.lines())
+
+        return "\n".join(lines) + "\n"
+
+
+def make_metrics(enabled: bool = True):
+    return Metrics() if enabled else None
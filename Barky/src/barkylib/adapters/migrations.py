@@ -0,0 +1,136 @@
+"""
+Versioned schema migrations, so databases created by older releases are upgraded in place.
+
+metadata.create_all only creates missing tables; it never changes a table that already
+exists. Every change to an existing table is a numbered step below. Applied steps are
+recorded in schema_migrations, and upgrade() runs the rest in order at startup. Steps must
+be idempotent, because a new database already gets the current schema from create_all.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+
+from barkylib.adapters import read_model
+from barkylib.adapters.orm import bookmark_documents, bookmarks, outbox, schema_migrations
+from barkylib.domain.models import url_hash
+
+logger = logging.getLogger(__name__)
+
+
+def create_indexes(connection, *names):
+    for index in bookmarks.indexes:
+        if index.name in names:
+            index.create(connection, checkfirst=True)
+
+
+def add_sort_and_filter_indexes(connection):
+    create_indexes(connection, "ix_bookmarks_date_added_id", "ix_bookmarks_date_edited_id", "ix_bookmarks_url")
+
+
+def add_full_text_search(connection):
+    """
+    FTS5 index over title, url and notes. It is an external content table, so the text is
+    not stored twice, and the triggers keep it in step with every write to bookmarks,
+    bulk statements included
+    """
+    if connection.dialect.name != "sqlite":
+        logger.warning("full text search needs SQLite FTS5, skipping")
+        return
+
+    statements = [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS bookmarks_fts USING fts5(
+            title, url, notes, content='bookmarks', content_rowid='id'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS bookmarks_fts_insert AFTER INSERT ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts (rowid, title, url, notes) VALUES (new.id, new.title, new.url, new.notes);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS bookmarks_fts_delete AFTER DELETE ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts (bookmarks_fts, rowid, title, url, notes)
+            VALUES ('delete', old.id, old.title, old.url, old.notes);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS bookmarks_fts_update AFTER UPDATE OF title, url, notes ON bookmarks BEGIN
+            INSERT INTO bookmarks_fts (bookmarks_fts, rowid, title, url, notes)
+            VALUES ('delete', old.id, old.title, old.url, old.notes);
+            INSERT INTO bookmarks_fts (rowid, title, url, notes) VALUES (new.id, new.title, new.url, new.notes);
+        END""",
+        # index the rows that are already there
+        "INSERT INTO bookmarks_fts (bookmarks_fts) VALUES ('rebuild')",
+    ]
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+
+
+def add_url_hash(connection, batch_size=1000):
+    """
+    Adds the indexed url_hash column and fills it in for the rows already there
+    """
+    if "url_hash" not in {column["name"] for column in inspect(connection).get_columns("bookmarks")}:
+        connection.exec_driver_sql("ALTER TABLE bookmarks ADD COLUMN url_hash VARCHAR(64)")
+    create_indexes(connection, "ix_bookmarks_url_hash")
+
+    stmt = update(bookmarks).where(bookmarks.c.id == bindparam("b_id")).values(url_hash=bindparam("b_url_hash"))
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(bookmarks.c.id, bookmarks.c.url)
+            .where(bookmarks.c.url_hash.is_(None), bookmarks.c.url.isnot(None), bookmarks.c.id > last_id)
+            .order_by(bookmarks.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        connection.execute(stmt, [dict(b_id=id, b_url_hash=url_hash(url)) for id, url in rows])
+        last_id = rows[-1].id
+
+
+def add_outbox(connection):
+    outbox.create(connection, checkfirst=True)
+
+
+def add_bookmark_documents(connection):
+    bookmark_documents.create(connection, checkfirst=True)
+    read_model.rebuild(connection)
+
+
+MIGRATIONS = [
+    (1, "indexes on date_added, date_edited and url", add_sort_and_filter_indexes),
+    (2, "full text search over title, url and notes", add_full_text_search),
+    (3, "url_hash column for duplicate detection", add_url_hash),
+    (4, "outbox table for event publishing", add_outbox),
+    (5, "bookmark_documents read model for listings", add_bookmark_documents),
+]
+
+
+def upgrade(engine) -> list[int]:
+    """
+    Applies the missing migrations in one transaction and returns their versions.
+
+    pysqlite only opens a transaction before DML, so on SQLite the write lock is taken with
+    BEGIN IMMEDIATE before schema_migrations is read: the DDL is covered too, and a worker
+    starting up concurrently waits for the first one and then finds nothing left to apply.
+    """
+    applied = list()
+    try:
+        with engine.begin() as connection:
+            if connection.dialect.name == "sqlite":
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+            done = set(connection.execute(select(schema_migrations.c.version)).scalars())
+            for version, description, step in MIGRATIONS:
+                if version in done:
+                    continue
+
+                logger.info("applying migration %s: %s", version, description)
+                step(connection)
+                connection.execute(
+                    insert(schema_migrations).values(version=version, description=description, applied_at=datetime.now())
+                )
+                applied.append(version)
+    except IntegrityError:
+        # another worker applied the same migrations first
+        logger.info("migrations were applied concurrently")
+        return list()
+
+    return applied
@@ -1,12 +1,12 @@
 import logging
 from typing import Text
 
-from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, event
+from sqlalchemy import DDL, Column, DateTime, Index, Integer, MetaData, String, Table, Text, event, inspect
 
 # from sqlalchemy.orm import mapper
 from sqlalchemy.orm import registry
 
-from barkylib.domain.models import Bookmark
+from barkylib.domain.models import Bookmark, url_hash
 
 logger = logging.getLogger(__name__)
 
@@ -33,13 +33,96 @@ bookmarks = Table(
     Column("notes", Text),
     Column("date_added", DateTime),
     Column("date_edited", DateTime),
+    # duplicate detection, computed from url on insert (see models.url_hash) and by update_bulk
+    Column("url_hash", String(64), default=lambda context: url_hash(context.get_current_parameters().get("url"))),
+    # filtering and keyset paging, see handlers.get_query; title is covered by its unique index
+    Index("ix_bookmarks_date_added_id", "date_added", "id"),
+    Index("ix_bookmarks_date_edited_id", "date_edited", "id"),
+    Index("ix_bookmarks_url", "url"),
+    Index("ix_bookmarks_url_hash", "url_hash"),
+)
+
+# bookmark columns that are kept out of the domain model and the API
+INTERNAL_COLUMNS = ("url_hash",)
+
+
+"""
+Change counter per table, bumped in the same transaction as every write so readers can
+tell whether anything changed (ETags / Last-Modified) with a single primary key lookup
+"""
+table_versions = Table(
+    "table_versions",
+    mapper_registry.metadata,
+    Column("name", String(64), primary_key=True),
+    Column("version", Integer, nullable=False),
+    Column("modified_at", DateTime),
+)
+
+"""
+Schema migrations applied to the database, see adapters.migrations
+"""
+schema_migrations = Table(
+    "schema_migrations",
+    mapper_registry.metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(255)),
+    Column("applied_at", DateTime),
+)
+
+"""
+Read model for listings (CQRS): one pre-serialized JSON document per bookmark next to the
+columns listings filter and sort on, kept in step with bookmarks by the command handlers in
+services.handlers in the same transaction as each write, see adapters.read_model
+"""
+bookmark_documents = Table(
+    "bookmark_documents",
+    mapper_registry.metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("title", String(255)),
+    Column("date_added", DateTime),
+    Column("date_edited", DateTime),
+    Column("document", Text, nullable=False),
+    Index("ix_bookmark_documents_title_id", "title", "id"),
+    Index("ix_bookmark_documents_date_added_id", "date_added", "id"),
+    Index("ix_bookmark_documents_date_edited_id", "date_edited", "id"),
+)
+
+"""
+Transactional outbox: events are written in the same transaction as the change that raised
+them (see unit_of_work.SqlAlchemyUnitOfWork) and published later by adapters.outbox.OutboxRelay
+"""
+outbox = Table(
+    "outbox",
+    mapper_registry.metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("event_type", String(255), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("published_at", DateTime),
+    # the relay reads the oldest unpublished events
+    Index("ix_outbox_published_at_id", "published_at", "id"),
+)
+
+event.listen(
+    table_versions,
+    "after_create",
+    DDL("INSERT INTO table_versions (name, version) VALUES ('bookmarks', 0)"),
 )
 
 
 def start_mappers():
+    # the app factory and tests may both get here, map once
+    if inspect(Bookmark, raiseerr=False) is not None:
+        return
+
     logger.info("string mappers")
     # SQLAlchemy 2.0
     bookmarks_mapper = mapper_registry.map_imperatively(Bookmark, bookmarks)
+    column_attrs = [attr for attr in bookmarks_mapper.column_attrs if attr.key not in INTERNAL_COLUMNS]
+    Bookmark.set_columns(
+        [attr.key for attr in column_attrs],
+        datetime_columns=[attr.key for attr in column_attrs if isinstance(attr.columns[0].type, DateTime)],
+    )
     # SQLAlchemy 1.3
     # bookmarks_mapper = mapper(Bookmark, bookmarks)
 
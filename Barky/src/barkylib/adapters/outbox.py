@@ -0,0 +1,199 @@
+"""
+Transactional outbox: unit_of_work.SqlAlchemyUnitOfWork stores every event raised by a
+handler in the outbox table in the same transaction as the change, and OutboxRelay publishes
+them afterwards in batches, one pipelined round trip to Redis per batch.
+
+A batch is read, published and then marked published (published_at set) in a short
+transaction of its own, so the SQLite write lock is never held while waiting on Redis. A
+failed publish leaves the batch for the next run, and a crash (or a second relay process)
+between publishing and marking can send a batch twice; every message carries its outbox id
+so consumers drop ids they have seen, which makes delivery exactly once for them. Published
+rows are deleted once they are older than the retention period.
+
+    cd Barky
+    PYTHONPATH=src python -m barkylib.adapters.outbox
+"""
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from dataclasses import asdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, insert, select, update
+
+from barkylib import config
+from barkylib.adapters.orm import outbox
+
+logger = logging.getLogger(__name__)
+
+
+def utcnow() -> datetime:
+    # naive UTC, like table_versions.modified_at
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+
+    return str(value)
+
+
+def write_events(connection, events: Iterable, now: datetime = None) -> int:
+    """
+    Inserts the events into the outbox with one executemany, on the caller's transaction
+    """
+    now = now or utcnow()
+    rows = [
+        dict(event_type=type(event).__name__, payload=json.dumps(asdict(event), default=encode_value), created_at=now)
+        for event in events
+    ]
+    if rows:
+        connection.execute(insert(outbox), rows)
+
+    return len(rows)
+
+
+class RedisPublisher:
+    """
+    Publishes a batch of (channel, message) pairs through one non transactional pipeline
+    """
+
+    def __init__(self, client) -> None:
+        self.client = client
+
+    def publish_batch(self, messages: list[tuple[str, str]]) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for channel, message in messages:
+            pipe.publish(channel, message)
+        pipe.execute()
+
+
+def make_redis_publisher() -> RedisPublisher:
+    import redis
+
+    return RedisPublisher(redis.Redis(**config.get_redis_host_and_port(), **config.get_redis_timeouts()))
+
+
+class OutboxRelay:
+    def __init__(
+        self,
+        session_factory,
+        publisher,
+        batch_size: int = 100,
+        retention: timedelta = timedelta(hours=24),
+        prune_interval: float = 60.0,
+    ) -> None:
+        self.session_factory = session_factory
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.retention = retention
+        self.prune_interval = prune_interval
+        # time.monotonic() of the last prune, see prune_if_due
+        self.pruned_at = None
+        # relays in one process take turns, so they do not publish the same batch
+        self._lock = threading.Lock()
+
+    def relay_once(self) -> int:
+        """
+        Publishes the oldest batch of unpublished events and returns how many were sent
+        """
+        with self._lock:
+            with self.session_factory() as session:
+                rows = session.execute(
+                    select(outbox.c.id, outbox.c.event_type, outbox.c.payload, outbox.c.created_at)
+                    .where(outbox.c.published_at.is_(None))
+                    .order_by(outbox.c.id)
+                    .limit(self.batch_size)
+                ).all()
+            if not rows:
+                return 0
+
+            # no transaction is open while Redis is waited on
+            self.publisher.publish_batch([
+                (row.event_type, json.dumps(dict(
+                    id=row.id, type=row.event_type, created_at=row.created_at.isoformat(),
+                    data=json.loads(row.payload),
+                )))
+                for row in rows
+            ])
+
+            with self.session_factory() as session:
+                session.execute(
+                    update(outbox)
+                    .where(outbox.c.id.in_([row.id for row in rows]), outbox.c.published_at.is_(None))
+                    .values(published_at=utcnow())
+                )
+                session.commit()
+
+        return len(rows)
+
+    def prune(self, now: datetime = None) -> int:
+        """
+        Deletes the events published longer than retention ago, returns how many
+        """
+        cutoff = (now or utcnow()) - self.retention
+        with self.session_factory() as session:
+            deleted = session.execute(
+                delete(outbox).where(outbox.c.published_at.isnot(None), outbox.c.published_at < cutoff)
+            ).rowcount
+            session.commit()
+
+        return deleted
+
+    def prune_if_due(self) -> int:
+        """
+        Prunes when prune_interval has passed since the last prune, returns how many were deleted
+        """
+        now = time.monotonic()
+        if self.pruned_at is not None and now - self.pruned_at < self.prune_interval:
+            return 0
+
+        self.pruned_at = now
+        return self.prune()
+
+    def relay_all(self) -> int:
+        """
+        Publishes until the outbox is empty and returns how many were sent, pruning too when due
+        so the in-process relay (handlers.publish_events) keeps the table bounded as well
+        """
+        relayed = 0
+        while True:
+            count = self.relay_once()
+            if not count:
+                break
+            relayed += count
+
+        self.prune_if_due()
+        return relayed
+
+    def run(self, interval: float = 1.0, stop: Optional[threading.Event] = None) -> None:
+        """
+        Relays until stop is set, sleeping for interval whenever the outbox is empty and
+        pruning old published events every prune_interval
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.prune_if_due()
+                if not self.relay_once():
+                    stop.wait(interval)
+            except Exception:
+                logger.exception("outbox relay failed, retrying")
+                stop.wait(interval)
+
+
+def main():
+    from barkylib.services.unit_of_work import get_default_session_factory
+
+    config.load_env()
+    logging.basicConfig(level=logging.INFO)
+    OutboxRelay(get_default_session_factory(), make_redis_publisher(), **config.get_outbox_settings()).run()
+
+
+if __name__ == "__main__":
+    main()
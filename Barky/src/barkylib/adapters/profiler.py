@@ -0,0 +1,110 @@
+"""
+SQL statement profiler hooked into the engine's before/after_cursor_execute events, see
+unit_of_work.create_sqlite_engine.
+
+Every statement is timed. Inside a profile() block (one per request in debug mode, see
+api.flaskapi) statements are counted and their timings kept, so an N+1 shows up as a
+statement count that grows with the data. Statements slower than slow_query_ms are logged
+together with their EXPLAIN QUERY PLAN whether or not a profile is active.
+"""
+from __future__ import annotations
+
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("barky_query_profile", default=None)
+
+
+@dataclass
+class QueryProfile:
+    """
+    Statements run while the profile was active, with their time in seconds
+    """
+    statements: int = 0
+    seconds: float = 0.0
+    timings: list = field(default_factory=list)
+    max_timings: int = 1000
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.statements += 1
+        self.seconds += seconds
+        if len(self.timings) < self.max_timings:
+            self.timings.append((statement, seconds))
+
+
+def start() -> tuple[QueryProfile, contextvars.Token]:
+    profile = QueryProfile()
+    return profile, _current.set(profile)
+
+
+def stop(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def profile() -> Iterator[QueryProfile]:
+    """
+    Profiles the statements this thread runs inside the block
+    """
+    query_profile, token = start()
+    try:
+        yield query_profile
+    finally:
+        stop(token)
+
+
+def explain(cursor, statement: str, parameters) -> Optional[str]:
+    # a cursor of its own, the statement's cursor may still have rows to hand out
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (list, tuple, dict)):
+        # executemany, the first row stands for all of them
+        parameters = parameters[0]
+    try:
+        plan_cursor = cursor.connection.cursor()
+        try:
+            rows = plan_cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters or ()).fetchall()
+        finally:
+            plan_cursor.close()
+    except Exception as e:
+        return f"unavailable: {e}"
+
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def instrument_engine(engine, slow_query_ms: Optional[float] = None, explain_slow_queries: bool = True):
+    """
+    Times every statement engine runs, records it on the active QueryProfile and logs the
+    ones that take slow_query_ms or longer
+    """
+    slow_query_seconds = None if slow_query_ms is None else slow_query_ms / 1000
+    explain_plans = explain_slow_queries and engine.dialect.name == "sqlite"
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # on the statement's own execution context, a statement that fails never reaches
+        # after_cursor_execute and leaves nothing behind on the connection
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context._query_start
+
+        query_profile = _current.get()
+        if query_profile is not None:
+            query_profile.record(statement, seconds)
+
+        if slow_query_seconds is not None and seconds >= slow_query_seconds:
+            plan = explain(cursor, statement, parameters) if explain_plans else None
+            logger.warning(
+                "slow query (%.1f ms): %s\nparameters: %.500r%s",
+                seconds * 1000, statement, parameters, f"\nplan:\n{plan}" if plan else "",
+            )
+
+    return engine
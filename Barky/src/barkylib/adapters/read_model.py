@@ -0,0 +1,87 @@
+"""
+Maintenance of the bookmark_documents read model (see orm.bookmark_documents): listings
+are served from it as ready made JSON, so a page is a concatenation of stored strings.
+
+Everything here runs on the caller's connection and transaction.
+"""
+import json
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, insert, select
+
+from barkylib.adapters.orm import INTERNAL_COLUMNS, bookmark_documents, bookmarks
+
+CHUNK_SIZE = 500
+SOURCE_COLUMNS = tuple(column for column in bookmarks.c if column.key not in INTERNAL_COLUMNS)
+
+
+def document_row(row) -> dict:
+    """
+    The read model row for a bookmarks row, the document is what the API returns for it
+    """
+    values = {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in row.items()
+    }
+    return dict(
+        id=row["id"],
+        title=row["title"],
+        date_added=row["date_added"],
+        date_edited=row["date_edited"],
+        document=json.dumps(values),
+    )
+
+
+def refresh(connection, ids: Optional[Iterable[int]] = None, titles: Optional[Iterable[str]] = None) -> int:
+    """
+    Rewrites the documents of the given bookmarks (by id or by title) from the bookmarks
+    table; ids that no longer exist lose their document
+    """
+    column, values = (bookmarks.c.id, ids) if ids is not None else (bookmarks.c.title, titles)
+    values = list(values or ())
+    written = 0
+    for i in range(0, len(values), CHUNK_SIZE):
+        chunk = values[i:i + CHUNK_SIZE]
+        rows = [
+            document_row(row)
+            for row in connection.execute(select(*SOURCE_COLUMNS).where(column.in_(chunk))).mappings()
+        ]
+        stale = chunk if ids is not None else [row["id"] for row in rows]
+        if stale:
+            connection.execute(delete(bookmark_documents).where(bookmark_documents.c.id.in_(stale)))
+        if rows:
+            connection.execute(insert(bookmark_documents), rows)
+        written += len(rows)
+
+    return written
+
+
+def prune(connection) -> int:
+    """
+    Drops documents whose bookmark is gone, for deletes that do not know their ids
+    """
+    stmt = delete(bookmark_documents).where(bookmark_documents.c.id.not_in(select(bookmarks.c.id)))
+    return connection.execute(stmt).rowcount
+
+
+def rebuild(connection, batch_size: int = 1000) -> int:
+    """
+    Recreates every document from the bookmarks table in id batches
+    """
+    connection.execute(delete(bookmark_documents))
+    written = 0
+    last_id = 0
+    while True:
+        rows = [
+            document_row(row)
+            for row in connection.execute(
+                select(*SOURCE_COLUMNS).where(bookmarks.c.id > last_id).order_by(bookmarks.c.id).limit(batch_size)
+            ).mappings()
+        ]
+        if not rows:
+            return written
+
+        connection.execute(insert(bookmark_documents), rows)
+        written += len(rows)
+        last_id = rows[-1]["id"]
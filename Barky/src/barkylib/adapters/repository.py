@@ -1,13 +1,16 @@
+import asyncio
 import json
+import time
 import traceback
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, timezone
 
 # making use of type hints: https://docs.python.org/3/library/typing.html
-from typing import List, Set
+from typing import Iterator, List, Set
 
-from barkylib.adapters.orm import mapper_registry
-from barkylib.domain.models import Bookmark
+from barkylib.adapters import read_model
+from barkylib.adapters.orm import INTERNAL_COLUMNS, mapper_registry, bookmarks as bookmarks_table, table_versions
+from barkylib.domain.models import Bookmark, url_hash
 from barkylib.domain import models
 from collections import UserDict
 
@@ -25,16 +28,24 @@ class AbstractRepository(ABC):
         raise NotImplementedError("Derived classes must implement add_many")
 
     @abstractmethod
-    def delete_one(bookmark) -> None:
+    def add_bulk(rows) -> int:
+        raise NotImplementedError("Derived classes must implement add_bulk")
+
+    @abstractmethod
+    def delete_one(bookmark) -> int:
         raise NotImplementedError("Derived classes must implement delete_one")
 
     @abstractmethod
-    def delete_many(bookmarks) -> None:
+    def delete_many(bookmarks) -> int:
         raise NotImplementedError("Derived classes must implement delete_many")
 
+    @abstractmethod
+    def delete_where(clause) -> int:
+        raise NotImplementedError("Derived classes must implement delete_where")
+
     @abstractmethod
     def get(self, id: int) -> Bookmark:
-        raise NotImplementedError("Derived classes must implement update")
+        raise NotImplementedError("Derived classes must implement get")
 
     @abstractmethod
     def update(bookmark) -> int:
@@ -44,6 +55,10 @@ class AbstractRepository(ABC):
     def update_many(bookmarks) -> int:
         raise NotImplementedError("Derived classes must implement update_many")
 
+    @abstractmethod
+    def update_bulk(bookmarks) -> int:
+        raise NotImplementedError("Derived classes must implement update_bulk")
+
     @abstractmethod
     def find_first(query) -> Bookmark:
         raise NotImplementedError("Derived classes must implement find_first")
@@ -52,9 +67,46 @@ class AbstractRepository(ABC):
     def find_all(query) -> list[Bookmark]:
         raise NotImplementedError("Derived classes must implement find_all")
 
+    @abstractmethod
+    def iter_rows(query, chunk_size) -> Iterator[dict]:
+        raise NotImplementedError("Derived classes must implement iter_rows")
+
+    @abstractmethod
+    def search(text, limit, offset) -> list[dict]:
+        raise NotImplementedError("Derived classes must implement search")
+
+    @abstractmethod
+    def find_existing_titles(titles) -> set[str]:
+        raise NotImplementedError("Derived classes must implement find_existing_titles")
+
+    @abstractmethod
+    def find_existing_url_hashes(hashes) -> set[str]:
+        raise NotImplementedError("Derived classes must implement find_existing_url_hashes")
+
+    @abstractmethod
+    def find_duplicate_urls() -> list[dict]:
+        raise NotImplementedError("Derived classes must implement find_duplicate_urls")
+
+    @abstractmethod
+    def find_documents(query) -> list[dict]:
+        raise NotImplementedError("Derived classes must implement find_documents")
+
+    @abstractmethod
+    def refresh_documents(ids, titles) -> int:
+        raise NotImplementedError("Derived classes must implement refresh_documents")
+
+    @abstractmethod
+    def prune_documents() -> int:
+        raise NotImplementedError("Derived classes must implement prune_documents")
+
+    @abstractmethod
+    def get_version(self) -> tuple[int, datetime]:
+        raise NotImplementedError("Derived classes must implement get_version")
+
 
 # sqlalchemy stuff
-from sqlalchemy import create_engine, select, update, delete
+from sqlalchemy import bindparam, create_engine, func, select, insert, update, delete
+from sqlalchemy import text as sql_text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import MetaData
 
@@ -63,8 +115,14 @@ class SqlAlchemyRepository(AbstractRepository):
     """
     Uses guidance from the basic SQLAlchemy 2.0 tutorial:
     https://docs.sqlalchemy.org/en/20/tutorial/index.html
+
+    Writes run in the session's current transaction, the unit of work commits them.
     """
 
+    IN_CHUNK_SIZE = 500
+    UPDATABLE_COLUMNS = ('title', 'url', 'notes', 'date_added', 'date_edited')
+    PROJECTED_COLUMNS = tuple(column for column in bookmarks_table.c if column.key not in INTERNAL_COLUMNS)
+
     def __init__(self, session, connection_string=None) -> None:
         super().__init__()
         self.Session = session
@@ -88,10 +146,6 @@ class SqlAlchemyRepository(AbstractRepository):
         # else:
         #     self.Session = sessionmaker(bind=self.engine)
 
-    def __del__(self):
-        self.Session.commit()
-        self.Session.close()
-
     def add_one(self, bookmark: Bookmark) -> None:
         bookmarks = list()
         if bookmark:
@@ -101,32 +155,57 @@ class SqlAlchemyRepository(AbstractRepository):
     def add_many(self, bookmarks: list[Bookmark]) -> None:
         if bookmarks:
             self.Session.add_all(bookmarks)
-            self.Session.commit()
+            self.Session.flush()
+            self.touch()
+
+    def add_bulk(self, rows: list[dict]) -> int:
+        """
+        Inserts plain column dicts with a single executemany, skipping object
+        construction and per-row flushes
+        """
+        if rows:
+            self.Session.execute(insert(Bookmark), rows)
+            self.touch()
 
-    def delete_one(self, bookmark: Bookmark) -> None:
+        return len(rows)
+
+    def delete_one(self, bookmark: Bookmark) -> int:
         bookmarks = list()
         if bookmark:
             bookmarks.append(bookmark)
 
-        self.delete_many(bookmarks)
+        return self.delete_many(bookmarks)
 
-    def delete_many(self, bookmarks: list[Bookmark]) -> None:
+    def delete_many(self, bookmarks: list[Bookmark]) -> int:
+        deleted = 0
         if bookmarks:
 
             ids = list()
             for bookmark in bookmarks:
-                try:
-                    ids.append(bookmark.id)
-                except Exception as e:
-                    ids.append(bookmark['id'])
+                ids.append(bookmark['id'] if isinstance(bookmark, dict) else bookmark.id)
+
+            # chunked so the IN list stays below the parameter limit
+            for i in range(0, len(ids), self.IN_CHUNK_SIZE):
+                stmt = delete(Bookmark).where(Bookmark.id.in_(ids[i:i + self.IN_CHUNK_SIZE]))
+                deleted += self.Session.execute(stmt).rowcount
+
+            if deleted:
+                self.touch()
+
+        return deleted
 
-            if ids:
-                stmt = delete(Bookmark).where(Bookmark.id.in_(ids))
-                self.Session.execute(stmt)
-                self.Session.commit()
+    def delete_where(self, clause) -> int:
+        # a single set based delete, the rows are never loaded
+        stmt = delete(Bookmark).where(clause).execution_options(synchronize_session=False)
+        deleted = self.Session.execute(stmt).rowcount
+        if deleted:
+            self.touch()
+
+        return deleted
 
     def get(self, id: int) -> Bookmark:
-        bookmark = self.find_first(select(Bookmark).where(Bookmark.id == id))
+        # primary key lookup, answered from the identity map when the row is already loaded
+        bookmark = self.Session.get(Bookmark, id)
         if bookmark:
             self.seen.add(bookmark)
 
@@ -144,39 +223,58 @@ class SqlAlchemyRepository(AbstractRepository):
         if bookmarks is None or not bookmarks:
             return 400
         else:
-            try:
-                for bookmark in bookmarks:
-                    bId = None
-
-                    try:
-                        bId = bookmark['id']
-                    except Exception as e:
-                        bId = bookmark.id
-
-                    if bId is not None:
-                        bmark = bookmark._asdict() if type(bookmark) is Bookmark else bookmark
-                        stmt = update(models.Bookmark).where(models.Bookmark.id == bId).values(bmark)
-                        self.Session.execute(stmt)
-                        self.Session.commit()
-                    if bId is None:
-                        raise Exception(f'No bookmark Id was found!')
-
-                return 200
-            except Exception as e:
-                print(e)
-                return 400
+            # a failure propagates, so the unit of work rolls the whole batch back instead of
+            # committing the statements that ran before it
+            self.update_bulk(bookmarks)
+            return 200
+
+    def update_bulk(self, bookmarks: list) -> int:
+        """
+        Updates bookmarks (mapped objects or dicts with an id). Rows that change the
+        same set of columns share one executemany UPDATE statement
+        """
+        groups = dict()
+        for bookmark in bookmarks:
+            if isinstance(bookmark, dict):
+                values = bookmark
+            else:
+                values = {column: getattr(bookmark, column) for column in ('id',) + self.UPDATABLE_COLUMNS}
+
+            if values.get('id') is None:
+                raise Exception(f'No bookmark Id was found!')
+            if 'url' in values:
+                values = dict(values, url_hash=url_hash(values['url']))
+
+            columns = tuple(column for column in self.UPDATABLE_COLUMNS + INTERNAL_COLUMNS if column in values)
+            params = {'b_' + column: values[column] for column in columns}
+            params['b_id'] = values['id']
+            groups.setdefault(columns, list()).append(params)
+
+        updated = 0
+        for columns, params in groups.items():
+            if not columns:
+                continue
+            stmt = (
+                update(bookmarks_table)
+                .where(bookmarks_table.c.id == bindparam('b_id'))
+                .values({column: bindparam('b_' + column) for column in columns})
+            )
+            updated += self.Session.execute(stmt, params).rowcount
+        if updated:
+            self.touch()
+
+        return updated
 
     def find_first(self, query) -> Bookmark:
         if query is None:
-            bookmarks = None
-        else:
-            bookmarks = self.find_all(query)
-
-        if bookmarks:
-            return bookmarks[0]
-        else:
             return None
 
+        bookmark = self.Session.scalars(query.limit(1)).first()
+        if bookmark:
+            self.seen.add(bookmark)
+
+        return bookmark
+
     def find_all(self, query) -> list[Bookmark]:
 
         query = select(Bookmark) if query is None else query
@@ -187,3 +285,364 @@ class SqlAlchemyRepository(AbstractRepository):
                 self.seen.add(bookmark)
 
         return bookmarks
+
+    def iter_rows(self, query, chunk_size: int = 1000) -> Iterator[dict]:
+        """
+        Read-only projection of a bookmark query: the columns are selected through Core and
+        come back as plain dicts, so no Bookmark is hydrated, tracked or added to seen. Rows
+        are fetched chunk_size at a time while being iterated, so memory stays flat however
+        many rows there are
+        """
+        stmt = self.projection(query).execution_options(yield_per=chunk_size)
+        for row in self.Session.connection().execute(stmt).mappings():
+            yield dict(row)
+
+    def projection(self, query):
+        query = select(Bookmark) if query is None else query
+        return query.with_only_columns(*self.PROJECTED_COLUMNS)
+
+    def search(self, text: str, limit: int = 20, offset: int = 0) -> list[dict]:
+        """
+        Full text search over title, url and notes through the bookmarks_fts index (see
+        migrations.add_full_text_search), best bm25 rank first. Every word has to match
+        """
+        terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+        if not terms:
+            return list()
+
+        columns = ", ".join(f"bookmarks.{column.name}" for column in self.PROJECTED_COLUMNS)
+        stmt = sql_text(
+            f"SELECT {columns} FROM bookmarks_fts "
+            "JOIN bookmarks ON bookmarks.id = bookmarks_fts.rowid "
+            "WHERE bookmarks_fts MATCH :match ORDER BY bm25(bookmarks_fts), bookmarks.id LIMIT :limit OFFSET :offset"
+        ).columns(*self.PROJECTED_COLUMNS)
+        result = self.Session.connection().execute(stmt, dict(match=" ".join(terms), limit=limit, offset=offset))
+        return [dict(row) for row in result.mappings()]
+
+    def find_documents(self, query) -> list[dict]:
+        """
+        Rows of the bookmark_documents read model, each with its ready made JSON document
+        """
+        return [dict(row) for row in self.Session.connection().execute(query).mappings()]
+
+    def refresh_documents(self, ids: list[int] = None, titles: list[str] = None) -> int:
+        return read_model.refresh(self.Session.connection(), ids=ids, titles=titles)
+
+    def prune_documents(self) -> int:
+        return read_model.prune(self.Session.connection())
+
+    def touch(self) -> None:
+        """
+        Bumps the bookmarks change counter inside the current transaction
+        """
+        stmt = (
+            update(table_versions)
+            .where(table_versions.c.name == 'bookmarks')
+            .values(version=table_versions.c.version + 1, modified_at=datetime.now(timezone.utc).replace(tzinfo=None))
+        )
+        self.Session.execute(stmt)
+
+    def get_version(self) -> tuple[int, datetime]:
+        """
+        Returns the bookmarks change counter and the UTC time of the last change
+        """
+        stmt = select(table_versions.c.version, table_versions.c.modified_at).where(table_versions.c.name == 'bookmarks')
+        row = self.Session.execute(stmt).first()
+        return (0, None) if row is None else tuple(row)
+
+    def find_existing_titles(self, titles: list[str]) -> set[str]:
+        return self.find_existing(bookmarks_table.c.title, titles)
+
+    def find_existing_url_hashes(self, hashes: list[str]) -> set[str]:
+        return self.find_existing(bookmarks_table.c.url_hash, hashes)
+
+    def find_existing(self, column, values) -> set:
+        existing = set()
+        values = list(values)
+        # chunked so the IN list stays well below the database parameter limit
+        for i in range(0, len(values), self.IN_CHUNK_SIZE):
+            chunk = values[i:i + self.IN_CHUNK_SIZE]
+            existing.update(self.Session.scalars(select(column).where(column.in_(chunk))))
+
+        return existing
+
+    def find_duplicate_urls(self) -> list[dict]:
+        """
+        Bookmarks whose urls have the same canonical form, grouped by it, in one query
+        """
+        duplicated = (
+            select(bookmarks_table.c.url_hash)
+            .where(bookmarks_table.c.url_hash.isnot(None))
+            .group_by(bookmarks_table.c.url_hash)
+            .having(func.count() > 1)
+        )
+        stmt = (
+            select(bookmarks_table.c.url_hash, bookmarks_table.c.id, bookmarks_table.c.title, bookmarks_table.c.url)
+            .where(bookmarks_table.c.url_hash.in_(duplicated))
+            .order_by(bookmarks_table.c.url_hash, bookmarks_table.c.id)
+        )
+
+        groups = list()
+        for row in self.Session.connection().execute(stmt):
+            if not groups or groups[-1]['url_hash'] != row.url_hash:
+                groups.append({'url_hash': row.url_hash, 'bookmarks': list()})
+            groups[-1]['bookmarks'].append({'id': row.id, 'title': row.title, 'url': row.url})
+
+        return groups
+
+
+class CachingRepository(AbstractRepository):
+    """
+    Read-through cache decorator around another repository: get, find_all and find_documents are
+    answered from a cache.BookmarkCache or cache.SharedBookmarkCache when possible, everything
+    else goes straight to the wrapped repository. Cached rows come back as new, session-less
+    Bookmark objects.
+    """
+
+    def __init__(self, repository: AbstractRepository, cache) -> None:
+        super().__init__()
+        self.repository = repository
+        self.cache = cache
+        self.seen = repository.seen
+
+    def add_one(self, bookmark: Bookmark) -> None:
+        return self.repository.add_one(bookmark)
+
+    def add_many(self, bookmarks: list[Bookmark]) -> None:
+        return self.repository.add_many(bookmarks)
+
+    def add_bulk(self, rows: list[dict]) -> int:
+        return self.repository.add_bulk(rows)
+
+    def delete_one(self, bookmark: Bookmark) -> int:
+        return self.repository.delete_one(bookmark)
+
+    def delete_many(self, bookmarks: list[Bookmark]) -> int:
+        return self.repository.delete_many(bookmarks)
+
+    def delete_where(self, clause) -> int:
+        return self.repository.delete_where(clause)
+
+    def get(self, id: int) -> Bookmark:
+        loaded = list()
+
+        def load():
+            bookmark = self.repository.get(id)
+            loaded.append(bookmark)
+            return None if bookmark is None else bookmark._asdict()
+
+        snapshot = self.cache.get_or_load(("id", int(id)), load)
+        if loaded:
+            # loaded by this call, hand out the session's own object
+            return loaded[0]
+
+        return None if snapshot is None else Bookmark(**snapshot)
+
+    def update(self, bookmark) -> int:
+        return self.repository.update(bookmark)
+
+    def update_many(self, bookmarks: list[Bookmark]) -> int:
+        return self.repository.update_many(bookmarks)
+
+    def update_bulk(self, bookmarks: list) -> int:
+        return self.repository.update_bulk(bookmarks)
+
+    def find_first(self, query) -> Bookmark:
+        # used for existence checks on the write path, so never served from the cache
+        return self.repository.find_first(query)
+
+    def find_all(self, query) -> list[Bookmark]:
+        query = select(Bookmark) if query is None else query
+        key = self.query_key(query)
+        loaded = list()
+
+        def load():
+            loaded.extend(self.repository.find_all(query))
+            return tuple(bookmark._asdict() for bookmark in loaded)
+
+        snapshots = self.cache.get_or_load(key, load, key[1])
+        if loaded or not snapshots:
+            return loaded
+
+        return [Bookmark(**snapshot) for snapshot in snapshots]
+
+    def iter_rows(self, query, chunk_size: int = 1000) -> Iterator[dict]:
+        return self.repository.iter_rows(query, chunk_size)
+
+    def search(self, text: str, limit: int = 20, offset: int = 0) -> list[dict]:
+        return self.repository.search(text, limit, offset)
+
+    def find_existing_titles(self, titles: list[str]) -> set[str]:
+        return self.repository.find_existing_titles(titles)
+
+    def find_existing_url_hashes(self, hashes: list[str]) -> set[str]:
+        return self.repository.find_existing_url_hashes(hashes)
+
+    def find_duplicate_urls(self) -> list[dict]:
+        return self.repository.find_duplicate_urls()
+
+    def find_documents(self, query) -> list[dict]:
+        """
+        A page is cached as its list of ids, the documents under their own keys so pages
+        that overlap share them; the documents of a cached page come back in one multi-get
+        """
+        key = ("documents",) + self.query_key(query)
+        generation = key[2]
+        loaded = list()
+
+        def load():
+            loaded.extend(self.repository.find_documents(query))
+            self.cache.set_many({("document", generation, row['id']): row for row in loaded}, generation)
+            return tuple(row['id'] for row in loaded)
+
+        ids = self.cache.get_or_load(key, load, generation)
+        if loaded or not ids:
+            return loaded
+
+        rows = self.cache.get_many([("document", generation, id) for id in ids])
+        if any(row is None for row in rows):
+            # some documents were evicted since the page was cached
+            return self.repository.find_documents(query)
+
+        return rows
+
+    def refresh_documents(self, ids: list[int] = None, titles: list[str] = None) -> int:
+        return self.repository.refresh_documents(ids, titles)
+
+    def prune_documents(self) -> int:
+        return self.repository.prune_documents()
+
+    def get_version(self) -> tuple[int, datetime]:
+        return self.repository.get_version()
+
+    def query_key(self, query) -> tuple:
+        # the same filter, value, sort and order always compile to the same SQL and parameters
+        compiled = query.compile()
+        params = tuple(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in sorted(compiled.params.items())
+        )
+        return "query", self.cache.generation, str(compiled), params
+
+
+class MeteredRepository(AbstractRepository):
+    """
+    Times and counts the calls that reach the wrapped repository: every call is a query in
+    metrics.Metrics and in the unit of work's metrics.QueryStats, with the rows it read or
+    wrote. It sits under CachingRepository, so cache hits are not counted.
+    """
+
+    def __init__(self, repository: AbstractRepository, metrics, stats) -> None:
+        super().__init__()
+        self.repository = repository
+        self.metrics = metrics
+        self.stats = stats
+        self.seen = repository.seen
+
+    def measure(self, method: str, call, rows=len):
+        start = time.perf_counter()
+        result = call()
+        self.record(method, time.perf_counter() - start, rows(result))
+        return result
+
+    def record(self, method: str, seconds: float, rows: int) -> None:
+        self.stats.queries += 1
+        self.stats.rows += rows
+        self.stats.seconds += seconds
+        self.metrics.observe_query(method, seconds, rows)
+
+    def add_one(self, bookmark: Bookmark) -> None:
+        return self.measure("add_one", lambda: self.repository.add_one(bookmark), lambda _: 1)
+
+    def add_many(self, bookmarks: list[Bookmark]) -> None:
+        return self.measure("add_many", lambda: self.repository.add_many(bookmarks), lambda _: len(bookmarks))
+
+    def add_bulk(self, rows: list[dict]) -> int:
+        return self.measure("add_bulk", lambda: self.repository.add_bulk(rows), int)
+
+    def delete_one(self, bookmark: Bookmark) -> int:
+        return self.measure("delete_one", lambda: self.repository.delete_one(bookmark), int)
+
+    def delete_many(self, bookmarks: list[Bookmark]) -> int:
+        return self.measure("delete_many", lambda: self.repository.delete_many(bookmarks), int)
+
+    def delete_where(self, clause) -> int:
+        return self.measure("delete_where", lambda: self.repository.delete_where(clause), int)
+
+    def get(self, id: int) -> Bookmark:
+        return self.measure("get", lambda: self.repository.get(id), lambda bookmark: int(bookmark is not None))
+
+    def update(self, bookmark) -> int:
+        # update and update_many answer with a status code, not a row count
+        return self.measure("update", lambda: self.repository.update(bookmark), lambda _: int(bookmark is not None))
+
+    def update_many(self, bookmarks: list[Bookmark]) -> int:
+        return self.measure("update_many", lambda: self.repository.update_many(bookmarks), lambda _: len(bookmarks or ()))
+
+    def update_bulk(self, bookmarks: list) -> int:
+        return self.measure("update_bulk", lambda: self.repository.update_bulk(bookmarks), int)
+
+    def find_first(self, query) -> Bookmark:
+        return self.measure("find_first", lambda: self.repository.find_first(query), lambda bookmark: int(bookmark is not None))
+
+    def find_all(self, query) -> list[Bookmark]:
+        return self.measure("find_all", lambda: self.repository.find_all(query))
+
+    def iter_rows(self, query, chunk_size: int = 1000) -> Iterator[dict]:
+        # rows are counted, and the time taken, as the caller consumes them
+        start = time.perf_counter()
+        seconds, count = 0.0, 0
+        try:
+            for row in self.repository.iter_rows(query, chunk_size):
+                seconds += time.perf_counter() - start
+                count += 1
+                yield row
+                start = time.perf_counter()
+            seconds += time.perf_counter() - start
+        finally:
+            self.record("iter_rows", seconds, count)
+
+    def search(self, text: str, limit: int = 20, offset: int = 0) -> list[dict]:
+        return self.measure("search", lambda: self.repository.search(text, limit, offset))
+
+    def find_existing_titles(self, titles: list[str]) -> set[str]:
+        return self.measure("find_existing_titles", lambda: self.repository.find_existing_titles(titles))
+
+    def find_existing_url_hashes(self, hashes: list[str]) -> set[str]:
+        return self.measure("find_existing_url_hashes", lambda: self.repository.find_existing_url_hashes(hashes))
+
+    def find_duplicate_urls(self) -> list[dict]:
+        return self.measure("find_duplicate_urls", lambda: self.repository.find_duplicate_urls())
+
+    def find_documents(self, query) -> list[dict]:
+        return self.measure("find_documents", lambda: self.repository.find_documents(query))
+
+    def refresh_documents(self, ids: list[int] = None, titles: list[str] = None) -> int:
+        return self.measure("refresh_documents", lambda: self.repository.refresh_documents(ids, titles), int)
+
+    def prune_documents(self) -> int:
+        return self.measure("prune_documents", lambda: self.repository.prune_documents(), int)
+
+    def get_version(self) -> tuple[int, datetime]:
+        return self.measure("get_version", lambda: self.repository.get_version(), lambda _: 1)
+
+
+class AsyncRepository:
+    """
+    Awaitable view of a synchronous repository: every method runs on a worker thread
+    (asyncio.to_thread) so blocking SQLite calls do not stall the event loop. Calls made
+    through one AsyncRepository are awaited one at a time, so its session is never used
+    by two threads at once.
+    """
+
+    def __init__(self, repository: AbstractRepository) -> None:
+        self.repository = repository
+        self.seen = repository.seen
+
+    def __getattr__(self, name):
+        method = getattr(self.repository, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
@@ -1,15 +1,24 @@
 import os
 
 from flask import Flask
-from .flaskapi import FlaskBookmarkAPI
 
-# init from dotenv file
-from dotenv import load_dotenv
+from barkylib import config
 
-load_dotenv()
+
+def __getattr__(name):
+    # flaskapi pulls in the whole service layer, import it only when it is asked for
+    if name == "FlaskBookmarkAPI":
+        from .flaskapi import FlaskBookmarkAPI
+
+        return FlaskBookmarkAPI
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def create_app(test_config=None):
+    # init from dotenv file
+    config.load_env()
+
     app = Flask(__name__)
 
     if test_config is None:
@@ -27,6 +36,9 @@ def create_app(test_config=None):
 
     from . import flaskapi
 
+    # engine, mappers and schema checks happen here once per process, not at import, and
+    # before the first request rather than during it
+    flaskapi.get_bus()
     app.register_blueprint(flaskapi.bp)
 
     return app
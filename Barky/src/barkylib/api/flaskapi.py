@@ -1,32 +1,80 @@
+import atexit
+import functools
+import itertools
 import json
-from datetime import datetime
-
-from barkylib import bootstrap
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from barkylib import bootstrap, config
+from barkylib.adapters.cache import make_cache
+from barkylib.adapters import profiler
+from barkylib.adapters.metrics import make_metrics
 from barkylib.services import unit_of_work, handlers
+from barkylib.services.dispatcher import make_dispatcher
 from barkylib.adapters.repository import *
 from barkylib.domain import commands
 
-# init from dotenv file
-from dotenv import load_dotenv
 from flask import (
     Blueprint,
+    Response,
+    current_app,
     flash,
     g,
+    make_response,
     redirect,
     render_template,
     request,
     session,
+    stream_with_context,
     url_for,
 )
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from werkzeug.exceptions import BadRequest
 from .baseapi import AbstractBookMarkAPI
 
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///bookmarks.db'
 # db = SQLAlchemy(app)
-bus = bootstrap.bootstrap()
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def make_relay():
+    from barkylib.adapters.outbox import OutboxRelay, make_redis_publisher
+
+    return OutboxRelay(
+        unit_of_work.get_default_session_factory(), make_redis_publisher(), **config.get_outbox_settings()
+    )
+
+
+def get_bus():
+    """
+    The process wide message bus, bootstrapped (engine, mappers, schema checks) on first
+    use so importing this module stays cheap, see api.create_app
+    """
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                dispatcher = make_dispatcher(**config.get_event_dispatch_settings())
+                if config.get_publish_events_enabled() and dispatcher is None:
+                    raise ValueError("BARKY_PUBLISH_EVENTS=1 needs BARKY_EVENT_WORKERS > 0")
+
+                bus = bootstrap.bootstrap(
+                    cache=make_cache(**config.get_cache_settings()),
+                    dispatcher=dispatcher,
+                    metrics=make_metrics(config.get_metrics_enabled()),
+                    read_session_factory=unit_of_work.get_default_read_session_factory(),
+                    relay=make_relay() if config.get_publish_events_enabled() else None,
+                )
+                # let background event handlers finish before the process exits
+                atexit.register(bus.shutdown, timeout=30)
+                _bus = bus
+
+    return _bus
 
 
 class FlaskBookmarkAPI(AbstractBookMarkAPI):
@@ -44,48 +92,149 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
     # @app.route("/api/one/<id>")
     def one(self, id):
         try:
+            cmd = commands.GetBookmarkCommand(id=id)
+            get_bus().handle(cmd)
 
-            bookmark = self.first(filter='id', value=id, sort='id')
-
-            if bookmark is None:
+            if cmd.bookmark is None:
                 return 'None found', 204
             else:
-                return bookmark
+                return cmd.bookmark
 
         except Exception as e:
-            print('one except')
-            print(e)
-            return str(e), 400
+            return self.error('one', e)
 
     # @app.route("/api/all")
     def all(self):
-        return self.many(filter=None, value=None, sort=None)
+        limit, cursor = self.get_page_args()
+        stream = request.args.get('stream')
+        if stream is not None:
+            if limit is not None or cursor is not None:
+                raise BadRequest('stream cannot be combined with limit or cursor')
+            return self.stream(
+                filter=None, value=None, sort=request.args.get('sort'),
+                order=request.args.get('order'), format=stream
+            )
+
+        return self.many(
+            filter=None, value=None, sort=request.args.get('sort'),
+            order=request.args.get('order'), limit=limit, cursor=cursor, as_json=True
+        )
 
     # @app.route("/api/first/<property>/<value>/<sort>")
     def first(self, filter, value, sort):
-        bookmarks = self.many(filter, value, sort)
-        if bookmarks:
-            return bookmarks[0]
+        limit, cursor = self.get_page_args()
+        if limit is not None or cursor is not None:
+            return self.many(
+                filter, value, sort, order=request.args.get('order'), limit=limit, cursor=cursor
+            )
+
+        # only the first row is needed, so let the database stop after it
+        bookmarks = self.many(filter, value, sort, order=request.args.get('order'), limit=1)
+        if isinstance(bookmarks, dict):
+            return bookmarks['bookmarks'][0] if bookmarks['bookmarks'] else ('None found', 204)
         else:
             return bookmarks
 
-    def many(self, filter, value, sort):
+    def many(self, filter, value, sort, order=None, limit=None, cursor=None, as_json=False):
+        """
+        With as_json the bookmarks come back as the read model's JSON documents and the
+        response body is put together from them without serializing anything
+        """
         try:
             cmd = commands.ListBookmarksCommand(
-                filter=filter, value=value, order_by=sort
+                filter=filter, value=value, order_by=sort, order=order, limit=limit, cursor=cursor,
+                as_json=as_json,
             )
 
-            bus.handle(cmd)
+            get_bus().handle(cmd)
             bookmarks = cmd.bookmarks
 
-            if bookmarks is None or not bookmarks:
+            if limit is not None or cursor is not None:
+                if as_json:
+                    body = '{"bookmarks": [' + ','.join(bookmarks) + '], "next_cursor": ' + json.dumps(cmd.next_cursor) + '}'
+                    return Response(body, mimetype='application/json')
+                return {'bookmarks': bookmarks, 'next_cursor': cmd.next_cursor}
+            elif bookmarks is None or not bookmarks:
                 return 'None found', 204
+            elif as_json:
+                return Response('[' + ','.join(bookmarks) + ']', mimetype='application/json')
             else:
                 return bookmarks
         except Exception as e:
-            print('many except')
-            print(e)
-            return str(e), 400
+            return self.error('many', e)
+
+    # @app.route("/api/search")
+    def search(self):
+        text = request.args.get('q', '')
+        limit, cursor = self.get_page_args()
+        if not text.strip():
+            raise BadRequest('q is required')
+
+        try:
+            cmd = commands.SearchBookmarksCommand(query=text, limit=limit or 20, cursor=cursor)
+            get_bus().handle(cmd)
+
+            return {'bookmarks': cmd.bookmarks, 'next_cursor': cmd.next_cursor}
+        except Exception as e:
+            return self.error('search', e)
+
+    # @app.route("/api/duplicates")
+    def duplicates(self):
+        try:
+            cmd = commands.FindDuplicateBookmarksCommand()
+            get_bus().handle(cmd)
+
+            return {'duplicates': cmd.duplicates}
+        except Exception as e:
+            return self.error('duplicates', e)
+
+    # @app.route("/api/metrics")
+    def metrics(self):
+        metrics = get_bus().metrics
+        if metrics is None:
+            return 'metrics are disabled', 404
+
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    def stream(self, filter, value, sort, order=None, format='json'):
+        """
+        Streams the listing as a chunked response, either one JSON array (format=json) or
+        one JSON document per line (format=ndjson), without building it in memory
+        """
+        if format not in ('json', 'ndjson'):
+            raise BadRequest('stream must be json or ndjson')
+
+        cmd = commands.ListBookmarksCommand(
+            filter=filter, value=value, order_by=sort, order=order, stream=True
+        )
+        get_bus().handle(cmd)
+
+        dumps = current_app.json.dumps
+
+        def generate(chunk_size=100):
+            rows = (dumps(bookmark) for bookmark in cmd.bookmarks)
+            chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+            if format == 'ndjson':
+                for chunk in chunks:
+                    yield '\n'.join(chunk) + '\n'
+            else:
+                yield '['
+                for i, chunk in enumerate(chunks):
+                    yield (',' if i else '') + ','.join(chunk)
+                yield ']'
+
+        mimetype = 'application/x-ndjson' if format == 'ndjson' else 'application/json'
+        return Response(stream_with_context(generate()), mimetype=mimetype)
+
+    def get_page_args(self):
+        """
+        Reads the keyset paging arguments (?limit=&cursor=) from the query string
+        """
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit < 1:
+            raise BadRequest('limit must be a positive integer')
+
+        return limit, request.args.get('cursor')
 
     def add(self, bookmark):
         try:
@@ -97,19 +246,35 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
                 date_added=bookmark.date_added,
                 date_edited=bookmark.date_edited
             )
-            bus.handle(cmd)
+            get_bus().handle(cmd)
 
             return 'OK', 201
         except Exception as e:
-            print('add except')
-            print(e)
-            return str(e), 400
+            return self.error('add', e)
 
     def add_bookmark(self):
         return self.add(bookmark=self.get_bookmark_from_json(request.get_json(force=True)))
 
+    def add_many(self, bookmarks):
+        try:
+            cmd = commands.AddBookmarksBatchCommand(bookmarks=bookmarks)
+            get_bus().handle(cmd)
+
+            added = sum(1 for result in cmd.results if result['status'] == 'added')
+            return {'added': added, 'results': cmd.results}, 201 if added else 200
+        except Exception as e:
+            return self.error('add_many', e)
+
+    def add_bookmarks(self):
+        req_json = request.get_json(force=True)
+        if isinstance(req_json, dict):
+            req_json = req_json.get('bookmarks')
+        if not isinstance(req_json, list):
+            raise BadRequest('Expected a list of bookmarks')
+
+        return self.add_many(bookmarks=req_json)
+
     def delete(self, bookmark):
-        print('delete')
         try:
             id = None
             try:
@@ -120,30 +285,51 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
             cmd = commands.DeleteBookmarkCommand(
                 id=id
             )
-            print('cmd')
-            bus.handle(cmd)
+            get_bus().handle(cmd)
+
+            if not cmd.deleted:
+                raise Exception(f'{id} was not found')
 
             return 'OK', 201
 
         except Exception as e:
-            print('delete except')
-            print(e)
-            return str(e), 400
+            return self.error('delete', e)
 
     def delete_bookmark(self, id):
-        try:
-            bookmark = self.one(id=id)
-            print('results')
-            if not bookmark:
-                raise Exception(f'{id} was not found')
+        # the delete reports how many rows it removed, so no lookup is needed beforehand
+        bmrk = {}
+        bmrk['id'] = id
 
-            bmrk = {}
-            bmrk['id'] = id
+        body, status = self.delete(bmrk)
+        if status != 201:
+            return body, status
 
-            self.delete(bmrk)
-            return 'Ok', 200
+        return 'Ok', 200
+
+    def delete_many(self, ids=None, filter=None, value=None, op=None):
+        try:
+            cmd = commands.DeleteBookmarksCommand(ids=ids, filter=filter, value=value, op=op)
+            get_bus().handle(cmd)
+
+            return {'deleted': cmd.deleted}, 200
         except Exception as e:
-            return str(e), 400
+            return self.error('delete_many', e)
+
+    def delete_bookmarks(self):
+        req_json = request.get_json(force=True)
+        if not isinstance(req_json, dict):
+            raise BadRequest('Expected ids or a filter')
+
+        ids = req_json.get('ids')
+        if ids is not None and not handlers.is_id_list(ids):
+            raise BadRequest('ids must be a list of integers')
+
+        return self.delete_many(
+            ids=ids,
+            filter=req_json.get('filter'),
+            value=req_json.get('value'),
+            op=req_json.get('op'),
+        )
 
     def update_bookmark(self, id):
         bookmark = self.get_bookmark_from_json(request.get_json(force=True))
@@ -161,14 +347,96 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
                 date_added=bookmark.date_added
             )
 
-            bus.handle(cmd)
+            get_bus().handle(cmd)
 
             return 'OK', 201
 
         except Exception as e:
-            print('update except')
-            print(e)
-            return str(e), 400
+            return self.error('update', e)
+
+    def update_many(self, bookmarks):
+        try:
+            cmd = commands.EditBookmarksBatchCommand(bookmarks=bookmarks)
+            get_bus().handle(cmd)
+
+            return {'updated': cmd.updated}, 200
+        except Exception as e:
+            return self.error('update_many', e)
+
+    def update_bookmarks(self):
+        req_json = request.get_json(force=True)
+        if isinstance(req_json, dict):
+            req_json = req_json.get('bookmarks')
+        if not isinstance(req_json, list):
+            raise BadRequest('Expected a list of bookmarks')
+
+        return self.update_many(bookmarks=req_json)
+
+    def conditional(self, view):
+        """
+        Wraps a read view so it answers conditional GETs: the ETag and Last-Modified come
+        from the bookmarks change counter, and a client that already has the current
+        version gets a 304 without the view (and its query) running at all.
+
+        The cache is invalidated just after a write commits, and not at all in this process
+        when another worker made the write. Reading the version empties a cache that has not
+        seen it yet (see BookmarkCache.sync_version) and the ETag carries the resulting cache
+        generation, so it only ever names one body. Last-Modified is left out until the
+        change is a second old, since a date cannot tell apart two states within the same
+        second.
+        """
+
+        @functools.wraps(view)
+        def conditional_view(*args, **kwargs):
+            cmd = commands.GetBookmarksVersionCommand()
+            get_bus().handle(cmd)
+
+            etag = f'{cmd.version}.{cmd.cache_generation}'
+            modified_at = None
+            if cmd.modified_at is not None:
+                modified_at = cmd.modified_at.replace(tzinfo=timezone.utc)
+                if datetime.now(timezone.utc) - modified_at < timedelta(seconds=1):
+                    modified_at = None
+                else:
+                    modified_at = modified_at.replace(microsecond=0)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = since is not None and modified_at is not None and modified_at <= since
+
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if modified_at is not None:
+                response.last_modified = modified_at
+
+            return response
+
+        return conditional_view
+
+    def error(self, endpoint, e):
+        """
+        Answers a failed request with a 400. The traceback goes to the log and the failure
+        to the metrics; database errors get a generic body, so no SQL or parameters leak
+        """
+        logger.exception('%s failed', endpoint)
+        metrics = get_bus().metrics
+        if metrics is not None:
+            metrics.api_errors.inc(endpoint, type(e).__name__)
+
+        if isinstance(e, IntegrityError):
+            return 'conflicts with an existing bookmark', 400
+        elif isinstance(e, SQLAlchemyError):
+            return 'database error', 400
+
+        return str(e), 400
 
     def get_bookmark_from_json(self, req_json) -> Bookmark:
         return Bookmark(
@@ -184,23 +452,61 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
 fb = FlaskBookmarkAPI()
 bp = Blueprint("flask_bookmark_api", __name__, url_prefix="/api")
 
+
+@bp.before_request
+def start_query_profile():
+    # in debug mode every response says how many statements it took, see profiler.py
+    if current_app.debug:
+        g.query_profile, g.query_profile_token = profiler.start()
+
+
+@bp.after_request
+def add_query_profile_headers(response):
+    token = g.pop('query_profile_token', None)
+    if token is not None:
+        profiler.stop(token)
+        response.headers['X-Query-Count'] = str(g.query_profile.statements)
+        # milliseconds
+        response.headers['X-DB-Time'] = f'{g.query_profile.seconds * 1000:.3f}'
+
+    return response
+
+
 # @app.route('/')
 bp.add_url_rule("/", "index", fb.index, ["GET"])
 
 # @app.route('/api/one/<id>')
-bp.add_url_rule("/one/<id>", "one", fb.one, ["GET"])
+bp.add_url_rule("/one/<id>", "one", fb.conditional(fb.one), ["GET"])
 
 # @app.route('/api/all')
-bp.add_url_rule("/all", "all", fb.all, ["GET"])
+bp.add_url_rule("/all", "all", fb.conditional(fb.all), ["GET"])
 
 # @app.route('/api/add')
 bp.add_url_rule("/add", "add", fb.add_bookmark, methods=["POST"])
 
+# @app.route('/api/add/bulk')
+bp.add_url_rule("/add/bulk", "add_bulk", fb.add_bookmarks, methods=["POST"])
+
 # @app.route('/api/edit/<id>')
 bp.add_url_rule("/edit/<id>", "edit", fb.update_bookmark, methods=["POST"])
 
+# @app.route('/api/edit/bulk')
+bp.add_url_rule("/edit/bulk", "edit_bulk", fb.update_bookmarks, methods=["PATCH"])
+
 # @app.route('/api/delete/<id>')
 bp.add_url_rule("/delete/<id>", "delete", fb.delete_bookmark, methods=["GET"])
 
+# @app.route('/api/delete/bulk')
+bp.add_url_rule("/delete/bulk", "delete_bulk", fb.delete_bookmarks, methods=["POST"])
+
+# @app.route("/api/search")
+bp.add_url_rule("/search", "search", fb.conditional(fb.search), methods=["GET"])
+
+# @app.route("/api/duplicates")
+bp.add_url_rule("/duplicates", "duplicates", fb.conditional(fb.duplicates), methods=["GET"])
+
 # @app.route("/api/first/<filter>/<value>/<sort>")
-bp.add_url_rule('/first/<filter>/<value>/<sort>', "first", fb.first, methods=["GET"])
\ No newline at end of file
+bp.add_url_rule('/first/<filter>/<value>/<sort>', "first", fb.conditional(fb.first), methods=["GET"])
+
+# @app.route("/api/metrics")
+bp.add_url_rule("/metrics", "metrics", fb.metrics, methods=["GET"])
\ No newline at end of file
@@ -1,27 +1,73 @@
+import asyncio
+import functools
 import inspect
-from typing import Callable
+from typing import Callable, Union
 
 from barkylib.adapters import orm
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.adapters.metrics import Metrics
+from barkylib.adapters.outbox import OutboxRelay
 from barkylib.services import handlers, messagebus, unit_of_work
+from barkylib.services.dispatcher import BackgroundEventDispatcher
 
 
 def bootstrap(
     start_orm: bool = True,
-    uow: unit_of_work.AbstractUnitOfWork = unit_of_work.SqlAlchemyUnitOfWork(),
+    uow: unit_of_work.AbstractUnitOfWork = None,
+    cache: BookmarkCache = None,
+    async_mode: bool = False,
+    uow_factory: Callable[[], unit_of_work.AbstractUnitOfWork] = None,
+    dispatcher: BackgroundEventDispatcher = None,
+    metrics: Metrics = None,
+    read_session_factory: Callable = None,
+    relay: OutboxRelay = None,
     # notifications: AbstractNotifications = None,
     # publish: Callable = redis_eventpublisher.publish,
-) -> messagebus.MessageBus:
+) -> Union[messagebus.MessageBus, messagebus.AsyncMessageBus]:
     # if notifications is None:
     #     notifications = EmailNotifications()
 
     if start_orm:
         orm.start_mappers()
 
-    # dependencies = {"uow": uow, "notifications": notifications, "publish": publish}
-    dependencies = {"uow": uow}
+    if uow is None:
+        # engine, schema and migrations are set up here, not when this module is imported
+        uow = unit_of_work.SqlAlchemyUnitOfWork()
+
+    if cache is not None:
+        uow.cache = cache
+
+    if metrics is not None:
+        uow.metrics = metrics
+
+    if uow_factory is None:
+        uow_factory = default_uow_factory(uow)
+
+    read_uow_factory = None
+    if read_session_factory is not None and isinstance(uow, unit_of_work.SqlAlchemyUnitOfWork):
+        # the read only commands, see handlers.READ_ONLY_COMMANDS
+        read_uow_factory = default_uow_factory(uow, read_session_factory)
+
+    if async_mode:
+        return bootstrap_async(uow, uow_factory, relay)
+
+    if relay is not None and dispatcher is None:
+        # inline, every write would wait on Redis before it returns
+        raise ValueError("publishing events needs a background event dispatcher")
+
+    # dependencies = {"notifications": notifications, "publish": publish}
+    dependencies = {"cache": uow.cache, "relay": relay}
     injected_event_handlers = {
         event_type: [
             inject_dependencies(handler, dependencies) for handler in event_handlers
+            if handler in handlers.INLINE_EVENT_HANDLERS
+        ]
+        for event_type, event_handlers in handlers.EVENT_HANDLERS.items()
+    }
+    injected_background_event_handlers = {
+        event_type: [
+            inject_dependencies(handler, dependencies) for handler in event_handlers
+            if handler not in handlers.INLINE_EVENT_HANDLERS
         ]
         for event_type, event_handlers in handlers.EVENT_HANDLERS.items()
     }
@@ -31,15 +77,90 @@ def bootstrap(
     }
 
     return messagebus.MessageBus(
-        uow=uow,
+        uow_factory=uow_factory,
         event_handlers=injected_event_handlers,
         command_handlers=injected_command_handlers,
+        background_event_handlers=injected_background_event_handlers,
+        dispatcher=dispatcher,
+        metrics=metrics,
+        read_uow_factory=read_uow_factory,
+        read_only_commands=handlers.READ_ONLY_COMMANDS,
     )
 
 
+def default_uow_factory(
+    uow: unit_of_work.AbstractUnitOfWork,
+    session_factory: Callable = None,
+) -> Callable[[], unit_of_work.AbstractUnitOfWork]:
+    if not isinstance(uow, unit_of_work.SqlAlchemyUnitOfWork):
+        return lambda: uow
+
+    # new units of work on the same engine (or the given one) and cache, the schema is
+    # already in place
+    session_factory = session_factory or uow.session_factory
+
+    def uow_factory():
+        return unit_of_work.SqlAlchemyUnitOfWork(
+            session_factory, cache=uow.cache, create_schema=False, metrics=uow.metrics
+        )
+
+    return uow_factory
+
+
+def bootstrap_async(
+    uow: unit_of_work.AbstractUnitOfWork,
+    uow_factory: Callable[[], unit_of_work.AbstractUnitOfWork],
+    relay: OutboxRelay = None,
+) -> messagebus.AsyncMessageBus:
+    dependencies = {"cache": uow.cache, "relay": relay}
+    injected_event_handlers = {
+        event_type: [
+            inject_async_dependencies(handler, dependencies) for handler in event_handlers
+        ]
+        for event_type, event_handlers in handlers.EVENT_HANDLERS.items()
+    }
+    injected_command_handlers = {
+        command_type: inject_async_dependencies(
+            handlers.ASYNC_COMMAND_HANDLERS.get(command_type, handler), dependencies
+        )
+        for command_type, handler in handlers.COMMAND_HANDLERS.items()
+    }
+
+    return messagebus.AsyncMessageBus(
+        uow_factory=lambda: unit_of_work.AsyncUnitOfWork(uow_factory()),
+        event_handlers=injected_event_handlers,
+        command_handlers=injected_command_handlers,
+    )
+
+
+def inject_async_dependencies(handler, dependencies):
+    """
+    Wraps a handler as a coroutine taking (message, uow) where uow is the message's
+    AsyncUnitOfWork. Coroutine handlers are awaited with it, plain handlers run on a worker
+    thread with the synchronous unit of work inside it.
+    """
+    params = inspect.signature(handler).parameters
+    deps = {
+        name: dependency for name, dependency in dependencies.items() if name in params
+    }
+    takes_uow = "uow" in params
+
+    if inspect.iscoroutinefunction(handler):
+        async def run(message, uow):
+            return await handler(message, **deps, **({"uow": uow} if takes_uow else {}))
+    else:
+        async def run(message, uow):
+            return await asyncio.to_thread(handler, message, **deps, **({"uow": uow.uow} if takes_uow else {}))
+
+    return run
+
+
 def inject_dependencies(handler, dependencies):
     params = inspect.signature(handler).parameters
     deps = {
         name: dependency for name, dependency in dependencies.items() if name in params
     }
-    return lambda message: handler(message, **deps)
+    if "uow" not in params:
+        return functools.wraps(handler)(lambda message, uow: handler(message, **deps))
+    # wraps sets __wrapped__, the bus keys dispatch on the handler rather than on this lambda
+    return functools.wraps(handler)(lambda message, uow: handler(message, uow=uow, **deps))
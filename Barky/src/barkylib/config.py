@@ -1,4 +1,14 @@
+import functools
 import os
+from datetime import timedelta
+
+
+@functools.lru_cache(maxsize=None)
+def load_env():
+    # reads .env into os.environ once per process, variables already set win
+    from dotenv import load_dotenv
+
+    load_dotenv()
 
 
 def get_sqlite_memory_uri():
@@ -9,6 +19,71 @@ def get_sqlite_file_url():
     return f"sqlite:///../bookmarks.db"
 
 
+def get_sqlite_engine_profile():
+    """
+    Connection settings applied to every SQLite connection, see unit_of_work.create_sqlite_engine
+    """
+    return dict(
+        journal_mode=os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+        synchronous=os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        # bytes of the database file to memory map
+        mmap_size=int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        # negative values are KiB, so this is a 64MB page cache per connection
+        cache_size=int(os.environ.get("SQLITE_CACHE_SIZE", -64000)),
+        busy_timeout=int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+        pool_size=int(os.environ.get("SQLITE_POOL_SIZE", 5)),
+        max_overflow=int(os.environ.get("SQLITE_MAX_OVERFLOW", 10)),
+    )
+
+
+def get_sqlite_read_only():
+    # SQLITE_READ_ONLY=1 serves reads from a second engine whose connections are query_only,
+    # writes keep the normal one
+    return os.environ.get("SQLITE_READ_ONLY", "0") == "1"
+
+
+def get_cache_settings():
+    # BARKY_CACHE_SIZE=0 turns the bookmark cache off, BARKY_CACHE_BACKEND=redis shares it
+    # between worker processes through the Redis server from get_redis_host_and_port
+    maxsize = int(os.environ.get("BARKY_CACHE_SIZE", 1024))
+    ttl = float(os.environ.get("BARKY_CACHE_TTL", 60))
+    backend = os.environ.get("BARKY_CACHE_BACKEND", "local")
+    return dict(maxsize=maxsize, ttl=ttl, backend=backend)
+
+
+def get_event_dispatch_settings():
+    # BARKY_EVENT_WORKERS=0 runs every event handler inline in the request
+    return dict(
+        max_workers=int(os.environ.get("BARKY_EVENT_WORKERS", 0)),
+        max_pending=int(os.environ.get("BARKY_EVENT_QUEUE_SIZE", 1000)),
+        handler_concurrency=int(os.environ.get("BARKY_EVENT_HANDLER_CONCURRENCY", 2)),
+        block_timeout=float(os.environ.get("BARKY_EVENT_BLOCK_TIMEOUT", 5)),
+    )
+
+
+def get_publish_events_enabled():
+    # BARKY_PUBLISH_EVENTS=1 relays the outbox to Redis from the background event workers
+    # right after each write, instead of leaving it to `python -m barkylib.adapters.outbox`;
+    # it needs BARKY_EVENT_WORKERS > 0, see flaskapi.get_bus
+    return os.environ.get("BARKY_PUBLISH_EVENTS", "0") == "1"
+
+
+def get_query_profiler_settings():
+    # BARKY_SLOW_QUERY_MS is the slow query log threshold, BARKY_QUERY_PROFILER=0 removes the
+    # statement hooks altogether
+    slow_query_ms = os.environ.get("BARKY_SLOW_QUERY_MS", "100")
+    return dict(
+        profile_queries=os.environ.get("BARKY_QUERY_PROFILER", "1") == "1",
+        slow_query_ms=float(slow_query_ms) if slow_query_ms else None,
+        explain_slow_queries=os.environ.get("BARKY_EXPLAIN_SLOW_QUERIES", "1") == "1",
+    )
+
+
+def get_metrics_enabled():
+    # BARKY_METRICS=0 leaves the bus and the repository uninstrumented and /api/metrics empty
+    return os.environ.get("BARKY_METRICS", "1") == "1"
+
+
 def get_postgres_uri():
     host = os.environ.get("DB_HOST", "localhost")
     port = 54321 if host == "localhost" else 5432
@@ -29,6 +104,20 @@ def get_redis_host_and_port():
     return dict(host=host, port=port)
 
 
+def get_redis_timeouts():
+    # seconds; a Redis server that stops answering fails the call instead of hanging it
+    timeout = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 2))
+    return dict(socket_timeout=timeout, socket_connect_timeout=timeout)
+
+
+def get_outbox_settings():
+    # published events are kept BARKY_OUTBOX_RETENTION_HOURS for inspection, then deleted
+    return dict(
+        batch_size=int(os.environ.get("BARKY_OUTBOX_BATCH_SIZE", 100)),
+        retention=timedelta(hours=float(os.environ.get("BARKY_OUTBOX_RETENTION_HOURS", 24))),
+    )
+
+
 def get_email_host_and_port():
     host = os.environ.get("EMAIL_HOST", "localhost")
     port = 11025 if host == "localhost" else 1025
@@ -2,14 +2,11 @@
 This module utilizes the command pattern - https://en.wikipedia.org/wiki/Command_pattern - to
 specify and implement the business logic layer
 """
-import sys
 from abc import ABC
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
-import requests
-
 # from database import DatabaseManager
 
 # module scope
@@ -36,6 +33,16 @@ class AddBookmarkCommand(Command):
     notes: Optional[str] = None
 
 
+@dataclass
+class AddBookmarksBatchCommand(Command):
+    """
+    Adds many bookmarks in one transaction, bookmarks is a list of dicts with
+    title, url and optionally notes. results gets one outcome per input row
+    """
+
+    bookmarks: list[dict]
+    results: Optional[list[dict]] = None
+
 
 @dataclass
 class ListBookmarksCommand(Command):
@@ -45,11 +52,75 @@ class ListBookmarksCommand(Command):
     order: Optional[str] = None
     query: Optional[object] = None
     bookmarks: Optional[list[object]] = None
+    # keyset pagination: page size, the opaque cursor of the previous page and
+    # the cursor to hand back to the client for the next page
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    next_cursor: Optional[str] = None
+    # when set, bookmarks is a generator that reads the rows in chunks while it is consumed
+    stream: bool = False
+    # when set, bookmarks holds the JSON documents of the read model as strings
+    as_json: bool = False
+
+
+@dataclass
+class SearchBookmarksCommand(Command):
+    """
+    Full text search over title, url and notes, best match first
+    """
+
+    query: str
+    limit: int = 20
+    cursor: Optional[str] = None
+    bookmarks: Optional[list[dict]] = None
+    next_cursor: Optional[str] = None
+
+
+@dataclass
+class FindDuplicateBookmarksCommand(Command):
+    """
+    Groups of bookmarks whose urls have the same canonical form
+    """
+
+    duplicates: Optional[list[dict]] = None
+
+
+@dataclass
+class GetBookmarkCommand(Command):
+    id: int
+    bookmark: Optional[dict] = None
+
+
+@dataclass
+class GetBookmarksVersionCommand(Command):
+    """
+    Reads the bookmarks change counter, which every write bumps, and the read cache
+    generation, which every invalidation bumps
+    """
+
+    version: Optional[int] = None
+    modified_at: Optional[datetime] = None
+    cache_generation: Optional[int] = None
 
 
 @dataclass
 class DeleteBookmarkCommand(Command):
     id: int
+    deleted: Optional[int] = None
+
+
+@dataclass
+class DeleteBookmarksCommand(Command):
+    """
+    Deletes either the listed ids or every bookmark matching a get_query style
+    filter, e.g. filter='date_added', value=datetime(2023, 1, 1), op='lt'
+    """
+
+    ids: Optional[list[int]] = None
+    filter: Optional[str] = None
+    value: Optional[object] = None
+    op: Optional[str] = 'eq'
+    deleted: Optional[int] = None
 
 
 @dataclass
@@ -60,3 +131,14 @@ class EditBookmarkCommand(Command):
     date_added: Optional[str]
     date_edited: Optional[str]
     notes: Optional[str] = None
+
+
+@dataclass
+class EditBookmarksBatchCommand(Command):
+    """
+    Edits many bookmarks in one transaction, bookmarks is a list of dicts with
+    an id and any of title, url and notes. updated gets the number of rows changed
+    """
+
+    bookmarks: list[dict]
+    updated: Optional[int] = None
@@ -27,8 +27,8 @@ class BookmarkAdded(Event):
 @dataclass
 class BookmarkEdited(Event):
     id: int
-    title: str
-    url: str
+    title: Optional[str]
+    url: Optional[str]
     date_edited: str
     bookmark_notes: Optional[str] = None
 
@@ -43,6 +43,17 @@ class BookmarkDeleted(Event):
     id: int
 
 
-# @dataclass
-# class BookmarksDeleted(Event):
-#     bookmarks: list[Bookmark]
+@dataclass
+class BookmarksAdded(Event):
+    titles: list
+
+
+@dataclass
+class BookmarksEdited(Event):
+    ids: list
+
+
+@dataclass
+class BookmarksDeleted(Event):
+    # None when the rows were deleted by a filter and the ids are not known
+    ids: Optional[list] = None
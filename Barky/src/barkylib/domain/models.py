@@ -1,6 +1,9 @@
 from datetime import datetime
+import hashlib
 import json
+import operator
 from json import JSONEncoder
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from sqlalchemy import inspect
 
@@ -18,6 +21,11 @@ class Bookmark:
     date_edited TEXT NOT NULL
     """
 
+    # filled in once by orm.start_mappers, so serializing never has to inspect the mapper
+    _columns = None
+    _datetime_columns = ()
+    _getter = None
+
     def __init__(
             self,
             id: int,
@@ -40,8 +48,77 @@ class Bookmark:
         return o.__dict__
 
     def to_json (self):
-        return json.dumps(self._asdict(), default=str)
+        return json.dumps(self.to_dict(), default=str)
+
+    @classmethod
+    def set_columns(cls, columns, datetime_columns=()):
+        cls._columns = tuple(columns)
+        cls._datetime_columns = tuple(datetime_columns)
+        cls._getter = operator.attrgetter(*cls._columns)
 
     def _asdict(self):
-        return {c.key: getattr(self, c.key)
-                for c in inspect(self).mapper.column_attrs}
+        if self._columns is None:
+            return {c.key: getattr(self, c.key)
+                    for c in inspect(self).mapper.column_attrs}
+
+        return dict(zip(self._columns, self._getter(self)))
+
+    def to_dict(self):
+        """
+        Column values ready for JSON, datetimes as ISO 8601 strings
+        """
+        return self.serialize(self._asdict())
+
+    @classmethod
+    def serialize(cls, values: dict) -> dict:
+        """
+        Copy of a column -> value mapping (e.g. a Core result row) ready for JSON
+        """
+        values = dict(values)
+        for column in cls._datetime_columns:
+            value = values.get(column)
+            if isinstance(value, datetime):
+                values[column] = value.isoformat()
+
+        return values
+
+
+# query parameters that only track where a click came from
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "igshid", "mc_cid", "mc_eid", "_ga"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url: str) -> str:
+    """
+    Normal form of a url for duplicate detection: scheme and host lower cased, default port,
+    fragment, tracking parameters (utm_* and friends) and trailing slash dropped, remaining
+    query parameters sorted
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = "http://" + url
+
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    try:
+        host = (parts.hostname or "").lower()
+        if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+            host = f"{host}:{parts.port}"
+    except ValueError:
+        # not a valid port, compare the location as given
+        host = parts.netloc.lower()
+
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not name.lower().startswith("utm_") and name.lower() not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/")
+
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def url_hash(url: str) -> str:
+    if url is None:
+        return None
+
+    return hashlib.sha256(canonical_url(url).encode()).hexdigest()
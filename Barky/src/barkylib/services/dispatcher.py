@@ -0,0 +1,109 @@
+"""
+Bounded worker pool for event handlers that may run after the response, see
+messagebus.MessageBus and handlers.INLINE_EVENT_HANDLERS
+
+At most max_pending events wait or run at a time; dispatching beyond that blocks the caller
+(backpressure) until a slot frees up, and when block_timeout runs out the handler is run
+inline instead of being dropped, and so is everything dispatched after shutdown(): by then
+the command has committed, so its handlers must still run. Each handler runs at most
+handler_concurrency times at once, extra events for it queue up in order instead of tying
+up workers.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundEventDispatcher:
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_pending: int = 1000,
+        handler_concurrency: int = 2,
+        block_timeout: Optional[float] = 5.0,
+    ) -> None:
+        self.max_pending = max_pending
+        self.handler_concurrency = handler_concurrency
+        self.block_timeout = block_timeout
+        self.pending = 0
+        self.closed = False
+        self._running = dict()
+        self._waiting = dict()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="barky-events")
+
+    def dispatch(self, key: Hashable, task: Callable[[], None]) -> bool:
+        """
+        Queues task (one handler for one event) under its handler key, returns False when
+        the dispatcher is shut down or the queue stayed full for block_timeout and the task
+        was run inline instead
+        """
+        with self._condition:
+            if self.closed:
+                logger.warning("event dispatcher is shut down, running %s inline", key)
+                inline = True
+            elif not self._condition.wait_for(lambda: self.pending < self.max_pending, self.block_timeout):
+                logger.warning("event queue full, running %s inline", key)
+                inline = True
+            else:
+                inline = False
+                self.pending += 1
+                if self._running.get(key, 0) < self.handler_concurrency:
+                    self._running[key] = self._running.get(key, 0) + 1
+                    self._executor.submit(self._run, key, task)
+                else:
+                    self._waiting.setdefault(key, deque()).append(task)
+
+        if inline:
+            self._call(key, task)
+
+        return not inline
+
+    def _run(self, key: Hashable, task: Callable[[], None]) -> None:
+        while task is not None:
+            self._call(key, task)
+            with self._condition:
+                self.pending -= 1
+                waiting = self._waiting.get(key)
+                # keep this worker on the handler while it has a backlog
+                task = waiting.popleft() if waiting else None
+                if task is None:
+                    self._running[key] -= 1
+                self._condition.notify_all()
+
+    def _call(self, key: Hashable, task: Callable[[], None]) -> None:
+        try:
+            task()
+        except Exception:
+            logger.exception("Exception in background event handler %s", key)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every dispatched event has been handled, returns False on timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.pending == 0, timeout)
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stops taking events and drains the ones already queued
+        """
+        with self._condition:
+            self.closed = True
+        drained = self.drain(timeout)
+        self._executor.shutdown(wait=drained)
+        return drained
+
+
+def make_dispatcher(max_workers: int, **settings) -> Optional[BackgroundEventDispatcher]:
+    # no workers keeps every event handler inline
+    if max_workers <= 0:
+        return None
+
+    return BackgroundEventDispatcher(max_workers=max_workers, **settings)
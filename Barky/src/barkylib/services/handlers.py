@@ -1,17 +1,22 @@
 from __future__ import annotations
 
+import base64
 import json
+import operator
 from dataclasses import asdict
 from typing import TYPE_CHECKING, Callable, Dict, List, Type
 
 from barkylib.domain import commands, events, models
 from barkylib.domain.commands import EditBookmarkCommand
 from barkylib.domain.events import BookmarkEdited
-from sqlalchemy import select, text, desc
+from barkylib.adapters.orm import bookmark_documents
+from sqlalchemy import Table, select, text, desc, and_, or_, tuple_
 
 from datetime import datetime
 
 if TYPE_CHECKING:
+    from barkylib.adapters.cache import BookmarkCache
+    from barkylib.adapters.outbox import OutboxRelay
     from . import unit_of_work
 
 
@@ -30,6 +35,13 @@ def do_add_bookmark(
     with uow:
         bookmark = models.Bookmark(id=id, title=title, url=url, notes=notes, date_added=date_added, date_edited=datetime.now()) if bookmark is None else bookmark
         uow.bookmarks.add_one(bookmark)
+        # the read model is written in the same transaction, so listings never lag behind
+        uow.bookmarks.refresh_documents(ids=[bookmark.id])
+        uow.add_event(events.BookmarkAdded(
+            id=bookmark.id, title=bookmark.title, url=bookmark.url,
+            date_added=bookmark.date_added, bookmark_notes=bookmark.notes
+        ))
+        uow.commit()
 
 
 def add_bookmark(
@@ -37,33 +49,148 @@ def add_bookmark(
     uow: unit_of_work.AbstractUnitOfWork,
 ):
     with uow:
-        # look to see if we already have this bookmark as the title is set as unique
-        bookmark = uow.bookmarks.find_first(get_query(filter='title', value=cmd.title, sort='title', order=None))
+        # titles are unique and urls are deduped by their canonical form, both probes hit an index
+        clause = models.Bookmark.title == cmd.title
+        if cmd.url is not None:
+            clause = or_(clause, models.Bookmark.url_hash == models.url_hash(cmd.url))
+        bookmark = uow.bookmarks.find_first(select(models.Bookmark).where(clause))
         if bookmark is None:
             do_add_bookmark(uow=uow, id=cmd.id, title=cmd.title, url=cmd.url, notes=cmd.notes)
 
 
-def list_bookmark(
-        id: int,
+# AddBookmarksBatchCommand: bookmarks: list[dict]
+def add_bookmarks_batch(
+    cmd: commands.AddBookmarksBatchCommand,
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    results = list()
+    rows = list()
+    titles = set()
+    seen = set()
+    hashes = dict()
+
+    for index, bookmark in enumerate(cmd.bookmarks):
+        title = bookmark.get('title') if isinstance(bookmark, dict) else None
+        url = bookmark.get('url') if isinstance(bookmark, dict) else None
+        if not isinstance(title, str) or not title or not isinstance(url, str) or not url:
+            results.append({'index': index, 'title': title, 'status': 'invalid'})
+            continue
+
+        key = models.url_hash(bookmark['url'])
+        if title in titles or key in seen:
+            results.append({'index': index, 'title': title, 'status': 'duplicate'})
+        else:
+            titles.add(title)
+            seen.add(key)
+            hashes[index] = key
+            results.append({'index': index, 'title': title, 'status': 'added'})
+
+    with uow:
+        # one IN query per key for the whole batch instead of a lookup per bookmark
+        existing = uow.bookmarks.find_existing_titles(titles)
+        existing_hashes = uow.bookmarks.find_existing_url_hashes(seen)
+        now = datetime.now()
+
+        for result, bookmark in zip(results, cmd.bookmarks):
+            if result['status'] == 'added' and (
+                result['title'] in existing or hashes[result['index']] in existing_hashes
+            ):
+                result['status'] = 'duplicate'
+            elif result['status'] == 'added':
+                rows.append({
+                    'title': bookmark['title'],
+                    'url': bookmark['url'],
+                    'notes': bookmark.get('notes'),
+                    'date_added': now,
+                    'date_edited': now,
+                })
+
+        uow.bookmarks.add_bulk(rows)
+        if rows:
+            uow.bookmarks.refresh_documents(titles=[row['title'] for row in rows])
+            uow.add_event(events.BookmarksAdded(titles=[row['title'] for row in rows]))
+        uow.commit()
+
+    cmd.results = results
+
+
+# GetBookmarkCommand: id: int
+def get_bookmark(
+        cmd: commands.GetBookmarkCommand,
         uow: unit_of_work.AbstractUnitOfWork
 ):
     with uow:
-        bookmark = uow.bookmarks.get(id)
-        if bookmark is None:
-            return 'No results'
-        else:
-            return bookmark._asdict()
+        bookmark = uow.bookmarks.get(int(cmd.id))
+        cmd.bookmark = None if bookmark is None else bookmark.to_dict()
 
 
-# ListBookmarksCommand: order_by: str order: str
+async def get_bookmark_async(
+        cmd: commands.GetBookmarkCommand,
+        uow: unit_of_work.AsyncUnitOfWork
+):
+    async with uow:
+        bookmark = await uow.bookmarks.get(int(cmd.id))
+        cmd.bookmark = None if bookmark is None else bookmark.to_dict()
+
+
+# GetBookmarksVersionCommand
+def get_bookmarks_version(
+        cmd: commands.GetBookmarksVersionCommand,
+        uow: unit_of_work.AbstractUnitOfWork
+):
+    with uow:
+        cmd.version, cmd.modified_at = uow.bookmarks.get_version()
+        # a cache that has not seen this version yet (a write not invalidated yet, or one
+        # made by another process) is emptied first, so the generation in the validator
+        # only ever covers bodies of this version
+        cmd.cache_generation = 0 if uow.cache is None else uow.cache.sync_version(cmd.version)
+
+
+async def get_bookmarks_version_async(
+        cmd: commands.GetBookmarksVersionCommand,
+        uow: unit_of_work.AsyncUnitOfWork
+):
+    async with uow:
+        cmd.version, cmd.modified_at = await uow.bookmarks.get_version()
+        cmd.cache_generation = 0 if uow.cache is None else uow.cache.sync_version(cmd.version)
+
+
+# ListBookmarksCommand: order_by: str order: str limit: int cursor: str
 def list_bookmarks(
     cmd: commands.ListBookmarksCommand,
     uow: unit_of_work.AbstractUnitOfWork,
 ):
+    if cmd.order_by is not None and cmd.order_by not in SORTABLE_COLUMNS:
+        # listings are served from the read model, which has only these columns to sort on
+        raise ValueError(f"{cmd.order_by} is not a sortable column, use one of {', '.join(SORTABLE_COLUMNS)}")
+
     bookmarks = None
     with uow:
-        bookmarks = list_all_bookmarks(filter=cmd.filter, value=cmd.value, sort=cmd.order_by, order=cmd.order, uow=uow)
-        cmd.bookmarks = bookmarks
+        if cmd.stream:
+            cmd.bookmarks = stream_bookmarks(filter=cmd.filter, value=cmd.value, sort=cmd.order_by, order=cmd.order, uow=uow)
+            return
+
+        sort = cmd.order_by
+        if sort is None and (cmd.limit is not None or cmd.cursor is not None):
+            # paging needs a stable order, fall back to the primary key
+            sort = 'id'
+
+        # fetch one extra row so we know whether there is a next page
+        limit = cmd.limit + 1 if cmd.limit is not None else None
+        bookmarks = list_all_bookmarks(
+            filter=cmd.filter, value=cmd.value, sort=sort, order=cmd.order,
+            limit=limit, cursor=cmd.cursor, uow=uow
+        )
+
+        cmd.next_cursor = None
+        if cmd.limit is not None and len(bookmarks) > cmd.limit:
+            bookmarks = bookmarks[:cmd.limit]
+            cmd.next_cursor = encode_cursor(bookmarks[-1], sort, cmd.order)
+
+        if cmd.as_json:
+            cmd.bookmarks = [row['document'] for row in bookmarks]
+        else:
+            cmd.bookmarks = [json.loads(row['document']) for row in bookmarks]
 
 
 def list_all_bookmarks(
@@ -71,18 +198,98 @@ def list_all_bookmarks(
         value: object,
         sort: str,
         order: str,
-        uow: unit_of_work.AbstractUnitOfWork
+        uow: unit_of_work.AbstractUnitOfWork,
+        limit: int = None,
+        cursor: str = None,
 ):
 
     with uow:
-        bookmarks = uow.bookmarks.find_all(query=get_query(filter, value, sort, order))
-        json_bookmarks = list()
+        # served from the read model: the sort columns plus the already serialized document
+        query = get_query(filter, value, sort, order, limit=limit, cursor=cursor, source=bookmark_documents)
+        return uow.bookmarks.find_documents(query)
+
+
+def stream_bookmarks(
+        filter: str,
+        value: object,
+        sort: str,
+        order: str,
+        uow: unit_of_work.AbstractUnitOfWork,
+        chunk_size: int = 1000,
+):
+    # the unit of work is entered lazily, once the caller starts consuming the rows
+    with uow:
+        for row in uow.bookmarks.iter_rows(get_query(filter, value, sort, order), chunk_size):
+            yield models.Bookmark.serialize(row)
+
+
+# SearchBookmarksCommand: query: str limit: int cursor: str
+def search_bookmarks(
+    cmd: commands.SearchBookmarksCommand,
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    offset = decode_search_cursor(cmd.cursor)
+    with uow:
+        # fetch one extra row so we know whether there is a next page
+        rows = uow.bookmarks.search(cmd.query, limit=cmd.limit + 1, offset=offset)
+
+    set_search_results(cmd, rows, offset)
+
+
+async def search_bookmarks_async(
+    cmd: commands.SearchBookmarksCommand,
+    uow: unit_of_work.AsyncUnitOfWork,
+):
+    offset = decode_search_cursor(cmd.cursor)
+    async with uow:
+        rows = await uow.bookmarks.search(cmd.query, limit=cmd.limit + 1, offset=offset)
+
+    set_search_results(cmd, rows, offset)
+
+
+def decode_search_cursor(cursor: str) -> int:
+    if cursor is None:
+        return 0
+
+    try:
+        kind, offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f'{cursor} is not a valid cursor')
+    if kind != 'search' or not isinstance(offset, int) or offset < 0:
+        raise ValueError(f'{cursor} is not a valid cursor')
+
+    return offset
+
+
+def set_search_results(cmd: commands.SearchBookmarksCommand, rows: list[dict], offset: int):
+    cmd.next_cursor = None
+    if len(rows) > cmd.limit:
+        rows = rows[:cmd.limit]
+        payload = json.dumps(['search', offset + cmd.limit])
+        cmd.next_cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+
+    cmd.bookmarks = [models.Bookmark.serialize(row) for row in rows]
+
+
+# FindDuplicateBookmarksCommand
+def find_duplicate_bookmarks(
+    cmd: commands.FindDuplicateBookmarksCommand,
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    with uow:
+        groups = uow.bookmarks.find_duplicate_urls()
 
-        if bookmarks:
-            for bookmark in bookmarks:
-                json_bookmarks.append(bookmark._asdict())
+    cmd.duplicates = [dict(group, count=len(group['bookmarks'])) for group in groups]
 
-        return json_bookmarks
+
+async def find_duplicate_bookmarks_async(
+    cmd: commands.FindDuplicateBookmarksCommand,
+    uow: unit_of_work.AsyncUnitOfWork,
+):
+    async with uow:
+        groups = await uow.bookmarks.find_duplicate_urls()
+
+    cmd.duplicates = [dict(group, count=len(group['bookmarks'])) for group in groups]
 
 
 #EditBookmarkCommand(Command):
@@ -91,98 +298,183 @@ def edit_bookmark(
     uow: unit_of_work.AbstractUnitOfWork,
 ):
     with uow:
-        bookmark = uow.bookmarks.get(id=cmd.id)
-        if bookmark is None:
+        # only the changed columns are written, so the bookmark does not have to be read first
+        bmark = {'id': int(cmd.id), 'date_edited': datetime.now()}
+        if cmd.title is not None:
+            bmark['title'] = cmd.title
+        if cmd.url is not None:
+            bmark['url'] = cmd.url
+        if cmd.notes is not None:
+            bmark['notes'] = cmd.notes
+
+        if not uow.bookmarks.update_bulk([bmark]):
             raise Exception(f'{cmd.id} was not found')
-        else:
-            bmark = bookmark._asdict()
-            bmark['id'] = cmd.id
-            if cmd.title is not None:
-                bmark['title'] = cmd.title
-            if cmd.url is not None:
-                bmark['url'] = cmd.url
-            if cmd.notes is not None:
-                bmark['notes'] = cmd.notes
-
-            bmark['date_edited'] = datetime.now()
 
-            do_edit_bookmark(bookmark=bmark, uow=uow)
+        uow.bookmarks.refresh_documents(ids=[bmark['id']])
+        uow.add_event(events.BookmarkEdited(
+            id=bmark['id'], title=cmd.title, url=cmd.url,
+            date_edited=bmark['date_edited'], bookmark_notes=cmd.notes
+        ))
+        uow.commit()
 
 
-def do_edit_bookmark(
-        uow: unit_of_work.AbstractUnitOfWork,
-        id: int = None,
-        title: str = None,
-        url: str = None,
-        notes: str = None,
-        bookmark: models.Bookmark = None,
+# EditBookmarksBatchCommand: bookmarks: list[dict]
+def edit_bookmarks_batch(
+    cmd: commands.EditBookmarksBatchCommand,
+    uow: unit_of_work.AbstractUnitOfWork,
 ):
+    now = datetime.now()
+    rows = list()
+    for bookmark in cmd.bookmarks:
+        if not isinstance(bookmark, dict) or bookmark.get('id') is None:
+            raise Exception(f'{bookmark} does not have an id')
+
+        row = {'id': int(bookmark['id']), 'date_edited': now}
+        for column in ('title', 'url', 'notes'):
+            if bookmark.get(column) is not None:
+                row[column] = bookmark[column]
+        rows.append(row)
+
     with uow:
-        try:
-            bookmark = models.Bookmark(id=id, title=title, url=url, notes=notes, date_edited=datetime.now()) if bookmark is None else bookmark
-            return uow.bookmarks.update(bookmark=bookmark)
-        except Exception as e:
-            print('do_edit_bookmark exception')
-            print(e)
-            return 'Error', 400
+        cmd.updated = uow.bookmarks.update_bulk(rows)
+        uow.bookmarks.refresh_documents(ids=[row['id'] for row in rows])
+        uow.add_event(events.BookmarksEdited(ids=[row['id'] for row in rows]))
+        uow.commit()
 
 
-def do_delete_bookmark(
-        bookmark: models.Bookmark,
-        uow: unit_of_work.AbstractUnitOfWork
-):
-    with uow:
-        try:
-            uow.bookmarks.delete_one(bookmark=bookmark)
-            return 200
-        except Exception as e:
-            return 400
+SORTABLE_COLUMNS = ('id', 'title', 'date_added', 'date_edited')
+
 
 def get_query(
         filter: str,
         value: object,
         sort: str,
-        order: str
-):
-    query = select(models.Bookmark)
-
-    if filter is not None:
-        if filter == 'id':
-            query = query.where(models.Bookmark.id == int(value))
-        elif filter == 'title' and isinstance(value, str):
-            query = query.where(models.Bookmark.title == str(value))
-        elif filter == 'date_added' and isinstance(value, datetime):
-            query = query.where(models.Bookmark.date_added == datetime(value))
-        elif filter == 'date_edited' and isinstance(value, datetime):
-            query = query.where(models.Bookmark.date_edited == datetime(value))
-    else:
-        query = query.where(models.Bookmark.id.isnot(None))
-
-    if sort is not None:
-        if sort == 'id':
-            if order is not None and order.lower() == 'desc':
-                query = query.order_by(desc(models.Bookmark.id))
-            else:
-                query = query.order_by(models.Bookmark.id)
-        elif sort == 'title':
-            if order is not None and order.lower() == 'desc':
-                query = query.order_by(desc(models.Bookmark.title))
-            else:
-                query = query.order_by(models.Bookmark.title)
-        elif sort == 'date_added':
-            if order is not None and order.lower() == 'desc':
-                query = query.order_by(desc(models.Bookmark.date_added))
-            else:
-                query = query.order_by(models.Bookmark.date_added)
-        elif sort == 'date_edited':
-            if order is not None and order.lower() == 'desc':
-                query = query.order_by(models.Bookmark.date_edited)
-            else:
-                query = query.order_by(models.Bookmark.date_edited)
+        order: str,
+        limit: int = None,
+        cursor: str = None,
+        source=models.Bookmark,
+):
+    """
+    Listing query over the Bookmark mapping or, given as source, a table with the same
+    id, title, date_added and date_edited columns such as the bookmark_documents read model
+    """
+    query = select(source)
+    columns = source.c if isinstance(source, Table) else source
+
+    clause = get_filter_clause(filter, value, columns=columns) if filter is not None else None
+    query = query.where(columns.id.isnot(None) if clause is None else clause)
+
+    descending = order is not None and order.lower() == 'desc'
+
+    if sort in SORTABLE_COLUMNS:
+        column = getattr(columns, sort)
+        query = query.order_by(desc(column) if descending else column)
+        if sort != 'id' and (limit is not None or cursor is not None):
+            # the id breaks ties so that keyset pages never skip or repeat rows
+            query = query.order_by(desc(columns.id) if descending else columns.id)
+
+    if cursor is not None:
+        query = query.where(get_cursor_clause(cursor, sort, order, columns=columns))
+
+    if limit is not None:
+        query = query.limit(limit)
 
     return query
 
 
+FILTER_OPERATORS = {
+    'eq': operator.eq,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+}
+
+
+def get_filter_clause(
+        filter: str,
+        value: object,
+        op: str = 'eq',
+        columns=models.Bookmark,
+):
+    """
+    Builds the where clause for a get_query style filter, or None when the filter does not apply
+    """
+    compare = FILTER_OPERATORS.get(op or 'eq')
+    if compare is None:
+        raise ValueError(f'{op} is not a supported operator')
+
+    if filter == 'id':
+        return compare(columns.id, int(value))
+    elif filter == 'title' and isinstance(value, str):
+        return compare(columns.title, value)
+    elif filter == 'url' and isinstance(value, str):
+        if hasattr(columns, 'url'):
+            return compare(columns.url, value)
+        # the read model has no url column, its ids come from ix_bookmarks_url
+        return columns.id.in_(select(models.Bookmark.id).where(compare(models.Bookmark.url, value)))
+    elif filter in ('date_added', 'date_edited'):
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if isinstance(value, datetime):
+            return compare(getattr(columns, filter), value)
+
+    return None
+
+
+def encode_cursor(bookmark: dict, sort: str, order: str) -> str:
+    """
+    Builds the opaque cursor that points just after the given bookmark for the given sort
+    """
+    key = bookmark[sort]
+    if isinstance(key, datetime):
+        key = key.isoformat()
+
+    payload = json.dumps([sort, (order or 'asc').lower(), key, bookmark['id']])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        sort, order, key, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f'{cursor} is not a valid cursor')
+
+    if sort not in SORTABLE_COLUMNS:
+        raise ValueError(f'{cursor} is not a valid cursor')
+
+    if key is not None and sort in ('date_added', 'date_edited'):
+        key = datetime.fromisoformat(key)
+
+    return sort, order, key, id
+
+
+def get_cursor_clause(cursor: str, sort: str, order: str, columns=models.Bookmark):
+    """
+    Keyset predicate: only rows that sort after the cursor position, so no OFFSET scan is needed
+    """
+    cursor_sort, cursor_order, key, id = decode_cursor(cursor)
+    if cursor_sort != sort or cursor_order != (order or 'asc').lower():
+        raise ValueError('The cursor does not belong to this sort order')
+
+    descending = cursor_order == 'desc'
+    if sort == 'id':
+        return columns.id < id if descending else columns.id > id
+
+    # NULLs sort first ascending and last descending, and a row value comparison against
+    # NULL is never true, so they are matched separately
+    column = getattr(columns, sort)
+    if key is None:
+        if descending:
+            return and_(column.is_(None), columns.id < id)
+        return or_(and_(column.is_(None), columns.id > id), column.isnot(None))
+
+    if descending:
+        return or_(tuple_(column, columns.id) < tuple_(key, id), column.is_(None))
+    else:
+        return tuple_(column, columns.id) > tuple_(key, id)
+
+
 # DeleteBookmarkCommand: id: int
 def delete_bookmark(
     cmd: commands.DeleteBookmarkCommand,
@@ -190,20 +482,122 @@ def delete_bookmark(
 ):
     with uow:
         bookmark = {}
-        bookmark['id'] = cmd.id
-        uow.bookmarks.delete_one(bookmark)
+        bookmark['id'] = int(cmd.id)
+        cmd.deleted = uow.bookmarks.delete_one(bookmark)
+        if cmd.deleted:
+            uow.bookmarks.refresh_documents(ids=[bookmark['id']])
+            uow.add_event(events.BookmarkDeleted(id=bookmark['id']))
+        uow.commit()
+
+
+def is_id_list(ids) -> bool:
+    return isinstance(ids, list) and all(isinstance(id, int) and not isinstance(id, bool) for id in ids)
+
+
+# DeleteBookmarksCommand: ids: list[int] filter: str value: object op: str
+def delete_bookmarks(
+    cmd: commands.DeleteBookmarksCommand,
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    if (cmd.ids is None) == (cmd.filter is None):
+        raise Exception('Either a list of ids or a filter is required')
 
+    if cmd.ids is not None and not is_id_list(cmd.ids):
+        # a string would otherwise be taken apart into one id per digit
+        raise ValueError(f'{cmd.ids!r} is not a list of ids')
 
+    with uow:
+        if cmd.ids is not None:
+            ids = list(cmd.ids)
+            cmd.deleted = uow.bookmarks.delete_many([{'id': id} for id in ids])
+        else:
+            clause = get_filter_clause(cmd.filter, cmd.value, cmd.op)
+            if clause is None:
+                # never fall back to deleting everything
+                raise Exception(f'{cmd.filter} = {cmd.value} is not a valid filter')
+            ids = None
+            cmd.deleted = uow.bookmarks.delete_where(clause)
+
+        if cmd.deleted and ids is not None:
+            uow.bookmarks.refresh_documents(ids=ids)
+        elif cmd.deleted:
+            # deleted by a filter, the ids are not known
+            uow.bookmarks.prune_documents()
+        if cmd.deleted:
+            uow.add_event(events.BookmarksDeleted(ids=ids))
+        uow.commit()
+
+
+def invalidate_cached_bookmarks(
+    event: events.Event,
+    cache: BookmarkCache,
+):
+    if cache is None:
+        return
+
+    if isinstance(event, (events.BookmarkEdited, events.BookmarkDeleted)):
+        cache.invalidate(ids=[event.id])
+    elif isinstance(event, (events.BookmarksEdited, events.BookmarksDeleted)):
+        cache.invalidate(ids=event.ids)
+    else:
+        # new bookmarks only change query results
+        cache.invalidate(ids=[])
+
+
+def publish_events(
+    event: events.Event,
+    relay: OutboxRelay,
+):
+    # the event is in the outbox already, committed with its change; this only gets it to
+    # subscribers sooner than the standalone relay process would
+    if relay is None:
+        return
+
+    relay.relay_all()
+
+
+# handlers that readers depend on, they always finish before handle() returns; the rest may
+# run on the background dispatcher (see bootstrap.bootstrap)
+INLINE_EVENT_HANDLERS = {invalidate_cached_bookmarks}
+
+# the read model is written by the command handlers themselves, in the write's transaction
 EVENT_HANDLERS = {
-    events.BookmarkAdded: [add_bookmark],
-    events.BookmarksListed: [list_bookmarks],
-    events.BookmarkDeleted: [delete_bookmark],
-    events.BookmarkEdited: [edit_bookmark],
+    events.BookmarkAdded: [invalidate_cached_bookmarks, publish_events],
+    events.BookmarksAdded: [invalidate_cached_bookmarks, publish_events],
+    events.BookmarksListed: [],
+    events.BookmarkDeleted: [invalidate_cached_bookmarks, publish_events],
+    events.BookmarksDeleted: [invalidate_cached_bookmarks, publish_events],
+    events.BookmarkEdited: [invalidate_cached_bookmarks, publish_events],
+    events.BookmarksEdited: [invalidate_cached_bookmarks, publish_events],
 }  # type: Dict[Type[events.Event], List[Callable]]
 
+# commands that never write, the bus may give them a unit of work on a read only engine
+READ_ONLY_COMMANDS = {
+    commands.ListBookmarksCommand,
+    commands.GetBookmarkCommand,
+    commands.SearchBookmarksCommand,
+    commands.FindDuplicateBookmarksCommand,
+    commands.GetBookmarksVersionCommand,
+}
+
 COMMAND_HANDLERS = {
     commands.AddBookmarkCommand: add_bookmark,
+    commands.AddBookmarksBatchCommand: add_bookmarks_batch,
     commands.ListBookmarksCommand: list_bookmarks,
+    commands.GetBookmarkCommand: get_bookmark,
+    commands.SearchBookmarksCommand: search_bookmarks,
+    commands.FindDuplicateBookmarksCommand: find_duplicate_bookmarks,
+    commands.GetBookmarksVersionCommand: get_bookmarks_version,
     commands.DeleteBookmarkCommand: delete_bookmark,
+    commands.DeleteBookmarksCommand: delete_bookmarks,
     commands.EditBookmarkCommand: edit_bookmark,
-}  # type: Dict[Type[commands.Command], Callable]
\ No newline at end of file
+    commands.EditBookmarksBatchCommand: edit_bookmarks_batch,
+}  # type: Dict[Type[commands.Command], Callable]
+
+# native coroutines for AsyncMessageBus, every other handler is run on a worker thread
+ASYNC_COMMAND_HANDLERS = {
+    commands.GetBookmarkCommand: get_bookmark_async,
+    commands.GetBookmarksVersionCommand: get_bookmarks_version_async,
+    commands.SearchBookmarksCommand: search_bookmarks_async,
+    commands.FindDuplicateBookmarksCommand: find_duplicate_bookmarks_async,
+}  # type: Dict[Type[commands.Command], Callable]
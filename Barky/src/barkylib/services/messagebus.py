@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import functools
 import logging
-from typing import TYPE_CHECKING, Callable, Dict, List, Type, Union
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Deque, Dict, List, Type, Union
 
 from barkylib.domain import commands, events
 
 if TYPE_CHECKING:
+    from barkylib.adapters.metrics import Metrics
     from . import unit_of_work
+    from .dispatcher import BackgroundEventDispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -14,43 +19,173 @@ Message = Union[commands.Command, events.Event]
 
 
 class MessageBus:
+    """
+    Dispatches commands and the events they raise. The queue lives in each handle() call
+    and every message gets a fresh unit of work from uow_factory, so one bus can serve
+    many threads at once. Handlers take (message, uow), see bootstrap.bootstrap.
+
+    With a dispatcher, background_event_handlers run on its worker pool and handle() returns
+    once the command and the inline event handlers are done; without one they run inline.
+
+    With metrics, every handler run is recorded per message type: handler time, time spent
+    in the repository and events raised. Without it handlers are called directly.
+
+    With read_uow_factory, the commands in read_only_commands get their unit of work from it
+    (e.g. on a query_only engine) and everything else from uow_factory.
+    """
+
     def __init__(
         self,
-        uow: unit_of_work.AbstractUnitOfWork,
+        uow_factory: Callable[[], unit_of_work.AbstractUnitOfWork],
         event_handlers: Dict[Type[events.Event], List[Callable]],
         command_handlers: Dict[Type[commands.Command], Callable],
+        background_event_handlers: Dict[Type[events.Event], List[Callable]] = None,
+        dispatcher: BackgroundEventDispatcher = None,
+        metrics: Metrics = None,
+        read_uow_factory: Callable[[], unit_of_work.AbstractUnitOfWork] = None,
+        read_only_commands: set = frozenset(),
     ):
-        self.uow = uow
+        self.uow_factory = uow_factory
         self.event_handlers = event_handlers
         self.command_handlers = command_handlers
+        self.background_event_handlers = background_event_handlers or dict()
+        self.dispatcher = dispatcher
+        self.metrics = metrics
+        self.read_uow_factory = read_uow_factory
+        self.read_only_commands = read_only_commands
 
     def handle(self, message: Message):
-        self.queue = [message]
-        while self.queue:
-            message = self.queue.pop(0)
+        queue = deque([message])
+        while queue:
+            message = queue.popleft()
+            if isinstance(message, events.Event):
+                self.handle_event(message, queue)
+            elif isinstance(message, commands.Command):
+                self.handle_command(message, queue)
+            else:
+                raise Exception(f"{message} was not an Event or Command")
+
+    def handle_event(self, event: events.Event, queue: Deque[Message]):
+        background = self.background_event_handlers.get(type(event), [])
+        if self.dispatcher is None:
+            handlers, background = self.event_handlers[type(event)] + background, []
+        else:
+            handlers = self.event_handlers[type(event)]
+
+        for handler in handlers:
+            try:
+                logger.debug("handling event %s with handler %s", event, handler)
+                uow = self.uow_factory()
+                queue.extend(self.run_handler(handler, event, uow, "event"))
+            except Exception:
+                logger.exception("Exception handling event %s", event)
+                continue
+
+        for handler in background:
+            logger.debug("dispatching event %s to handler %s", event, handler)
+            # one handler is injected once per event type, its concurrency limit covers all of them
+            key = getattr(handler, "__wrapped__", handler)
+            self.dispatcher.dispatch(key, functools.partial(self.handle_in_background, handler, event))
+
+    def handle_in_background(self, handler: Callable, event: events.Event):
+        # runs on a dispatcher worker, events the handler raises are handled from there
+        uow = self.uow_factory()
+        for new_event in self.run_handler(handler, event, uow, "event"):
+            self.handle(new_event)
+
+    def run_handler(self, handler: Callable, message: Message, uow: unit_of_work.AbstractUnitOfWork, kind: str) -> list:
+        """
+        Runs handler on message and returns the events it raised
+        """
+        if self.metrics is None:
+            handler(message, uow)
+            return list(uow.collect_new_events())
+
+        stats = getattr(uow, "query_stats", None)
+        db_start = stats.seconds if stats is not None else 0.0
+        start = time.perf_counter()
+        outcome, new_events = "error", []
+        try:
+            handler(message, uow)
+            new_events = list(uow.collect_new_events())
+            outcome = "ok"
+            return new_events
+        finally:
+            self.metrics.observe_message(
+                type(message).__name__, kind, outcome, time.perf_counter() - start,
+                stats.seconds - db_start if stats is not None else 0.0, len(new_events),
+            )
+
+    def shutdown(self, timeout: float = None) -> bool:
+        """
+        Drains the background event handlers, call before the process exits
+        """
+        if self.dispatcher is None:
+            return True
+
+        return self.dispatcher.shutdown(timeout)
+
+    def handle_command(self, command: commands.Command, queue: Deque[Message]):
+        logger.debug("handling command %s", command)
+        try:
+            handler = self.command_handlers[type(command)]
+            if self.read_uow_factory is not None and type(command) in self.read_only_commands:
+                uow = self.read_uow_factory()
+            else:
+                uow = self.uow_factory()
+            queue.extend(self.run_handler(handler, command, uow, "command"))
+        except Exception:
+            logger.exception("Exception handling command %s", command)
+            raise
+
+
+class AsyncMessageBus:
+    """
+    Asyncio counterpart of MessageBus for ASGI style deployments. Every message gets its own
+    unit of work from uow_factory, so any number of handle() calls can run concurrently on
+    one event loop. Handlers are coroutines taking (message, uow), see bootstrap.bootstrap
+    with async_mode=True.
+    """
+
+    def __init__(
+        self,
+        uow_factory: Callable[[], unit_of_work.AsyncUnitOfWork],
+        event_handlers: Dict[Type[events.Event], List[Callable]],
+        command_handlers: Dict[Type[commands.Command], Callable],
+    ):
+        self.uow_factory = uow_factory
+        self.event_handlers = event_handlers
+        self.command_handlers = command_handlers
+
+    async def handle(self, message: Message):
+        queue = deque([message])
+        while queue:
+            message = queue.popleft()
             if isinstance(message, events.Event):
-                self.handle_event(message)
+                await self.handle_event(message, queue)
             elif isinstance(message, commands.Command):
-                self.handle_command(message)
+                await self.handle_command(message, queue)
             else:
                 raise Exception(f"{message} was not an Event or Command")
 
-    def handle_event(self, event: events.Event):
+    async def handle_event(self, event: events.Event, queue: Deque[Message]):
         for handler in self.event_handlers[type(event)]:
             try:
                 logger.debug("handling event %s with handler %s", event, handler)
-                handler(event)
-                self.queue.extend(self.uow.collect_new_events())
+                uow = self.uow_factory()
+                await handler(event, uow)
+                queue.extend(uow.collect_new_events())
             except Exception:
                 logger.exception("Exception handling event %s", event)
                 continue
 
-    def handle_command(self, command: commands.Command):
+    async def handle_command(self, command: commands.Command, queue: Deque[Message]):
         logger.debug("handling command %s", command)
         try:
             handler = self.command_handlers[type(command)]
-            handler(command)
-            self.queue.extend(self.uow.collect_new_events())
+            uow = self.uow_factory()
+            await handler(command, uow)
+            queue.extend(uow.collect_new_events())
         except Exception:
             logger.exception("Exception handling command %s", command)
             raise
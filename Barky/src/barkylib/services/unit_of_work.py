@@ -1,18 +1,28 @@
 from __future__ import annotations
 
 import abc
+import asyncio
+import functools
 from abc import ABC
 
 from barkylib import config
-from barkylib.adapters import repository
+from barkylib.adapters import migrations, outbox, profiler, repository
+from barkylib.adapters.metrics import QueryStats
 from barkylib.adapters.orm import mapper_registry
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 
 
 class AbstractUnitOfWork(ABC):
     bookmarks: repository.AbstractRepository
+    cache = None
+    metrics = None
+
+    def __init__(self):
+        # events raised by handlers for changes that have no loaded bookmark to carry them
+        self.events = list()
 
     def __enter__(self) -> AbstractUnitOfWork:
         return self
@@ -23,10 +33,17 @@ class AbstractUnitOfWork(ABC):
     def commit(self):
         self._commit()
 
+    def add_event(self, event):
+        self.events.append(event)
+
     def collect_new_events(self):
-        for bookmark in self.bookmarks.seen:
+        # handlers that never enter the unit of work have no repository
+        seen = self.bookmarks.seen if hasattr(self, "bookmarks") else ()
+        for bookmark in seen:
             while bookmark.events:
                 yield bookmark.events.pop(0)
+        while self.events:
+            yield self.events.pop(0)
 
     @abc.abstractmethod
     def _commit(self):
@@ -37,31 +54,203 @@ class AbstractUnitOfWork(ABC):
         raise NotImplementedError
 
 
-DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(
-        config.get_sqlite_file_url(),
+def create_sqlite_engine(
+    url: str,
+    journal_mode: str = None,
+    synchronous: str = None,
+    mmap_size: int = None,
+    cache_size: int = None,
+    busy_timeout: int = None,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    read_only: bool = False,
+    profile_queries: bool = False,
+    slow_query_ms: float = None,
+    explain_slow_queries: bool = True,
+):
+    """
+    Builds a SQLite engine whose connections all get the given pragmas through a connect
+    hook, e.g. WAL so readers no longer block on writers and synchronous=NORMAL so a commit
+    does not wait for a full journal fsync. Settings left as None keep the SQLite default.
+
+    profile_queries times every statement for profiler.profile() blocks and logs the ones
+    slower than slow_query_ms, see adapters/profiler.py.
+    """
+    engine = create_engine(
+        url,
         isolation_level="SERIALIZABLE",
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        connect_args={"check_same_thread": False},
+    )
+
+    pragmas = [
+        ("busy_timeout", busy_timeout),
+        ("journal_mode", journal_mode),
+        ("synchronous", synchronous),
+        ("mmap_size", mmap_size),
+        ("cache_size", cache_size),
+        ("query_only", 1 if read_only else None),
+    ]
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            if value is not None:
+                cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    if profile_queries:
+        profiler.instrument_engine(engine, slow_query_ms, explain_slow_queries)
+
+    return engine
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_session_factory() -> sessionmaker:
+    """
+    Session factory for the configured database, the engine is created on first use rather
+    than at import
+    """
+    return sessionmaker(
+        bind=create_sqlite_engine(
+            config.get_sqlite_file_url(),
+            **config.get_sqlite_engine_profile(),
+            **config.get_query_profiler_settings(),
+        )
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_read_session_factory() -> sessionmaker:
+    """
+    Session factory for the read only commands, see handlers.READ_ONLY_COMMANDS: with
+    SQLITE_READ_ONLY=1 a second engine on the same file whose connections cannot write,
+    otherwise None and reads share the default one
+    """
+    if not config.get_sqlite_read_only():
+        return None
+
+    return sessionmaker(
+        bind=create_sqlite_engine(
+            config.get_sqlite_file_url(),
+            **config.get_sqlite_engine_profile(),
+            **config.get_query_profiler_settings(),
+            read_only=True,
+        )
     )
-)
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
-        self.session_factory = session_factory
-        mapper_registry.metadata.create_all(self.session_factory().get_bind())
+    """
+    Re-entrant: a handler that calls another handler with the same unit of work nests
+    `with uow:` blocks, and all of them share the session and transaction of the outermost
+    one. A commit() inside a nested block is deferred to the end of the outermost block, so
+    a message commits once or not at all. sessions_opened and transactions_committed count
+    what actually reached the database.
+
+    With metrics, repository calls are counted in query_stats and in the metrics.Metrics
+    registry.
+    """
+
+    def __init__(self, session_factory=None, cache=None, create_schema=True, metrics=None):
+        super().__init__()
+        self.session_factory = session_factory or get_default_session_factory()
+        self.cache = cache
+        self.metrics = metrics
+        self.query_stats = QueryStats()
+        self.unsaved_events = list()
+        self.depth = 0
+        self.commit_requested = False
+        self.sessions_opened = 0
+        self.transactions_committed = 0
+        if create_schema:
+            engine = self.session_factory().get_bind()
+            mapper_registry.metadata.create_all(engine)
+            migrations.upgrade(engine)
 
     def __enter__(self):
-        self.session = self.session_factory()  # type: Session
-        self.bookmarks = repository.SqlAlchemyRepository(self.session)
+        if self.depth == 0:
+            self.session = self.session_factory()  # type: Session
+            self.sessions_opened += 1
+            self.bookmarks = repository.SqlAlchemyRepository(self.session)
+            if self.metrics is not None:
+                self.bookmarks = repository.MeteredRepository(self.bookmarks, self.metrics, self.query_stats)
+            if self.cache is not None:
+                self.bookmarks = repository.CachingRepository(self.bookmarks, self.cache)
+        self.depth += 1
 
         return super().__enter__()
 
-    def __exit__(self, *args):
-        super().__exit__(*args)
-        self.session.close()
+    def __exit__(self, exc_type, *args):
+        self.depth -= 1
+        if self.depth > 0:
+            return
+
+        try:
+            if exc_type is None and self.commit_requested:
+                self._commit()
+            super().__exit__(exc_type, *args)
+        finally:
+            self.commit_requested = False
+            self.session.close()
+
+    def commit(self):
+        if self.depth > 1:
+            self.commit_requested = True
+        else:
+            self._commit()
+
+    def add_event(self, event):
+        super().add_event(event)
+        self.unsaved_events.append(event)
 
     def _commit(self):
+        # the events go out through the outbox, committed together with the change
+        outbox.write_events(self.session, self.unsaved_events)
+        self.unsaved_events.clear()
         self.session.commit()
+        self.commit_requested = False
+        self.transactions_committed += 1
 
     def rollback(self):
+        self.unsaved_events.clear()
         self.session.rollback()
+
+
+class AsyncUnitOfWork:
+    """
+    Async wrapper around a synchronous unit of work: entering, committing and every
+    repository call are offloaded to a worker thread, and uow.bookmarks is a
+    repository.AsyncRepository whose methods are awaited. Use one instance per message,
+    two coroutines must not share it.
+    """
+
+    def __init__(self, uow: AbstractUnitOfWork):
+        self.uow = uow
+
+    @property
+    def cache(self):
+        return self.uow.cache
+
+    async def __aenter__(self) -> AsyncUnitOfWork:
+        await asyncio.to_thread(self.uow.__enter__)
+        self.bookmarks = repository.AsyncRepository(self.uow.bookmarks)
+        return self
+
+    async def __aexit__(self, *args):
+        await asyncio.to_thread(self.uow.__exit__, *args)
+
+    async def commit(self):
+        await asyncio.to_thread(self.uow.commit)
+
+    async def rollback(self):
+        await asyncio.to_thread(self.uow.rollback)
+
+    def add_event(self, event):
+        self.uow.add_event(event)
+
+    def collect_new_events(self):
+        return self.uow.collect_new_events()
@@ -1,6 +1,8 @@
+import fnmatch
 import os
 import shutil
 import subprocess
+import threading
 import time
 from pathlib import Path
 
@@ -41,6 +43,124 @@ def flask_api(session):
 def test_client(flask_api):
     return flask_api.test_client()
 
+class InMemoryRedis:
+    """
+    Stand-in for the redis.Redis calls the shared cache makes, values are bytes like Redis returns
+    """
+
+    def __init__(self):
+        self.data = dict()
+        self.expires = dict()
+        # bumped on every write to a key, for WATCH
+        self.versions = dict()
+        self.lock = threading.RLock()
+
+    def _live(self, name):
+        if name in self.expires and self.expires[name] <= time.monotonic():
+            self.data.pop(name, None)
+            self.expires.pop(name, None)
+        return name in self.data
+
+    def _touch(self, name):
+        self.versions[name] = self.versions.get(name, 0) + 1
+
+    def get(self, name):
+        with self.lock:
+            return self.data[name] if self._live(name) else None
+
+    def mget(self, names):
+        with self.lock:
+            return [self.get(name) for name in names]
+
+    def set(self, name, value, ex=None, px=None, nx=False):
+        with self.lock:
+            if nx and self._live(name):
+                return None
+            self.data[name] = value if isinstance(value, bytes) else str(value).encode()
+            self._touch(name)
+            self.expires.pop(name, None)
+            if ex is not None or px is not None:
+                self.expires[name] = time.monotonic() + (ex if ex is not None else px / 1000)
+            return True
+
+    def incr(self, name):
+        with self.lock:
+            value = int(self.get(name) or 0) + 1
+            self.data[name] = str(value).encode()
+            self._touch(name)
+            return value
+
+    def delete(self, *names):
+        with self.lock:
+            for name in names:
+                self._touch(name)
+            return sum(self.data.pop(name, None) is not None for name in names)
+
+    def scan_iter(self, match="*"):
+        with self.lock:
+            return [name for name in list(self.data) if self._live(name) and fnmatch.fnmatchcase(name, match)]
+
+    def pipeline(self, transaction=True):
+        return InMemoryPipeline(self)
+
+
+class InMemoryPipeline:
+    """
+    Queues calls until execute(), which runs them under the server lock. After watch() calls
+    run straight away until multi(), and execute() raises WatchError if a watched key was
+    written in the meantime, like redis-py's pipeline
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = list()
+        self.watched = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.reset()
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+        if self.watched is not None and self.watched[1]:
+            return method
+
+        def queue(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def watch(self, *names):
+        with self.redis.lock:
+            self.watched = ({name: self.redis.versions.get(name, 0) for name in names}, True)
+
+    def multi(self):
+        self.watched = (self.watched[0], False) if self.watched is not None else None
+
+    def reset(self):
+        self.calls = list()
+        self.watched = None
+
+    def execute(self):
+        with self.redis.lock:
+            try:
+                if self.watched is not None and any(
+                    self.redis.versions.get(name, 0) != version for name, version in self.watched[0].items()
+                ):
+                    raise redis.exceptions.WatchError("Watched variable changed.")
+                return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+            finally:
+                self.reset()
+
+
+@pytest.fixture
+def memory_redis():
+    return InMemoryRedis()
+
+
 @pytest.fixture
 def in_memory_sqlite_db():
     engine = create_engine("sqlite:///:memory:")
@@ -1,10 +1,12 @@
 import json
 import os
+import time
 from pathlib import Path
 
 import pytest
 import requests
 from barkylib import config
+from barkylib.api import flaskapi
 from barkylib.domain.models import Bookmark
 
 
@@ -26,6 +28,35 @@ def test_api_add(test_client):
     assert r.status_code == 201
 
 
+def test_api_add_bulk(test_client):
+    indexes = [1, 2, 3]
+    for index in indexes:
+        cleanup(test_client, index)
+    add_bookmark(test_client, 1)
+
+    url = config.get_api_url()+'/api/add/bulk'
+    rows = [{"title": str(index), "url": "http://test"+str(index)+".com"} for index in indexes]
+    rows.append({"title": "2", "url": "http://test2.com"})
+    rows.append({"title": "no url"})
+    # only non-empty strings are accepted, a bad row does not fail the batch
+    rows.append({"title": "number url", "url": 5})
+    rows.append({"title": 5, "url": "http://test5.com"})
+
+    r = test_client.post(url, json=rows)
+    assert r.status_code == 201
+
+    data = json.loads(r.data)
+    assert data['added'] == 2
+    assert [result['status'] for result in data['results']] == [
+        'duplicate', 'added', 'added', 'duplicate', 'invalid', 'invalid', 'invalid',
+    ]
+    assert test_client.get(config.get_api_url()+'/api/first/title/number url/title').status_code == 204
+    assert get_test_bookmark(test_client, 3)['url'] == 'http://test3.com'
+
+    for index in indexes:
+        cleanup(test_client, index)
+
+
 def test_get_all(test_client):
     cleanup(test_client, 1)
     cleanup(test_client, 2)
@@ -63,6 +94,68 @@ def test_edit(test_client):
     cleanup(test_client, index)
 
 
+def test_edit_bulk(test_client):
+    indexes = [1, 2]
+    bmarks = list()
+    for index in indexes:
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+        bmarks.append(get_test_bookmark(test_client, index))
+
+    url = config.get_api_url()+'/api/edit/bulk'
+    r = test_client.patch(url, json=[
+        {"id": bmarks[0]['id'], "notes": "bulk notes"},
+        {"id": bmarks[1]['id'], "url": "http://bulk.com", "notes": "bulk notes"},
+    ])
+    assert r.status_code == 200
+    assert json.loads(r.data)['updated'] == 2
+
+    first, second = get_test_bookmark(test_client, 1), get_test_bookmark(test_client, 2)
+    assert first['notes'] == second['notes'] == 'bulk notes'
+    assert first['url'] == 'http://test1.com'
+    assert second['url'] == 'http://bulk.com'
+
+    r = test_client.patch(url, json=[{"notes": "no id"}])
+    assert r.status_code == 400
+
+    for index in indexes:
+        cleanup(test_client, index)
+
+
+def test_delete_bulk(test_client):
+    indexes = [1, 2, 3]
+    ids = list()
+    for index in indexes:
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+        ids.append(get_test_bookmark(test_client, index)['id'])
+
+    url = config.get_api_url()+'/api/delete/bulk'
+    r = test_client.post(url, json={"ids": ids[:2] + [-1]})
+    assert r.status_code == 200
+    assert json.loads(r.data)['deleted'] == 2
+
+    r = test_client.post(url, json={"filter": "title", "value": "3"})
+    assert json.loads(r.data)['deleted'] == 1
+    assert get_test_bookmark(test_client, 3) is None
+
+    # an unknown filter must never turn into a delete of everything
+    r = test_client.post(url, json={"filter": "unknown", "value": "3"})
+    assert r.status_code == 400
+    r = test_client.post(url, json={})
+    assert r.status_code == 400
+
+    # a string of digits is not a list of ids
+    cleanup(test_client, 1)
+    add_bookmark(test_client, 1)
+    id = get_test_bookmark(test_client, 1)['id']
+    for ids in [str(id), [str(id)], [id, None], {"id": id}]:
+        r = test_client.post(url, json={"ids": ids})
+        assert r.status_code == 400
+    assert get_test_bookmark(test_client, 1)['id'] == id
+    cleanup(test_client, 1)
+
+
 def test_get_one(test_client):
     index = 1
     cleanup(test_client, index)
@@ -75,6 +168,249 @@ def test_get_one(test_client):
 
     assert bmark['title'] == json.loads(r.data)['title']
 
+    cleanup(test_client, index)
+
+    r = test_client.get(f'{url}')
+    assert r.status_code == 204
+
+    # deleting something that is not there is reported
+    r = test_client.get(config.get_api_url()+'/api/delete/'+str(bmark['id']))
+    assert r.status_code == 400
+
+
+def test_get_all_paged(test_client):
+    indexes = [1, 2, 3]
+    for index in indexes:
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+
+    for sort, order in [('id', 'asc'), ('title', 'desc')]:
+        url = config.get_api_url()+'/api/all?limit=2&sort='+sort+'&order='+order
+        seen = list()
+        cursor = None
+        while True:
+            r = test_client.get(url + ('&cursor=' + cursor if cursor else ''))
+            assert r.status_code == 200
+            page = json.loads(r.data)
+            assert len(page['bookmarks']) <= 2
+            seen.extend(page['bookmarks'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        keys = [bmark[sort] for bmark in seen]
+        # every row shows up exactly once and in order
+        assert len(set(bmark['id'] for bmark in seen)) == len(seen)
+        assert keys == sorted(keys, reverse=order == 'desc')
+        assert set(str(index) for index in indexes) <= set(bmark['title'] for bmark in seen)
+
+    r = test_client.get(config.get_api_url()+'/api/all?limit=2&cursor=garbage')
+    assert r.status_code == 400
+
+    # the read model cannot sort on url, say so rather than fail on the missing column
+    r = test_client.get(config.get_api_url()+'/api/all?limit=2&sort=url')
+    assert r.status_code == 400
+    assert b'url is not a sortable column' in r.data
+
+    for index in indexes:
+        cleanup(test_client, index)
+
+
+def test_first_honours_order(test_client):
+    indexes = [1, 2, 3]
+    for index in indexes:
+        cleanup(test_client, index)
+    # one batch, so every row has the same date_added
+    test_client.post(config.get_api_url()+'/api/add/bulk', json=[
+        {"title": str(index), "url": "http://test"+str(index)+".com"} for index in indexes
+    ])
+    bookmarks = [get_test_bookmark(test_client, index) for index in indexes]
+
+    url = config.get_api_url()+'/api/first/date_added/'+bookmarks[0]['date_added']+'/id'
+    assert json.loads(test_client.get(url).data)['id'] == bookmarks[0]['id']
+    assert json.loads(test_client.get(url+'?order=desc').data)['id'] == bookmarks[-1]['id']
+
+    for index in indexes:
+        cleanup(test_client, index)
+
+
+def test_get_all_streamed(test_client):
+    indexes = [1, 2, 3]
+    for index in indexes:
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+
+    url = config.get_api_url()+'/api/all?sort=id'
+    listed = json.loads(test_client.get(url).data)
+
+    r = test_client.get(url + '&stream=json')
+    assert r.status_code == 200
+    assert r.is_streamed
+    assert json.loads(r.data) == listed
+
+    r = test_client.get(url + '&stream=ndjson')
+    assert r.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in r.data.splitlines()] == listed
+
+    r = test_client.get(url + '&stream=xml')
+    assert r.status_code == 400
+
+    for index in indexes:
+        cleanup(test_client, index)
+
+
+def test_search(test_client):
+    indexes = [1, 2, 3]
+    for index in indexes:
+        cleanup(test_client, index)
+    test_client.post(config.get_api_url()+'/api/add/bulk', json=[
+        {"title": str(index), "url": "http://test"+str(index)+".com", "notes": "searchable e2e note"}
+        for index in indexes
+    ])
+
+    url = config.get_api_url()+'/api/search?q=searchable+e2e&limit=2'
+    r = test_client.get(url)
+    assert r.status_code == 200
+    page = json.loads(r.data)
+    assert len(page['bookmarks']) == 2
+
+    r = test_client.get(url + '&cursor=' + page['next_cursor'])
+    last = json.loads(r.data)
+    assert len(last['bookmarks']) == 1
+    assert last['next_cursor'] is None
+    assert sorted(bmark['title'] for bmark in page['bookmarks'] + last['bookmarks']) == ['1', '2', '3']
+
+    assert test_client.get(config.get_api_url()+'/api/search').status_code == 400
+
+    for index in indexes:
+        cleanup(test_client, index)
+
+
+def test_conditional_get(test_client):
+    cleanup(test_client, 1)
+    add_bookmark(test_client, 1)
+    url = config.get_api_url()+'/api/all'
+
+    # no Last-Modified within the second of the write, a date could not tell the two apart
+    r = test_client.get(url)
+    assert 'Last-Modified' not in r.headers
+    time.sleep(1)
+
+    r = test_client.get(url)
+    etag = r.headers['ETag']
+    last_modified = r.headers['Last-Modified']
+    assert r.status_code == 200
+
+    r = test_client.get(url, headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.data == b''
+    assert r.headers['ETag'] == etag
+
+    r = test_client.get(url, headers={'If-Modified-Since': last_modified})
+    assert r.status_code == 304
+
+    # a cache invalidation moves the ETag on even when the version stays, a body served
+    # before it may have come from the old cache
+    cache = flaskapi.get_bus().uow_factory().cache
+    if cache is not None:
+        cache.invalidate(ids=[])
+        r = test_client.get(url, headers={'If-None-Match': etag})
+        assert r.status_code == 200
+        etag = r.headers['ETag']
+
+    # any write moves the version on
+    cleanup(test_client, 1)
+    r = test_client.get(url, headers={'If-None-Match': etag})
+    assert r.status_code != 304
+    assert r.headers.get('ETag') != etag
+
+
+def test_duplicates(test_client):
+    indexes = [1, 2, 3]
+    for index in indexes:
+        cleanup(test_client, index)
+    add_bookmark(test_client, 1)
+
+    # same url under another title is not added again
+    url = config.get_api_url()+'/api/add'
+    test_client.post(url, json={"title": "2", "url": "HTTP://test1.com/?utm_campaign=e2e"})
+    assert get_test_bookmark(test_client, 2) is None
+
+    r = test_client.post(config.get_api_url()+'/api/add/bulk', json=[
+        {"title": "2", "url": "http://test1.com/#again"},
+        {"title": "3", "url": "http://test3.com"},
+    ])
+    assert [result['status'] for result in json.loads(r.data)['results']] == ['duplicate', 'added']
+
+    # rows edited onto the same url are reported
+    bmark = get_test_bookmark(test_client, 3)
+    test_client.post(config.get_api_url()+'/api/edit/'+str(bmark['id']), json={"url": "http://test1.com/"})
+    r = test_client.get(config.get_api_url()+'/api/duplicates')
+    assert r.status_code == 200
+    groups = [group for group in json.loads(r.data)['duplicates'] if group['bookmarks'][0]['title'] in ('1', '3')]
+    assert len(groups) == 1
+    assert groups[0]['count'] == 2
+    assert [bmark['title'] for bmark in groups[0]['bookmarks']] == ['1', '3']
+
+    for index in indexes:
+        cleanup(test_client, index)
+
+
+def test_metrics(test_client):
+    cleanup(test_client, 1)
+    add_bookmark(test_client, 1)
+    get_test_bookmark(test_client, 1)
+
+    r = test_client.get(config.get_api_url()+'/api/metrics')
+    assert r.status_code == 200
+    assert r.mimetype == 'text/plain'
+    text = r.data.decode()
+    assert 'barky_messages_total{type="AddBookmarkCommand",kind="command",outcome="ok"}' in text
+    assert 'barky_message_handler_seconds_count{type="ListBookmarksCommand"}' in text
+    assert 'barky_repository_queries_total{method="find_documents"}' in text
+
+    cleanup(test_client, 1)
+
+
+def test_errors_are_logged_not_echoed(test_client, caplog):
+    for index in (1, 2):
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+    id = get_test_bookmark(test_client, 1)['id']
+
+    # renaming onto a title that is taken violates the unique index
+    with caplog.at_level('ERROR', logger='barkylib.api.flaskapi'):
+        r = test_client.post(config.get_api_url()+'/api/edit/'+str(id), json={'title': '2'})
+    assert r.status_code == 400
+    assert r.data == b'conflicts with an existing bookmark'
+    assert 'UNIQUE constraint failed' in caplog.text
+
+    text = test_client.get(config.get_api_url()+'/api/metrics').data.decode()
+    assert 'barky_api_errors_total{endpoint="update",error="IntegrityError"} 1' in text
+
+    for index in (1, 2):
+        cleanup(test_client, index)
+
+
+def test_query_profile_headers(test_client):
+    cleanup(test_client, 1)
+    add_bookmark(test_client, 1)
+    id = get_test_bookmark(test_client, 1)['id']
+    url = config.get_api_url()+'/api/one/'+str(id)
+
+    test_client.application.debug = True
+    first = test_client.get(url)
+    second = test_client.get(url)
+
+    assert float(first.headers['X-DB-Time']) >= 0
+    # the second read is answered from the cache, only the version check queries
+    assert int(second.headers['X-Query-Count']) < int(first.headers['X-Query-Count'])
+
+    test_client.application.debug = False
+    assert 'X-Query-Count' not in test_client.get(url).headers
+
+    cleanup(test_client, 1)
+
 
 def add_bookmark(test_client, index):
     url = config.get_api_url()+'/api/add'
@@ -0,0 +1,374 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pytest
+from barkylib import bootstrap
+from barkylib.adapters import read_model
+from barkylib.adapters.orm import bookmark_documents
+from barkylib.adapters.outbox import OutboxRelay
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.adapters.metrics import Metrics
+from barkylib.domain import commands, events
+from barkylib.services import handlers
+from barkylib.services.dispatcher import BackgroundEventDispatcher
+from barkylib.services.unit_of_work import SqlAlchemyUnitOfWork, create_sqlite_engine
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+@pytest.fixture
+def file_session_factory(tmp_path):
+    # a file database, worker threads would each get their own :memory: one
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'bookmarks.db'}", journal_mode="WAL", busy_timeout=5000)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def test_bus_is_thread_safe(file_session_factory):
+    bus = bootstrap.bootstrap(start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache())
+
+    def add_and_read(index):
+        bus.handle(commands.AddBookmarkCommand(
+            id=None, title=str(index), url=f"http://test{index}.com", notes=None,
+            date_added=None, date_edited=None,
+        ))
+        cmd = commands.ListBookmarksCommand(filter="title", value=str(index), order_by="id", order=None)
+        bus.handle(cmd)
+        return cmd.bookmarks
+
+    # every request has its own queue and unit of work, nothing is shared between threads
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(add_and_read, range(40)))
+
+    assert [[bookmark["title"] for bookmark in bookmarks] for bookmarks in results] == [[str(index)] for index in range(40)]
+
+
+def test_background_event_handlers(file_session_factory, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    handled = list()
+
+    def slow_subscriber(event: events.BookmarkAdded):
+        started.set()
+        release.wait(5)
+        handled.append(event.title)
+
+    monkeypatch.setitem(
+        handlers.EVENT_HANDLERS, events.BookmarkAdded,
+        handlers.EVENT_HANDLERS[events.BookmarkAdded] + [slow_subscriber],
+    )
+    cache = BookmarkCache()
+    bus = bootstrap.bootstrap(
+        start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=cache,
+        dispatcher=BackgroundEventDispatcher(max_workers=2),
+    )
+    generation = cache.generation
+
+    bus.handle(commands.AddBookmarkCommand(
+        id=None, title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None,
+    ))
+
+    # the command returned while the subscriber is still running, cache invalidation stayed inline
+    assert started.wait(5)
+    assert handled == []
+    assert cache.generation > generation
+
+    release.set()
+    assert bus.shutdown(timeout=5)
+    assert handled == ["1"]
+
+
+def test_events_are_published_from_the_worker_pool(file_session_factory):
+    published = list()
+
+    class Publisher:
+        def publish_batch(self, messages):
+            published.append((threading.current_thread(), [channel for channel, message in messages]))
+
+    bus = bootstrap.bootstrap(
+        start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache(),
+        dispatcher=BackgroundEventDispatcher(max_workers=2),
+        relay=OutboxRelay(file_session_factory, Publisher()),
+    )
+
+    bus.handle(commands.AddBookmarkCommand(
+        id=None, title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None,
+    ))
+    assert bus.shutdown(timeout=5)
+    assert [channels for thread, channels in published] == [["BookmarkAdded"]]
+    assert published[0][0] is not threading.current_thread()
+
+    # after shutdown the handlers run inline rather than failing a committed command
+    bus.handle(commands.DeleteBookmarkCommand(id=1))
+    assert [channels for thread, channels in published][-1] == ["BookmarkDeleted"]
+
+
+def test_publishing_events_needs_a_dispatcher(file_session_factory):
+    with pytest.raises(ValueError):
+        bootstrap.bootstrap(
+            start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache(),
+            relay=OutboxRelay(file_session_factory, None),
+        )
+
+
+def test_in_process_publishing_prunes_the_outbox(file_session_factory):
+    class Publisher:
+        def publish_batch(self, messages):
+            pass
+
+    bus = bootstrap.bootstrap(
+        start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache(),
+        dispatcher=BackgroundEventDispatcher(max_workers=2),
+        relay=OutboxRelay(file_session_factory, Publisher(), retention=timedelta(0), prune_interval=0),
+    )
+
+    bus.handle(commands.AddBookmarkCommand(
+        id=None, title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None,
+    ))
+    bus.handle(commands.DeleteBookmarkCommand(id=1))
+    assert bus.shutdown(timeout=5)
+
+    # no standalone relay is running, publish_events deleted the rows it published
+    with file_session_factory() as session:
+        assert session.execute(text("SELECT count(*) FROM outbox")).scalar() == 0
+
+
+def test_background_handlers_share_one_dispatch_key_across_event_types(file_session_factory):
+    keys = list()
+
+    class RecordingDispatcher(BackgroundEventDispatcher):
+        def dispatch(self, key, task):
+            keys.append(key)
+            super().dispatch(key, task)
+
+    bus = bootstrap.bootstrap(
+        start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache(),
+        dispatcher=RecordingDispatcher(max_workers=2),
+    )
+
+    bus.handle(commands.AddBookmarkCommand(
+        id=None, title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None,
+    ))
+    bus.handle(commands.DeleteBookmarkCommand(id=1))
+    assert bus.shutdown(timeout=5)
+    # handler_concurrency limits publish_events itself, not each event type it is wired to
+    assert keys == [handlers.publish_events, handlers.publish_events]
+
+
+def test_listings_come_from_the_read_model(file_session_factory):
+    bus = bootstrap.bootstrap(start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache())
+
+    def listing(**kwargs):
+        cmd = commands.ListBookmarksCommand(order_by="id", **kwargs)
+        bus.handle(cmd)
+        return cmd
+
+    bus.handle(commands.AddBookmarkCommand(
+        id=None, title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None,
+    ))
+    bus.handle(commands.AddBookmarksBatchCommand(bookmarks=[
+        {"title": str(index), "url": f"http://test{index}.com"} for index in range(2, 6)
+    ]))
+    bus.handle(commands.EditBookmarkCommand(
+        id=2, title="two", url=None, notes="edited", date_added=None, date_edited=None,
+    ))
+    bus.handle(commands.EditBookmarksBatchCommand(bookmarks=[{"id": 3, "notes": "batch"}]))
+    bus.handle(commands.DeleteBookmarkCommand(id=4))
+    bus.handle(commands.DeleteBookmarksCommand(filter="title", value="5"))
+
+    bookmarks = listing().bookmarks
+    assert [(bookmark["id"], bookmark["title"], bookmark["notes"]) for bookmark in bookmarks] == [
+        (1, "1", None), (2, "two", "edited"), (3, "3", "batch"),
+    ]
+    # the documents are what the bookmark itself serializes to
+    get = commands.GetBookmarkCommand(id=2)
+    bus.handle(get)
+    assert bookmarks[1] == get.bookmark
+
+    page = listing(limit=2, as_json=True)
+    assert [json.loads(document)["id"] for document in page.bookmarks] == [1, 2]
+    assert [bookmark["id"] for bookmark in listing(limit=2, cursor=page.next_cursor).bookmarks] == [3]
+    assert [bookmark["title"] for bookmark in listing(filter="title", value="two").bookmarks] == ["two"]
+    assert [bookmark["id"] for bookmark in listing(filter="url", value="http://test3.com").bookmarks] == [3]
+
+    # the url filter looks the ids up through ix_bookmarks_url
+    query = handlers.get_query("url", "http://test3.com", "id", None, source=bookmark_documents)
+    with file_session_factory() as session:
+        compiled = query.compile(compile_kwargs={"literal_binds": True})
+        plan = " ".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+    assert "ix_bookmarks_url" in plan
+
+
+def test_read_model_is_written_with_the_change(file_session_factory, monkeypatch):
+    bus = bootstrap.bootstrap(start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache())
+
+    def broken_refresh(*args, **kwargs):
+        raise RuntimeError("read model is broken")
+
+    # a read model that cannot be written fails the command, the bookmark is not left behind
+    monkeypatch.setattr(read_model, "refresh", broken_refresh)
+    with pytest.raises(RuntimeError):
+        bus.handle(commands.AddBookmarkCommand(
+            id=None, title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None,
+        ))
+    monkeypatch.undo()
+
+    get = commands.GetBookmarkCommand(id=1)
+    bus.handle(get)
+    assert get.bookmark is None
+    version = commands.GetBookmarksVersionCommand()
+    bus.handle(version)
+    assert version.version == 0
+
+
+def test_version_check_drops_pages_cached_before_another_process_wrote(file_session_factory):
+    # two worker processes on one database, each with its own in-process cache
+    caches = [BookmarkCache(), BookmarkCache()]
+    buses = [
+        bootstrap.bootstrap(start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=cache)
+        for cache in caches
+    ]
+
+    def read(bus):
+        version, listing = commands.GetBookmarksVersionCommand(), commands.ListBookmarksCommand(order_by="id")
+        bus.handle(version)
+        bus.handle(listing)
+        return f"{version.version}.{version.cache_generation}", [bookmark["title"] for bookmark in listing.bookmarks]
+
+    buses[0].handle(commands.AddBookmarkCommand(
+        id=None, title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None,
+    ))
+    etag, titles = read(buses[0])
+    assert titles == ["1"]
+
+    # the other process writes, this one's cache is never invalidated
+    buses[1].handle(commands.EditBookmarkCommand(
+        id=1, title="renamed", url=None, notes=None, date_added=None, date_edited=None,
+    ))
+    new_etag, titles = read(buses[0])
+    assert titles == ["renamed"]
+    assert new_etag != etag
+    # the ETag stays put while nothing is written
+    assert read(buses[0]) == (new_etag, ["renamed"])
+
+
+def test_paging_through_null_sort_keys(file_session_factory):
+    bus = bootstrap.bootstrap(start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache())
+    with file_session_factory() as session:
+        session.execute(text(
+            "INSERT INTO bookmarks (id, title, url, date_added, date_edited) VALUES "
+            "(1, 'a', 'http://a.com', '2023-01-01 00:00:00', NULL), (2, 'b', 'http://b.com', '2023-01-01 00:00:00', '2023-01-03 00:00:00'), "
+            "(3, 'c', 'http://c.com', '2023-01-01 00:00:00', NULL), (4, 'd', 'http://d.com', '2023-01-01 00:00:00', '2023-01-02 00:00:00')"
+        ))
+        read_model.rebuild(session.connection())
+        session.commit()
+
+    def pages(order):
+        ids, cursor = list(), None
+        while True:
+            cmd = commands.ListBookmarksCommand(order_by="date_edited", order=order, limit=1, cursor=cursor)
+            bus.handle(cmd)
+            ids.extend(bookmark["id"] for bookmark in cmd.bookmarks)
+            cursor = cmd.next_cursor
+            if cursor is None:
+                return ids
+
+    # NULLs come first ascending and last descending, as in the unpaged listing
+    assert pages("asc") == [1, 3, 4, 2]
+    assert pages("desc") == [2, 4, 3, 1]
+
+    with pytest.raises(ValueError, match="not a sortable column"):
+        bus.handle(commands.ListBookmarksCommand(order_by="url", limit=1))
+
+
+def test_reads_use_the_read_only_engine(file_session_factory, tmp_path):
+    read_engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'bookmarks.db'}", read_only=True)
+    read_sessions = list()
+
+    def read_session_factory():
+        read_sessions.append(sessionmaker(bind=read_engine)())
+        return read_sessions[-1]
+
+    bus = bootstrap.bootstrap(
+        start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache(),
+        read_session_factory=read_session_factory,
+    )
+
+    # writes and their event handlers keep the writable engine
+    bus.handle(commands.AddBookmarkCommand(
+        id=None, title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None,
+    ))
+    assert not read_sessions
+
+    listing = commands.ListBookmarksCommand(order_by="id")
+    bus.handle(listing)
+    assert [bookmark["title"] for bookmark in listing.bookmarks] == ["1"]
+    assert len(read_sessions) == 1
+    read_engine.dispose()
+
+
+def test_async_bus(file_session_factory):
+    cache = BookmarkCache()
+    bus = bootstrap.bootstrap(
+        start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=cache, async_mode=True
+    )
+
+    async def scenario():
+        await bus.handle(commands.AddBookmarksBatchCommand(bookmarks=[
+            {"title": str(index), "url": f"http://test{index}.com", "notes": "async note"} for index in range(10)
+        ]))
+
+        # reads run side by side on the event loop, each with its own unit of work
+        searches = [commands.SearchBookmarksCommand(query="async", limit=5) for _ in range(4)]
+        gets = [commands.GetBookmarkCommand(id=index) for index in range(1, 11)]
+        await asyncio.gather(*(bus.handle(cmd) for cmd in searches + gets))
+
+        version = commands.GetBookmarksVersionCommand()
+        await bus.handle(version)
+        return searches, gets, version
+
+    generation = cache.generation
+    searches, gets, version = asyncio.run(scenario())
+
+    assert all(len(cmd.bookmarks) == 5 and cmd.next_cursor for cmd in searches)
+    assert sorted(cmd.bookmark["title"] for cmd in gets) == sorted(str(index) for index in range(10))
+    assert version.version == 1
+    # events raised by the offloaded handler reached the event handlers
+    assert cache.generation > generation
+
+
+def test_async_bus_raises_command_errors(file_session_factory):
+    bus = bootstrap.bootstrap(start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), async_mode=True)
+
+    with pytest.raises(ValueError):
+        asyncio.run(bus.handle(commands.SearchBookmarksCommand(query="x", cursor="not a cursor")))
+
+
+def test_bus_metrics(file_session_factory):
+    metrics = Metrics()
+    bus = bootstrap.bootstrap(
+        start_orm=False, uow=SqlAlchemyUnitOfWork(file_session_factory), cache=BookmarkCache(), metrics=metrics,
+    )
+
+    bus.handle(commands.AddBookmarksBatchCommand(bookmarks=[
+        {"title": str(index), "url": f"http://test{index}.com"} for index in range(3)
+    ]))
+    for _ in range(2):
+        bus.handle(commands.ListBookmarksCommand(order_by="id"))
+    with pytest.raises(ValueError):
+        bus.handle(commands.SearchBookmarksCommand(query="x", cursor="not a cursor"))
+
+    assert metrics.messages.get("AddBookmarksBatchCommand", "command", "ok") == 1
+    assert metrics.messages.get("BookmarksAdded", "event", "ok") >= 1
+    assert metrics.messages.get("SearchBookmarksCommand", "command", "error") == 1
+    assert metrics.events_emitted.values[("AddBookmarksBatchCommand",)][1] == 1
+    assert metrics.handler_seconds.count("ListBookmarksCommand") == 2
+    # the second listing came from the cache, only the first one queried
+    assert metrics.queries.get("find_documents") == 1
+    assert metrics.rows.get("find_documents") == 3
+    assert metrics.rows.get("add_bulk") == 3
+    assert metrics.db_seconds.values[("AddBookmarksBatchCommand",)][1] > 0
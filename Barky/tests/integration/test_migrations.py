@@ -0,0 +1,79 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from barkylib.adapters import migrations
+from barkylib.adapters.orm import mapper_registry
+from barkylib.domain.models import url_hash
+from sqlalchemy import create_engine, text
+
+
+def create_legacy_database(url):
+    # the schema as the first release created it, without any secondary indexes
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE bookmarks (id INTEGER NOT NULL PRIMARY KEY, title VARCHAR(255) UNIQUE, "
+            "url VARCHAR(255), notes TEXT, date_added DATETIME, date_edited DATETIME)"
+        ))
+        connection.execute(text(
+            "INSERT INTO bookmarks (title, url, date_added, date_edited) "
+            "VALUES ('1', 'http://test1.com', '2023-08-12 00:00:00', '2023-08-12 00:00:00')"
+        ))
+    return engine
+
+
+def query_plan(engine, sql):
+    with engine.connect() as connection:
+        return " ".join(row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN " + sql)))
+
+
+def test_upgrade_adds_indexes_to_existing_database(tmp_path):
+    engine = create_legacy_database(f"sqlite:///{tmp_path / 'bookmarks.db'}")
+    assert "SCAN bookmarks" in query_plan(engine, "SELECT * FROM bookmarks ORDER BY date_added, id LIMIT 10")
+
+    mapper_registry.metadata.create_all(engine)
+    assert migrations.upgrade(engine) == [version for version, _, _ in migrations.MIGRATIONS]
+
+    assert "USING INDEX ix_bookmarks_date_added_id" in query_plan(
+        engine, "SELECT * FROM bookmarks ORDER BY date_added, id LIMIT 10"
+    )
+    assert "USING INDEX ix_bookmarks_url" in query_plan(engine, "SELECT * FROM bookmarks WHERE url = 'x'")
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM bookmarks")).scalar() == 1
+        # rows that were there before are searchable
+        assert connection.execute(text("SELECT rowid FROM bookmarks_fts WHERE bookmarks_fts MATCH 'test1'")).scalar() == 1
+        # and have their url hash backfilled
+        assert connection.execute(text("SELECT url_hash FROM bookmarks")).scalar() == url_hash("http://TEST1.com/")
+        # and a read model document
+        document = json.loads(connection.execute(text("SELECT document FROM bookmark_documents")).scalar())
+        assert document == {
+            "id": 1, "title": "1", "url": "http://test1.com", "notes": None,
+            "date_added": "2023-08-12T00:00:00", "date_edited": "2023-08-12T00:00:00",
+        }
+    assert "INDEX ix_bookmarks_url_hash" in query_plan(engine, "SELECT id FROM bookmarks WHERE url_hash = 'x'")
+
+    # already applied
+    assert migrations.upgrade(engine) == []
+
+
+def test_new_database_is_marked_up_to_date(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bookmarks.db'}")
+    mapper_registry.metadata.create_all(engine)
+
+    assert migrations.upgrade(engine) == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.upgrade(engine) == []
+
+
+def test_concurrent_upgrades_apply_each_migration_once(tmp_path):
+    url = f"sqlite:///{tmp_path / 'bookmarks.db'}"
+    create_legacy_database(url)
+    mapper_registry.metadata.create_all(create_engine(url))
+    # one engine per worker process, each waiting for the other's write lock
+    engines = [create_engine(url, connect_args={"timeout": 30}) for _ in range(4)]
+
+    with ThreadPoolExecutor(max_workers=len(engines)) as executor:
+        results = list(executor.map(migrations.upgrade, engines))
+
+    assert sorted(results) == [[]] * 3 + [[version for version, _, _ in migrations.MIGRATIONS]]
+    with engines[0].connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM schema_migrations")).scalar() == len(migrations.MIGRATIONS)
@@ -0,0 +1,134 @@
+import json
+from datetime import timedelta
+
+import pytest
+from barkylib.adapters.orm import outbox
+from barkylib.adapters.outbox import OutboxRelay, RedisPublisher, utcnow
+from barkylib.domain import commands
+from barkylib.services import handlers
+from barkylib.services.unit_of_work import SqlAlchemyUnitOfWork, create_sqlite_engine
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+class FakeRedis:
+    """
+    Stand-in for redis.Redis that records what went through each pipeline
+    """
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.round_trips = 0
+        self.published = list()
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = list()
+
+    def publish(self, channel, message):
+        self.commands.append((channel, message))
+
+    def execute(self):
+        self.redis.round_trips += 1
+        if self.redis.fail:
+            raise ConnectionError("redis is down")
+        self.redis.published.extend(self.commands)
+
+
+def outbox_rows(session_factory):
+    with session_factory() as session:
+        return session.execute(select(outbox).order_by(outbox.c.id)).all()
+
+
+def add_bookmark(uow, index):
+    handlers.add_bookmark(commands.AddBookmarkCommand(
+        id=None, title=str(index), url=f"http://test{index}.com", notes=None, date_added=None, date_edited=None,
+    ), uow)
+
+
+def test_events_are_written_with_the_change(sqlite_session_factory):
+    uow = SqlAlchemyUnitOfWork(sqlite_session_factory)
+    add_bookmark(uow, 1)
+    handlers.edit_bookmarks_batch(commands.EditBookmarksBatchCommand(bookmarks=[{"id": 1, "notes": "x"}]), uow)
+
+    # a failed handler rolls back its change and its events
+    with pytest.raises(Exception):
+        handlers.edit_bookmark(commands.EditBookmarkCommand(id=99, title="99", url=None, notes=None), uow)
+
+    rows = outbox_rows(sqlite_session_factory)
+    assert [row.event_type for row in rows] == ["BookmarkAdded", "BookmarksEdited"]
+    assert json.loads(rows[0].payload)["title"] == "1"
+    assert json.loads(rows[1].payload) == {"ids": [1]}
+    assert all(row.published_at is None for row in rows)
+
+
+def test_relay_publishes_batches_once(sqlite_session_factory):
+    uow = SqlAlchemyUnitOfWork(sqlite_session_factory)
+    for index in range(5):
+        add_bookmark(uow, index)
+
+    redis = FakeRedis()
+    relay = OutboxRelay(sqlite_session_factory, RedisPublisher(redis), batch_size=2)
+
+    assert relay.relay_all() == 5
+    # one pipelined round trip per batch
+    assert redis.round_trips == 3
+    messages = [json.loads(message) for channel, message in redis.published]
+    assert {channel for channel, message in redis.published} == {"BookmarkAdded"}
+    assert [message["data"]["title"] for message in messages] == ["0", "1", "2", "3", "4"]
+    assert len({message["id"] for message in messages}) == 5
+
+    assert relay.relay_once() == 0
+    assert all(row.published_at is not None for row in outbox_rows(sqlite_session_factory))
+
+
+def test_failed_publish_is_retried(sqlite_session_factory):
+    uow = SqlAlchemyUnitOfWork(sqlite_session_factory)
+    add_bookmark(uow, 1)
+    redis = FakeRedis(fail=True)
+    relay = OutboxRelay(sqlite_session_factory, RedisPublisher(redis))
+
+    with pytest.raises(ConnectionError):
+        relay.relay_once()
+    assert outbox_rows(sqlite_session_factory)[0].published_at is None
+
+    redis.fail = False
+    assert relay.relay_once() == 1
+    assert len(redis.published) == 1
+
+
+def test_publish_does_not_hold_the_write_lock(tmp_path):
+    # no busy timeout, a write waiting on the relay's lock fails straight away
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'bookmarks.db'}", journal_mode="WAL", busy_timeout=0)
+    session_factory = sessionmaker(bind=engine)
+    uow = SqlAlchemyUnitOfWork(session_factory)
+    add_bookmark(uow, 1)
+
+    class WritingPublisher:
+        def publish_batch(self, messages):
+            # another request writes while the batch is on its way to Redis
+            add_bookmark(SqlAlchemyUnitOfWork(session_factory, create_schema=False), 2)
+
+    assert OutboxRelay(session_factory, WritingPublisher()).relay_once() == 1
+    assert [row.published_at is not None for row in outbox_rows(session_factory)] == [True, False]
+    engine.dispose()
+
+
+def test_prune_deletes_old_published_events(sqlite_session_factory):
+    uow = SqlAlchemyUnitOfWork(sqlite_session_factory)
+    for index in range(3):
+        add_bookmark(uow, index)
+    relay = OutboxRelay(sqlite_session_factory, RedisPublisher(FakeRedis()), batch_size=2, retention=timedelta(hours=1))
+    relay.relay_once()
+
+    assert relay.prune() == 0
+    assert relay.prune(now=utcnow() + timedelta(hours=2)) == 2
+    # the unpublished event stays whatever its age
+    assert [row.published_at for row in outbox_rows(sqlite_session_factory)] == [None]
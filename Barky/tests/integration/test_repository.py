@@ -1,9 +1,13 @@
 import pytest
 import json
 from datetime import datetime
-from barkylib.adapters.repository import SqlAlchemyRepository
-from barkylib.domain.models import Bookmark
-from sqlalchemy import create_engine, select, update, delete
+from barkylib.adapters import migrations
+from barkylib.adapters.cache import BookmarkCache, SharedBookmarkCache
+from barkylib.adapters.orm import bookmark_documents
+from barkylib.adapters.repository import CachingRepository, SqlAlchemyRepository
+from barkylib.domain.models import Bookmark, url_hash
+from sqlalchemy import create_engine, event, select, update, delete
+from sqlalchemy.exc import IntegrityError
 
 pytestmark = pytest.mark.usefixtures("mappers")
 
@@ -47,6 +51,21 @@ def test_add(sqlite_session_factory):
     assert len(indexes) == len(bmarks)
 
 
+def test_add_bulk(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+
+    rows = [{'title': str(index), 'url': f'http://test{index}.com', 'notes': None,
+             'date_added': datetime(2023, 8, 12), 'date_edited': datetime(2023, 8, 12)}
+            for index in range(1200)]
+
+    assert repo.add_bulk(rows) == 1200
+    # spans several IN chunks
+    assert repo.find_existing_titles(['5', '1199', 'missing'] + [str(i) for i in range(600, 1100)]) == \
+        {'5', '1199'} | {str(i) for i in range(600, 1100)}
+    assert repo.find_first(select(Bookmark).where(Bookmark.title == '7')).url == 'http://test7.com'
+
+
 def test_find(sqlite_session_factory):
     session = sqlite_session_factory()
     repo = SqlAlchemyRepository(session)
@@ -66,6 +85,71 @@ def test_find(sqlite_session_factory):
     assert len(bmarks) == len(indexes)
 
 
+def test_get_uses_identity_map(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+
+    bmarks = create_multiple_bookmarks(repo, ['1', '2'])
+    statements = list()
+    event.listen(session.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    # already loaded by the find_all above, so no SQL is issued
+    assert repo.get(bmarks[0].id) is bmarks[0]
+    assert statements == []
+    assert repo.get(1000) is None
+
+    query = select(Bookmark).order_by(Bookmark.title)
+    assert repo.find_first(query).title == '1'
+    assert 'LIMIT' in statements[-1]
+
+
+def test_iter_rows(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+    create_multiple_bookmarks(repo, [str(index) for index in range(10)])
+    repo.seen.clear()
+    session.expunge_all()
+
+    query = select(Bookmark).where(Bookmark.title != '5').order_by(Bookmark.id).limit(5)
+    rows = list(repo.iter_rows(query))
+
+    assert [row['title'] for row in rows] == ['0', '1', '2', '3', '4']
+    assert rows[0] == {'id': rows[0]['id'], 'title': '0', 'url': 'http://test0.com', 'notes': 'test 0',
+                       'date_added': datetime(2023, 8, 12), 'date_edited': datetime(2023, 8, 12)}
+    # nothing was hydrated or tracked
+    assert len(repo.seen) == 0
+    assert len(session.identity_map) == 0
+
+    titles = [row['title'] for row in repo.iter_rows(select(Bookmark).order_by(Bookmark.id), chunk_size=3)]
+    assert titles == [str(index) for index in range(10)]
+    assert len(session.identity_map) == 0
+
+
+def test_search(sqlite_session_factory):
+    session = sqlite_session_factory()
+    migrations.upgrade(session.get_bind())
+    repo = SqlAlchemyRepository(session)
+    bmarks = create_multiple_bookmarks(repo, ['1', '2', '3'])
+
+    repo.update_bulk([
+        {'id': bmarks[0].id, 'notes': 'python sqlite tips'},
+        {'id': bmarks[1].id, 'notes': 'sqlite sqlite sqlite'},
+    ])
+
+    assert [row['title'] for row in repo.search('sqlite')] == ['2', '1']
+    # rows carry the bookmark columns only, not the bm25 rank they were ordered by
+    assert set(repo.search('sqlite')[0]) == {'id', 'title', 'url', 'notes', 'date_added', 'date_edited'}
+    assert [row['title'] for row in repo.search('python SQLite')] == ['1']
+    assert [row['title'] for row in repo.search('sqlite', limit=1, offset=1)] == ['1']
+    # the url column is indexed as well, and quotes cannot break the match syntax
+    assert [row['title'] for row in repo.search('test3')] == ['3']
+    assert repo.search('"unbalanced') == []
+    assert repo.search('   ') == []
+
+    repo.delete_one(bmarks[1])
+    assert [row['title'] for row in repo.search('sqlite')] == ['1']
+
+
 def test_update(sqlite_session_factory):
     session = sqlite_session_factory()
     repo = SqlAlchemyRepository(session)
@@ -94,6 +178,36 @@ def test_update(sqlite_session_factory):
     for i in range(len(bmarks)):
         assert queried_bmarks[i].notes == bmarks[i].notes
 
+    # a failed update is raised rather than reported as a status the caller may ignore
+    with pytest.raises(IntegrityError):
+        repo.update_many([{'id': bmarks[0].id, 'title': '2'}])
+
+
+def test_update_bulk(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+
+    bmarks = create_multiple_bookmarks(repo, ['1', '2', '3'])
+    statements = list()
+    event.listen(session.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    updated = repo.update_bulk([
+        {'id': bmarks[0].id, 'notes': 'a'},
+        {'id': bmarks[1].id, 'notes': 'b'},
+        {'id': bmarks[2].id, 'notes': 'c', 'url': 'http://c.com'},
+    ])
+
+    # one statement per distinct set of changed columns
+    assert updated == 3
+    assert len([statement for statement in statements if statement.startswith('UPDATE bookmarks')]) == 2
+
+    session.expire_all()
+    assert [repo.get(bmark.id).notes for bmark in bmarks] == ['a', 'b', 'c']
+    assert repo.get(bmarks[2].id).url == 'http://c.com'
+
+    with pytest.raises(Exception):
+        repo.update_bulk([{'notes': 'no id'}])
+
 
 def test_delete(sqlite_session_factory):
     session = sqlite_session_factory()
@@ -111,12 +225,123 @@ def test_delete(sqlite_session_factory):
     assert (len(bmarks) - 1) == len(queried_bmarks)
 
     # deleting many
-    repo.delete_many(queried_bmarks)
+    assert repo.delete_many(queried_bmarks) == len(queried_bmarks)
     queried_bmarks = repo.find_all(query)
     # making sure all were deleted
     assert len(queried_bmarks) == 0
 
 
+def test_writes_bump_version(sqlite_session_factory):
+    repo = SqlAlchemyRepository(sqlite_session_factory())
+    assert repo.get_version() == (0, None)
+
+    bmarks = create_multiple_bookmarks(repo, ['1', '2'])
+    repo.update_bulk([{'id': bmarks[0].id, 'notes': 'a'}])
+    version, modified_at = repo.get_version()
+    assert version == 2
+    assert modified_at is not None
+
+    # nothing changed, so the version stays put
+    assert repo.delete_many([{'id': -1}]) == 0
+    assert repo.get_version()[0] == 2
+    repo.delete_many(bmarks)
+    assert repo.get_version()[0] == 3
+
+
+def test_delete_where(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+    bmarks = create_multiple_bookmarks(repo, ['1', '2', '3'])
+    repo.update_bulk([{'id': bmarks[0].id, 'date_added': datetime(2020, 1, 1)}])
+
+    assert repo.delete_where(Bookmark.date_added < datetime(2021, 1, 1)) == 1
+    assert repo.find_existing_titles(['1', '2', '3']) == {'2', '3'}
+
+
+def test_caching_repository(sqlite_session_factory):
+    cache = BookmarkCache(maxsize=100, ttl=60)
+    repo = SqlAlchemyRepository(sqlite_session_factory())
+    bmarks = create_multiple_bookmarks(repo, ['1', '2'])
+
+    statements = list()
+    event.listen(repo.Session.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    query = select(Bookmark).where(Bookmark.title.in_(['1', '2'])).order_by(Bookmark.title)
+
+    # a fresh session per "request", like the unit of work uses
+    for _ in range(3):
+        cached = CachingRepository(SqlAlchemyRepository(sqlite_session_factory()), cache)
+        assert [bmark.title for bmark in cached.find_all(query)] == ['1', '2']
+        assert cached.get(bmarks[0].id).title == '1'
+
+    # only the first find_all reaches the database, its session then answers the get
+    assert len(statements) == 1
+    assert cache.stats()['hits'] == 4
+
+    repo.update_bulk([{'id': bmarks[0].id, 'title': 'renamed'}])
+    cache.invalidate(ids=[bmarks[0].id])
+
+    cached = CachingRepository(SqlAlchemyRepository(sqlite_session_factory()), cache)
+    assert cached.get(bmarks[0].id).title == 'renamed'
+    assert [bmark.title for bmark in cached.find_all(query)] == ['2']
+
+
+def test_caching_repository_with_shared_cache(sqlite_session_factory, memory_redis):
+    repo = SqlAlchemyRepository(sqlite_session_factory())
+    bmarks = create_multiple_bookmarks(repo, ['1', '2', '3'])
+    query = select(Bookmark).order_by(Bookmark.id)
+    ids = [bmark.id for bmark in bmarks]
+    repo.refresh_documents(ids=ids)
+    repo.Session.commit()
+    documents = select(bookmark_documents).order_by(bookmark_documents.c.id)
+    workers = [SharedBookmarkCache(memory_redis), SharedBookmarkCache(memory_redis)]
+
+    statements = list()
+    event.listen(repo.Session.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    first = CachingRepository(SqlAlchemyRepository(sqlite_session_factory()), workers[0])
+    assert [row['title'] for row in first.find_documents(documents)] == ['1', '2', '3']
+    # the other worker gets the page and its documents from the shared cache
+    second = CachingRepository(SqlAlchemyRepository(sqlite_session_factory()), workers[1])
+    assert [row['title'] for row in second.find_documents(documents)] == ['1', '2', '3']
+    assert second.get(ids[1]).title == '2'
+    assert len([sql for sql in statements if 'FROM bookmark' in sql]) == 2
+
+    # a page that overlaps one already cached only loads its ids, the documents are shared
+    page = documents.where(bookmark_documents.c.id > ids[0])
+    assert [row['title'] for row in second.find_documents(page)] == ['2', '3']
+    assert [row['title'] for row in first.find_documents(page)] == ['2', '3']
+    assert len([sql for sql in statements if 'FROM bookmark' in sql]) == 3
+
+    repo.update_bulk([{'id': ids[1], 'title': 'renamed'}])
+    repo.refresh_documents(ids=[ids[1]])
+    repo.Session.commit()
+    workers[0].invalidate(ids=[ids[1]])
+
+    second = CachingRepository(SqlAlchemyRepository(sqlite_session_factory()), workers[1])
+    assert [row['title'] for row in second.find_documents(documents)] == ['1', 'renamed', '3']
+    assert second.get(ids[1]).title == 'renamed'
+
+
+def test_find_duplicate_urls(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+    bmarks = create_multiple_bookmarks(repo, ['1', '2', '3', '4'])
+
+    repo.update_bulk([
+        {'id': bmarks[1].id, 'url': 'HTTP://TEST1.com/?utm_source=mail'},
+        {'id': bmarks[3].id, 'url': 'http://test3.com/#top'},
+    ])
+
+    assert repo.find_existing_url_hashes([url_hash('http://test1.com'), url_hash('http://test9.com')]) == {
+        url_hash('http://test1.com')
+    }
+    groups = repo.find_duplicate_urls()
+    assert sorted([bmark['title'] for bmark in group['bookmarks']] for group in groups) == [['1', '2'], ['3', '4']]
+    assert all(group['url_hash'] == url_hash(group['bookmarks'][0]['url']) for group in groups)
+    # the hash stays internal to the table
+    assert 'url_hash' not in next(repo.iter_rows(select(Bookmark)))
+
+
 def create_multiple_bookmarks(repo, indexes) -> list[Bookmark]:
     bmarks = list()
     indexes_as_str = list()
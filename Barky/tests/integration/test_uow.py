@@ -0,0 +1,121 @@
+import logging
+
+import pytest
+from barkylib.adapters import profiler
+from barkylib.adapters.orm import mapper_registry
+from barkylib.domain import commands
+from barkylib.domain.models import Bookmark
+from barkylib.services import handlers
+from barkylib.services.unit_of_work import SqlAlchemyUnitOfWork, create_sqlite_engine
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+
+
+def pragma(engine, name):
+    with engine.connect() as connection:
+        return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+
+def test_engine_profile_applies_pragmas(tmp_path):
+    engine = create_sqlite_engine(
+        f"sqlite:///{tmp_path / 'bookmarks.db'}",
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        mmap_size=1024 * 1024,
+        cache_size=-2000,
+        busy_timeout=1234,
+        pool_size=2,
+    )
+
+    assert pragma(engine, "journal_mode") == "wal"
+    # NORMAL
+    assert pragma(engine, "synchronous") == 1
+    assert pragma(engine, "mmap_size") == 1024 * 1024
+    assert pragma(engine, "cache_size") == -2000
+    assert pragma(engine, "busy_timeout") == 1234
+    assert engine.pool.size() == 2
+
+
+def test_read_only_profile_rejects_writes(tmp_path):
+    url = f"sqlite:///{tmp_path / 'bookmarks.db'}"
+    mapper_registry.metadata.create_all(create_sqlite_engine(url))
+    engine = create_sqlite_engine(url, read_only=True)
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM bookmarks")).scalar() == 0
+        with pytest.raises(OperationalError):
+            connection.execute(text("INSERT INTO bookmarks (title, url) VALUES ('a', 'b')"))
+
+
+def test_profiler_counts_statements_and_logs_slow_ones(tmp_path, caplog):
+    url = f"sqlite:///{tmp_path / 'bookmarks.db'}"
+    mapper_registry.metadata.create_all(create_sqlite_engine(url))
+    # every statement counts as slow
+    engine = create_sqlite_engine(url, profile_queries=True, slow_query_ms=0)
+
+    with caplog.at_level(logging.WARNING, logger=profiler.__name__):
+        with profiler.profile() as query_profile, engine.begin() as connection:
+            connection.execute(text("INSERT INTO bookmarks (title, url) VALUES ('a', 'b')"))
+            assert connection.execute(text("SELECT id FROM bookmarks WHERE title = :title"), dict(title="a")).scalar() == 1
+        # outside the block nothing is counted
+        with engine.connect() as connection:
+            connection.execute(text("SELECT count(*) FROM bookmarks"))
+
+    assert query_profile.statements == 2
+    assert [statement for statement, _ in query_profile.timings][1].startswith("SELECT id FROM bookmarks")
+    assert query_profile.seconds > 0
+    plans = [record.getMessage() for record in caplog.records if "SELECT id FROM bookmarks" in record.getMessage()]
+    assert "plan:\nSEARCH bookmarks" in plans[0]
+
+
+def test_profiler_survives_failing_statements(tmp_path):
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'bookmarks.db'}", profile_queries=True)
+
+    with profiler.profile() as query_profile, engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+        connection.execute(text("SELECT 1"))
+        # nothing per statement is left on the pooled connection
+        assert connection.info == {}
+
+    assert query_profile.statements == 1
+
+
+@pytest.mark.usefixtures("mappers")
+def test_one_session_and_transaction_per_message(sqlite_session_factory):
+    uow = SqlAlchemyUnitOfWork(sqlite_session_factory)
+
+    # add_bookmark nests do_add_bookmark, list_bookmarks nests list_all_bookmarks
+    handlers.add_bookmark(commands.AddBookmarkCommand(
+        id=None, title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None,
+    ), uow)
+    assert (uow.sessions_opened, uow.transactions_committed) == (1, 1)
+
+    handlers.list_bookmarks(commands.ListBookmarksCommand(), uow)
+    assert (uow.sessions_opened, uow.transactions_committed) == (2, 1)
+
+
+@pytest.mark.usefixtures("mappers")
+def test_nested_commit_waits_for_the_outermost_scope(sqlite_session_factory):
+    uow = SqlAlchemyUnitOfWork(sqlite_session_factory)
+    row = dict(title="1", url="http://test1.com", notes=None, date_added=None, date_edited=None)
+
+    with pytest.raises(RuntimeError):
+        with uow:
+            with uow:
+                uow.bookmarks.add_bulk([row])
+                uow.commit()
+            assert uow.transactions_committed == 0
+            raise RuntimeError("the outer scope fails")
+
+    with uow:
+        assert list(uow.bookmarks.iter_rows(select(Bookmark))) == []
+        with uow:
+            uow.bookmarks.add_bulk([row])
+            uow.commit()
+
+    assert uow.transactions_committed == 1
+    assert uow.sessions_opened == 2
+    with uow:
+        assert [row["title"] for row in uow.bookmarks.iter_rows(select(Bookmark))] == ["1"]
@@ -6,7 +6,7 @@ import pytest
 
 from barkylib.adapters.repository import SqlAlchemyRepository
 from barkylib.domain import events
-from barkylib.domain.models import Bookmark
+from barkylib.domain.models import Bookmark, canonical_url, url_hash
 from sqlalchemy import create_engine, select, update, delete
 
 ok_urls = ["http://", "https://"]
@@ -72,3 +72,33 @@ def test_that_edit_time_is_newer_than_created_time():
 
     # assert
     assert bookmark.date_added < bookmark.date_edited
+
+
+def test_to_dict_formats_dates_as_iso():
+    # arrange
+    created = datetime(2023, 8, 12, 10, 30)
+    edited = datetime(2023, 8, 13)
+
+    # act
+    bookmark = Bookmark(1, "test", "http://www.example/com", None, created, edited)
+
+    # assert
+    assert bookmark._asdict()["date_added"] == created
+    assert bookmark.to_dict() == {
+        "id": 1,
+        "title": "test",
+        "url": "http://www.example/com",
+        "notes": None,
+        "date_added": "2023-08-12T10:30:00",
+        "date_edited": "2023-08-13T00:00:00",
+    }
+
+
+def test_canonical_url():
+    # assert
+    assert canonical_url("HTTP://Example.com:80/path/?utm_source=x&b=2&a=1#top") == "http://example.com/path?a=1&b=2"
+    assert canonical_url("  example.com/  ") == "http://example.com"
+    assert canonical_url("https://example.com:8443/Path") == "https://example.com:8443/Path"
+    assert url_hash("http://example.com/?fbclid=abc") == url_hash("HTTP://EXAMPLE.COM")
+    assert url_hash("http://example.com/a") != url_hash("http://example.com/b")
+    assert url_hash(None) is None
@@ -0,0 +1,184 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from barkylib.adapters.cache import BookmarkCache, SharedBookmarkCache, make_cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_hits_and_misses():
+    cache = BookmarkCache(maxsize=10, ttl=60)
+
+    assert cache.get(("id", 1)) is None
+    cache.set(("id", 1), {"id": 1}, cache.generation)
+
+    assert cache.get(("id", 1)) == {"id": 1}
+    assert cache.stats() == dict(hits=1, misses=1, evictions=0, size=1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = BookmarkCache(maxsize=2, ttl=60)
+    for id in [1, 2]:
+        cache.set(("id", id), {"id": id}, cache.generation)
+
+    # touching 1 makes 2 the least recently used
+    cache.get(("id", 1))
+    cache.set(("id", 3), {"id": 3}, cache.generation)
+
+    assert cache.get(("id", 2)) is None
+    assert cache.get(("id", 1)) == {"id": 1}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = BookmarkCache(maxsize=10, ttl=5, clock=clock)
+    cache.set(("id", 1), {"id": 1}, cache.generation)
+
+    clock.now = 4.9
+    assert cache.get(("id", 1)) is not None
+    clock.now = 5.0
+    assert cache.get(("id", 1)) is None
+
+
+def test_invalidate_drops_ids_and_rejects_stale_loads():
+    cache = BookmarkCache(maxsize=10, ttl=60)
+    cache.set(("id", 1), {"id": 1}, cache.generation)
+    cache.set(("id", 2), {"id": 2}, cache.generation)
+
+    # a load that started before the write must not be stored
+    generation = cache.generation
+    cache.invalidate(ids=[1])
+    cache.set(("id", 1), {"id": 1, "title": "stale"}, generation)
+
+    assert cache.get(("id", 1)) is None
+    assert cache.get(("id", 2)) == {"id": 2}
+
+    cache.invalidate()
+    assert cache.get(("id", 2)) is None
+
+
+def test_version_change_empties_the_cache():
+    cache = BookmarkCache(maxsize=4)
+    generation = cache.sync_version(1)
+    cache.set("a", 1, generation)
+
+    assert cache.sync_version(1) == generation
+    assert cache.get("a") == 1
+    assert cache.sync_version(2) == generation + 1
+    assert cache.get("a") is None
+
+
+def test_zero_size_disables_cache():
+    assert make_cache(maxsize=0, ttl=60) is None
+    assert isinstance(make_cache(maxsize=1, ttl=60), BookmarkCache)
+
+
+def concurrent_loads(cache, key):
+    calls = list()
+
+    def loader():
+        calls.append(threading.current_thread())
+        time.sleep(0.05)
+        return {"id": 1}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        values = list(pool.map(lambda _: cache.get_or_load(key, loader), range(8)))
+
+    return values, calls
+
+
+def test_concurrent_misses_load_once():
+    values, calls = concurrent_loads(BookmarkCache(maxsize=10, ttl=60), ("id", 1))
+
+    assert values == [{"id": 1}] * 8
+    assert len(calls) == 1
+
+
+def test_shared_cache_is_shared_between_workers(memory_redis):
+    # two worker processes talking to the same Redis
+    first, second = SharedBookmarkCache(memory_redis), SharedBookmarkCache(memory_redis)
+
+    first.set(("id", 1), {"id": 1}, first.generation)
+    first.set(("query", first.generation, "sql", ()), ({"id": 1},), first.generation)
+    assert second.get_many([("id", 1), ("id", 2)]) == [{"id": 1}, None]
+
+    generation = second.generation
+    second.invalidate(ids=[1])
+    assert first.generation == generation + 1
+    assert first.get(("id", 1)) is None
+    # a load that started before the write is not stored
+    first.set(("id", 1), {"id": 1, "title": "stale"}, generation)
+    assert second.get(("id", 1)) is None
+
+    first.set(("id", 2), {"id": 2}, first.generation)
+    second.invalidate()
+    assert first.get(("id", 2)) is None
+    assert first.stats()["hits"] == 0
+
+
+def test_shared_cache_store_fails_when_invalidated_after_the_check(memory_redis, monkeypatch):
+    cache = SharedBookmarkCache(memory_redis)
+    generation = cache.generation
+    get = memory_redis.get
+
+    def get_then_invalidate(name):
+        # another worker invalidates between set_many's generation check and its write
+        value = get(name)
+        if name == cache.generation_key:
+            monkeypatch.setattr(memory_redis, "get", get)
+            SharedBookmarkCache(memory_redis).invalidate(ids=[1])
+        return value
+
+    monkeypatch.setattr(memory_redis, "get", get_then_invalidate)
+    cache.set(("id", 1), {"id": 1, "title": "stale"}, generation)
+    assert cache.get(("id", 1)) is None
+
+    cache.set(("id", 1), {"id": 1}, cache.generation)
+    assert cache.get(("id", 1)) == {"id": 1}
+
+
+def test_shared_cache_protects_against_stampedes(memory_redis):
+    cache = SharedBookmarkCache(memory_redis, poll_interval=0.005)
+    values, calls = concurrent_loads(cache, ("id", 1))
+
+    assert values == [{"id": 1}] * 8
+    assert len(calls) == 1
+    # the load lock is released
+    assert memory_redis.scan_iter(match="*:lock") == []
+
+
+def test_shared_cache_entries_expire(memory_redis):
+    cache = SharedBookmarkCache(memory_redis, ttl=0.01)
+    cache.set(("id", 1), {"id": 1}, cache.generation)
+
+    time.sleep(0.02)
+    assert cache.get(("id", 1)) is None
+
+
+def test_shared_cache_falls_back_to_the_loader_when_redis_is_down(memory_redis, monkeypatch):
+    from redis.exceptions import ConnectionError
+
+    cache = SharedBookmarkCache(memory_redis)
+    cache.set(("id", 1), {"id": 1}, cache.generation)
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("Connection refused")
+
+    for name in ("get", "mget", "set", "pipeline"):
+        monkeypatch.setattr(memory_redis, name, fail)
+
+    assert cache.get_many([("id", 1), ("id", 2)]) == [None, None]
+    assert cache.get_or_load(("id", 1), lambda: {"id": 1, "title": "from the database"}) == {
+        "id": 1, "title": "from the database"
+    }
+    # read, then read, generation and lock inside get_or_load
+    assert cache.stats()["errors"] == 4
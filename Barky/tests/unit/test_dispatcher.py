@@ -0,0 +1,70 @@
+import threading
+import time
+
+from barkylib.services.dispatcher import BackgroundEventDispatcher, make_dispatcher
+
+
+def test_limits_concurrency_per_handler():
+    dispatcher = BackgroundEventDispatcher(max_workers=8, handler_concurrency=2)
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+    done = list()
+
+    def task(index):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.01)
+        with lock:
+            running["now"] -= 1
+            done.append(index)
+
+    for index in range(10):
+        assert dispatcher.dispatch("slow", lambda index=index: task(index))
+
+    assert dispatcher.shutdown(timeout=5)
+    assert sorted(done) == list(range(10))
+    assert running["max"] == 2
+
+
+def test_full_queue_applies_backpressure():
+    dispatcher = BackgroundEventDispatcher(max_workers=1, max_pending=1, block_timeout=0.05)
+    release = threading.Event()
+    ran_inline = list()
+
+    assert dispatcher.dispatch("blocked", release.wait)
+    # the queue is full: the caller waits for block_timeout, then runs the task itself
+    assert not dispatcher.dispatch("other", lambda: ran_inline.append(threading.current_thread()))
+    assert ran_inline == [threading.current_thread()]
+
+    release.set()
+    assert dispatcher.drain(timeout=5)
+    assert dispatcher.pending == 0
+
+
+def test_shutdown_drains_and_runs_late_events_inline():
+    dispatcher = BackgroundEventDispatcher(max_workers=2)
+    done = list()
+    for index in range(5):
+        dispatcher.dispatch(index % 2, lambda index=index: (time.sleep(0.01), done.append(index)))
+
+    assert dispatcher.shutdown(timeout=5)
+    assert sorted(done) == list(range(5))
+    # the command behind a late event has committed already, its handlers still run
+    assert not dispatcher.dispatch("late", lambda: done.append("late"))
+    assert done[-1] == "late"
+
+
+def test_errors_do_not_stop_the_worker():
+    dispatcher = BackgroundEventDispatcher(max_workers=1, handler_concurrency=1)
+    done = list()
+
+    dispatcher.dispatch("flaky", lambda: 1 / 0)
+    dispatcher.dispatch("flaky", lambda: done.append(True))
+
+    assert dispatcher.shutdown(timeout=5)
+    assert done == [True]
+
+
+def test_no_workers_means_no_dispatcher():
+    assert make_dispatcher(max_workers=0) is None
@@ -0,0 +1,38 @@
+from barkylib.adapters.metrics import Counter, Histogram, Metrics
+
+
+def test_counter_renders_labelled_samples():
+    counter = Counter("requests_total", "Requests", ("path",))
+    counter.inc("/a")
+    counter.inc("/a", amount=2)
+    counter.inc('say "hi"\n')
+
+    assert counter.get("/a") == 3
+    assert list(counter.lines()) == [
+        'requests_total{path="/a"} 3',
+        'requests_total{path="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    assert list(histogram.lines()) == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_render_has_help_and_type_for_every_metric():
+    metrics = Metrics()
+    metrics.observe_query("get", 0.002, 1)
+
+    text = metrics.render()
+    assert "# TYPE barky_repository_query_seconds histogram\n" in text
+    assert 'barky_repository_rows_total{method="get"} 1\n' in text
+    assert text.count("# HELP") == len(metrics.metrics)
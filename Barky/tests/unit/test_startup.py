@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).parents[2] / "src"
+
+
+def run(code, cwd):
+    env = dict(os.environ, PYTHONPATH=str(SRC))
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True).stdout
+
+
+def test_importing_the_api_does_no_work(tmp_path):
+    (tmp_path / "run").mkdir()
+    out = run(
+        "import sys\n"
+        "import barkylib.api.flaskapi as flaskapi\n"
+        "print(flaskapi._bus is None, 'requests' in sys.modules, 'flask_sqlalchemy' in sys.modules)\n",
+        tmp_path / "run",
+    )
+
+    assert out.split() == ["True", "False", "False"]
+    # no engine was created, so no database file either
+    assert not (tmp_path / "bookmarks.db").exists()
+
+
+def test_create_app_bootstraps_once(tmp_path):
+    (tmp_path / "run").mkdir()
+    out = run(
+        "from barkylib.api import create_app, flaskapi\n"
+        "create_app()\n"
+        "bus = flaskapi.get_bus()\n"
+        "create_app()\n"
+        "print(flaskapi.get_bus() is bus)\n",
+        tmp_path / "run",
+    )
+
+    assert out.split() == ["True"]
+    assert (tmp_path / "bookmarks.db").exists()